@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""Usage: %prog [options]
+Measures the speed and memory of the CTW models.
+
+Each benchmark case runs in a new process, so its peak memory
+is not affected by the other cases.
+A case is named by its model, estimator and depth limit,
+e.g., "suffix-kt-8", "gain-determ-none" or "factored-kt-32".
+
+Example:
+$ benchmark.py -n 2000 --output results.json
+$ benchmark.py --case suffix-kt-8 --input README.txt
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import platform
+import resource
+import optparse
+import subprocess
+import timeit
+
+from libctw import ctw, factored, byting, instrumenting
+from libctw.anycontext import creating
+
+MODELS = ["suffix", "gain", "factored", "factored-gain"]
+ESTIMATORS = ["kt", "determ"]
+DEPTHS = [None, 8, 32]
+MARKOV_ORDER = 6
+# The length of the block of the repeated input.
+REPEATED_BLOCK_LEN = 256
+RESULTS_VERSION = 1
+PERCENTILES = [50, 90, 99]
+
+DEFAULTS = {
+        "num_bits": 1000,
+        "input": "markov",
+        "seed": 0,
+        "storage": "nodes",
+        "memory": 64,
+        }
+
+_timer = timeit.default_timer
+
+
+def _parse_args():
+    parser = optparse.OptionParser(__doc__)
+    parser.add_option("-n", dest="num_bits", type="int",
+            help="the number of input bits (default=%(num_bits)s)" % DEFAULTS)
+    parser.add_option("-i", "--input",
+            help="the synthetic input [markov|random|repeated] or a file with bytes (default=%(input)s)" % DEFAULTS)
+    parser.add_option("--seed", type="int",
+            help="the seed of the synthetic input (default=%(seed)s)" % DEFAULTS)
+    parser.add_option("-s", "--storage", choices=ctw.STORAGES,
+            help="store the context trees as Python objects, arrays, a fixed-size hash table or a path-compressed tree [nodes|arrays|hashed|compressed] (default=%(storage)s)" % DEFAULTS)
+    parser.add_option("-m", "--memory", type="int",
+            help="the MB of memory for each hashed context tree (default=%(memory)s)" % DEFAULTS)
+    parser.add_option("-c", "--case", action="append", dest="cases",
+            metavar="CASE", help="run only the given case, can be repeated")
+    parser.add_option("-o", "--output", metavar="FILE",
+            help="write the results as JSON to the file")
+    parser.add_option("--in-process", action="store_true",
+            help="run the cases in this process, the peak memory is then shared")
+    parser.add_option("--run-case", metavar="CASE", help=optparse.SUPPRESS_HELP)
+    parser.set_defaults(**DEFAULTS)
+
+    options, args = parser.parse_args()
+    if args:
+        parser.error("No arguments are expected.")
+    for name in options.cases or []:
+        try:
+            _parse_case(name)
+        except ValueError, e:
+            parser.error(str(e))
+    return options
+
+
+def get_case_names():
+    names = []
+    for model in MODELS:
+        for estimator in ESTIMATORS:
+            for depth in DEPTHS:
+                names.append(_format_case(model, estimator, depth))
+    return names
+
+
+def _format_case(model, estimator, depth):
+    return "%s-%s-%s" % (model, estimator, str(depth).lower())
+
+
+def _parse_case(name):
+    """Returns the (model, estimator, max_depth) of the named case.
+    """
+    parts = name.rsplit("-", 2)
+    if len(parts) != 3:
+        raise ValueError("Invalid case name: %s" % name)
+    model, estimator, depth = parts
+    if model not in MODELS:
+        raise ValueError("Unknown model: %s" % model)
+    if estimator not in ESTIMATORS:
+        raise ValueError("Unknown estimator: %s" % estimator)
+    if depth == "none":
+        return model, estimator, None
+    if not depth.isdigit():
+        raise ValueError("Invalid depth: %s" % depth)
+    return model, estimator, int(depth)
+
+
+def create_input(input, num_bits, seed=0):
+    """Returns a list of bits.
+    The bits of a file are used from its start.
+    """
+    rand = random.Random(seed)
+    if input == "random":
+        return [rand.randint(0, 1) for i in xrange(num_bits)]
+    elif input == "markov":
+        # The next bit is a fixed function of the previous bits,
+        # so the deterministic estimator can learn it too.
+        table = [rand.randint(0, 1) for i in xrange(2**MARKOV_ORDER)]
+        bits = [rand.randint(0, 1) for i in xrange(MARKOV_ORDER)]
+        while len(bits) < num_bits:
+            state = 0
+            for bit in bits[-MARKOV_ORDER:]:
+                state = (state << 1) | bit
+            bits.append(table[state])
+        return bits[:num_bits]
+    elif input == "repeated":
+        # A long repeated context, like a repeated text.
+        block = [rand.randint(0, 1) for i in xrange(REPEATED_BLOCK_LEN)]
+        return (block * (num_bits // len(block) + 1))[:num_bits]
+    else:
+        data = open(input, "rb").read((num_bits + 7) // 8)
+        return byting.to_bits(data)[:num_bits]
+
+
+def _create_model(model_name, estimator, max_depth, bits, options):
+    """Returns the model and the seconds spent by the context selection.
+    """
+    deterministic = estimator == "determ"
+    memory_budget = options.memory * 2**20
+    is_factored = model_name.startswith("factored")
+    if model_name.endswith("gain"):
+        # The bit positions are selected like by continue.py.
+        num_generated_bits = 8 if is_factored else 1
+        bits = bits[:len(bits) - len(bits) % num_generated_bits]
+        historian = creating.Historian(bits, num_generated_bits, 0)
+        start = _timer()
+        model = creating.create_model(historian,
+                factored=is_factored,
+                deterministic=deterministic,
+                max_depth=max_depth,
+                storage=options.storage,
+                memory_budget=memory_budget)
+        return model, _timer() - start
+    elif is_factored:
+        return factored.create_model(deterministic, max_depth,
+                storage=options.storage, memory_budget=memory_budget), 0.0
+    else:
+        return ctw.create_model(deterministic, max_depth,
+                storage=options.storage, memory_budget=memory_budget), 0.0
+
+
+def run_case(name, options):
+    """Runs the benchmark case in this process.
+    Returns a dict with the measurements.
+    """
+    model_name, estimator, max_depth = _parse_case(name)
+    bits = create_input(options.input, options.num_bits, options.seed)
+    start_rss = _get_peak_rss()
+    model, select_seconds = _create_model(model_name, estimator, max_depth,
+            bits, options)
+
+    predict_times = []
+    see_times = []
+    error = None
+    for bit in bits:
+        start = _timer()
+        model.predict_one()
+        predict_times.append(_timer() - start)
+
+        start = _timer()
+        try:
+            model.see_generated([bit])
+        except ctw.ImpossibleHistoryError, e:
+            error = str(e)
+            break
+        see_times.append(_timer() - start)
+
+    num_nodes = instrumenting.count_nodes(model)
+    revert_times = []
+    if error is None:
+        num_reverted = min(len(see_times), ctw.NUM_REVERTIBLE_BITS)
+        for i in xrange(num_reverted):
+            start = _timer()
+            model.revert_generated(1)
+            revert_times.append(_timer() - start)
+
+    result = dict(
+            case=name,
+            model=model_name,
+            estimator=estimator,
+            max_depth=max_depth,
+            num_bits=len(see_times),
+            num_nodes=num_nodes,
+            select_seconds=select_seconds,
+            see_generated=_summarize(see_times),
+            predict_one=_summarize(predict_times),
+            revert_generated=_summarize(revert_times),
+            peak_rss_kb=_get_peak_rss(),
+            rss_growth_kb=_get_peak_rss() - start_rss)
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def _summarize(times):
+    """Returns the throughput and the latency percentiles
+    in microseconds.
+    """
+    if not times:
+        return None
+    total = sum(times)
+    times = sorted(times)
+    summary = dict(
+            num_calls=len(times),
+            seconds=total,
+            calls_per_second=len(times) / max(total, 1e-12),
+            max_us=times[-1] * 1e6)
+    for percentile in PERCENTILES:
+        index = min(len(times) - 1, len(times) * percentile // 100)
+        summary["p%s_us" % percentile] = times[index] * 1e6
+    return summary
+
+
+def _get_peak_rss():
+    # The ru_maxrss is in kilobytes on Linux and in bytes on Mac OS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+def _run_in_subprocess(name, options):
+    args = [sys.executable, os.path.abspath(__file__),
+            "--run-case", name,
+            "-n", str(options.num_bits),
+            "--input", options.input,
+            "--seed", str(options.seed),
+            "--storage", options.storage,
+            "--memory", str(options.memory)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return dict(case=name, error="exit status %s" % process.returncode)
+    return json.loads(output)
+
+
+def _format_result(result):
+    if "see_generated" not in result:
+        return "%-26s %s" % (result["case"], result["error"])
+
+    see = result["see_generated"] or {}
+    predict = result["predict_one"] or {}
+    line = "%-26s %9.0f bits/s %9.0f predictions/s %9s nodes %8s KB" \
+            " see p50/p99 %7.1f/%7.1f us" % (
+            result["case"],
+            see.get("calls_per_second", 0),
+            predict.get("calls_per_second", 0),
+            result["num_nodes"],
+            result["rss_growth_kb"],
+            see.get("p50_us", 0), see.get("p99_us", 0))
+    if result["select_seconds"]:
+        line += " select %.2f s" % result["select_seconds"]
+    if "error" in result:
+        line += " stopped: %s" % result["error"].splitlines()[0]
+    return line
+
+
+def main():
+    options = _parse_args()
+    if options.run_case:
+        json.dump(run_case(options.run_case, options), sys.stdout)
+        return
+
+    names = options.cases or get_case_names()
+    results = []
+    for name in names:
+        if options.in_process:
+            result = run_case(name, options)
+        else:
+            result = _run_in_subprocess(name, options)
+        print _format_result(result)
+        sys.stdout.flush()
+        results.append(result)
+
+    if options.output:
+        report = dict(
+                version=RESULTS_VERSION,
+                created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                num_bits=options.num_bits,
+                input=options.input,
+                seed=options.seed,
+                storage=options.storage,
+                results=results)
+        output = open(options.output, "w")
+        try:
+            json.dump(report, output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
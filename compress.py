@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Usage: %prog [options] INPUT OUTPUT
+Compresses or decompresses a file with CTW predictions.
+Use '-' for stdin or stdout.
+
+Example:
+$ compress.py README.txt README.ctwz
+$ compress.py -d README.ctwz README.copy
+"""
+
+import sys
+import time
+import optparse
+
+from libctw import coding, ctw
+
+DEFAULTS = {
+        "depth": coding.DEFAULT_MAX_DEPTH,
+        "storage": "nodes",
+        "memory": 64,
+        }
+
+def _parse_args():
+    parser = optparse.OptionParser(__doc__)
+    parser.add_option("-d", "--decompress", action="store_true",
+            help="decompress the input")
+    parser.add_option("-D", "--depth", type="int",
+            help="limit max depth of the context trees, 0 for no limit (default=%(depth)s)" % DEFAULTS)
+    parser.add_option("-1", "--single-tree", action="store_true",
+            help="use one context tree instead of a tree per bit position")
+    parser.add_option("-s", "--storage", choices=ctw.STORAGES,
+            help="store the context trees as Python objects, arrays or a fixed-size hash table [nodes|arrays|hashed] (default=%(storage)s)" % DEFAULTS)
+    parser.add_option("-m", "--memory", type="int",
+            help="the MB of memory for each hashed context tree (default=%(memory)s)" % DEFAULTS)
+    parser.set_defaults(**DEFAULTS)
+
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("An input and an output are expected.")
+    return options, args
+
+
+def _open(filename, mode, std_file):
+    if filename == "-":
+        return std_file
+    return open(filename, mode)
+
+
+def main():
+    options, (input_name, output_name) = _parse_args()
+    input = _open(input_name, "rb", sys.stdin)
+    output = _open(output_name, "wb", sys.stdout)
+
+    start = time.time()
+    if options.decompress:
+        num_compressed, num_original = coding.decompress(input, output)
+    else:
+        max_depth = options.depth or None
+        num_original, num_compressed = coding.compress(input, output,
+                max_depth=max_depth,
+                factored=not options.single_tree,
+                storage=options.storage,
+                memory_budget=options.memory * 2**20)
+    output.flush()
+    duration = time.time() - start
+
+    bits_per_byte = 8.0 * num_compressed / max(1, num_original)
+    sys.stderr.write("original %s B, compressed %s B, %.3f bits per byte, "
+            "%.4f MB/s\n" % (num_original, num_compressed, bits_per_byte,
+                num_original / 1e6 / max(duration, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
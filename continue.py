@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 """Usage: %prog BINARY_SEQUENCE
+       %prog --input FILE
 Continues the given binary sequence with the best guess.
 
 Example:
@@ -12,12 +13,18 @@ import sys
 import optparse
 import logging
 
-from libctw import modeling, byting, formatting
+from libctw import modeling, byting, formatting, ctw, storing, streaming
+from libctw import searching, extracting
+from libctw import factored
 from libctw.anycontext import creating
 
 DEFAULTS = {
         "num_predicted_bits": 100,
         "estimator": "kt",
+        "storage": "nodes",
+        "memory": 64,
+        "jobs": 1,
+        "top": 1,
         "verbose": 0,
         }
 
@@ -29,16 +36,42 @@ def _parse_args():
             help="limit max depth of the suffix tree model")
     parser.add_option("-e", "--estimator", choices=["kt", "determ"],
             help="use Krichevski-Trofimov or deterministic prior [kt|determ] (default=%(estimator)s)" % DEFAULTS)
+    parser.add_option("-s", "--storage", choices=ctw.STORAGES,
+            help="store the context tree as Python objects, arrays, a fixed-size hash table or a path-compressed tree [nodes|arrays|hashed|compressed] (default=%(storage)s)" % DEFAULTS)
+    parser.add_option("-m", "--memory", type="int",
+            help="the MB of memory for each hashed context tree (default=%(memory)s)" % DEFAULTS)
     parser.add_option("-b", "--bytes", action="store_true",
             help="accept and predict a sequence of bytes")
     parser.add_option("-g", "--gain", action="store_true",
             help="use information gain for context selection")
+    parser.add_option("-j", "--jobs", type="int",
+            help="select the --gain contexts by the given number of processes (default=%(jobs)s)" % DEFAULTS)
+    parser.add_option("--beam", type="int", metavar="WIDTH",
+            help="find the most probable continuations by a beam search")
+    parser.add_option("--top", type="int",
+            help="print the given number of the best --beam continuations (default=%(top)s)" % DEFAULTS)
+    parser.add_option("--save", metavar="FILE",
+            help="save the trained model to the file")
+    parser.add_option("--load", metavar="FILE",
+            help="use a saved model, the sequence is seen after its history")
+    parser.add_option("-i", "--input", metavar="FILE",
+            help="stream the sequence from the file or '-' for stdin"
+            " and write a bit and its P per line")
     parser.add_option("-v", "--verbose", action="count",
             help="increase verbosity")
     parser.set_defaults(**DEFAULTS)
 
     options, args = parser.parse_args()
     _set_logging(options.verbose)
+    if options.input is not None:
+        if args:
+            parser.error("No sequence is expected with --input.")
+        if options.gain:
+            parser.error("The --gain selection needs the whole sequence.")
+        if options.beam is not None:
+            parser.error("The --beam search is not supported with --input.")
+        return options, None
+
     if len(args) != 1:
         parser.error("A sequence is expected.")
 
@@ -66,11 +99,14 @@ def _round_up(value, base):
 
 
 def _create_history(options, input_seq):
+    """Returns the bits of the input.
+    The bytes are kept packed in the history.
+    """
     if options.bytes:
-        seq = byting.to_binseq(input_seq)
-    else:
-        seq = input_seq
-    return formatting.to_bits(seq)
+        history = extracting.PackedHistory()
+        history.extend_bytes(input_seq)
+        return history
+    return formatting.to_bits(input_seq)
 
 
 def _create_model(options, history):
@@ -91,21 +127,91 @@ def _create_model(options, history):
             factored=factored,
             deterministic=deterministic,
             max_depth=options.depth,
-            min_var_index=min_var_index)
+            min_var_index=min_var_index,
+            storage=options.storage,
+            memory_budget=options.memory * 2**20,
+            num_processes=options.jobs)
 
     model.see_generated(history)
     return model
 
 
+def _create_streamed_model(options):
+    deterministic = options.estimator == "determ"
+    memory_budget = options.memory * 2**20
+    if options.bytes:
+        return factored.create_model(deterministic, options.depth,
+                storage=options.storage, memory_budget=memory_budget)
+    else:
+        return ctw.create_model(deterministic, options.depth,
+                storage=options.storage, memory_budget=memory_budget)
+
+
+def _get_num_predicted_bits(options):
+    if options.bytes:
+        return _round_up(options.num_predicted_bits, 8)
+    else:
+        return options.num_predicted_bits
+
+
+def _stream(options):
+    if options.load:
+        model = storing.load(options.load)
+    else:
+        model = _create_streamed_model(options)
+
+    if options.input == "-":
+        input = sys.stdin
+    else:
+        input = open(options.input, "rb")
+
+    try:
+        bit_chunks = streaming.iter_bit_chunks(
+                streaming.read_chunks(input), options.bytes)
+        streaming.train(model, bit_chunks)
+    finally:
+        input.close()
+
+    if options.save:
+        storing.save(model, options.save)
+
+    predictions = streaming.iter_predictions(model,
+            _get_num_predicted_bits(options))
+    streaming.write_predictions(sys.stdout, predictions, options.bytes)
+
+
+def _print_searched(options, model, history, input_seq, num_predicted_bits):
+    results = searching.search(model, num_predicted_bits,
+            beam_width=options.beam, num_results=options.top)
+    for bits, probability in results:
+        seq = formatting.to_seq(bits)
+        print "%s -> %s" % (formatting.to_seq(history), seq)
+        if options.bytes:
+            print "%s -> %s" % (input_seq, byting.to_bytes(seq))
+        print "with P = %f" % probability
+
+
 def main():
     options, input_seq = _parse_args()
-    history = _create_history(options, input_seq)
-    model = _create_model(options, history)
+    if options.input is not None:
+        _stream(options)
+        return
 
-    if options.bytes:
-        num_predicted_bits = _round_up(options.num_predicted_bits, 8)
+    history = _create_history(options, input_seq)
+    if options.load:
+        model = storing.load(options.load)
+        model.see_generated(history)
     else:
-        num_predicted_bits = options.num_predicted_bits
+        model = _create_model(options, history)
+
+    if options.save:
+        storing.save(model, options.save)
+
+    num_predicted_bits = _get_num_predicted_bits(options)
+    if options.beam is not None:
+        _print_searched(options, model, history, input_seq,
+                num_predicted_bits)
+        return
 
     probs = []
     bits = ""
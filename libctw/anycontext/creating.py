@@ -1,4 +1,6 @@
 
+import multiprocessing
+
 from libctw import ctw, extracting
 from libctw import factored as _factored
 from libctw.anycontext import selecting
@@ -6,36 +8,71 @@ from libctw.anycontext import selecting
 SUFFIXES_ONLY = 0
 
 def create_model(historian, factored=False, deterministic=False,
-        max_depth=None, min_var_index=None):
+        max_depth=None, min_var_index=None, storage="nodes",
+        memory_budget=None, num_processes=1):
+    """Creates a model with contexts selected for the given history.
+    The memory budget is used by each context tree
+    of the "hashed" storage.
+    The contexts are selected by the given number of processes,
+    or by a process per CPU if num_processes is None.
+    The selected contexts don't depend on the number of processes.
+    """
+    history = historian.get_history()
     if factored:
-        factors = []
-        for positions in historian.get_factored_positions():
-            root_var = selecting.select_vartree(
-                    historian.get_history(),
-                    positions,
-                    min_index=min_var_index)
-            factors.append(_create_factor(root_var, deterministic, max_depth))
+        all_positions = historian.get_factored_positions()
+    else:
+        all_positions = [historian.get_generated_positions()]
+
+    if num_processes == 1:
+        root_vars = [selecting.select_vartree(history, positions,
+            min_index=min_var_index) for positions in all_positions]
+    else:
+        root_vars = _select_in_parallel(history, all_positions,
+                min_var_index, num_processes)
 
+    factors = [_create_factor(root_var, deterministic, max_depth, storage,
+        memory_budget) for root_var in root_vars]
+    if factored:
         return _factored.create_factored_model(factors)
     else:
-        positions = historian.get_generated_positions()
-        root_var = selecting.select_vartree(
-                historian.get_history(),
-                positions,
-                min_index=min_var_index)
-        return _create_factor(root_var, deterministic, max_depth)
+        return factors[0]
 
 
-def _create_factor(root_var, deterministic, max_depth):
+def _select_in_parallel(history, all_positions, min_var_index,
+        num_processes):
+    """Selects the var trees on a pool of processes.
+    A single tree is split to subtrees.
+    Many trees are selected by separate processes.
+    """
+    pool = multiprocessing.Pool(num_processes)
+    try:
+        if len(all_positions) == 1:
+            return [selecting.select_vartree(history, all_positions[0],
+                min_index=min_var_index, pool=pool)]
+
+        results = [pool.apply_async(selecting.select_vartree,
+            (history, positions, min_var_index))
+            for positions in all_positions]
+        return [result.get() for result in results]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _create_factor(root_var, deterministic, max_depth, storage,
+        memory_budget):
     extractor = extracting.VarExtractor(root_var, max_depth)
     return ctw.create_context_based_model(extractor,
-            deterministic=deterministic)
+            deterministic=deterministic, storage=storage,
+            memory_budget=memory_budget)
 
 
 class Historian:
     """It assumes that the history consists of many steps.
     Each step has a fixed number of generated bits,
     followed by a fixed number of added bits.
+    The positions and steps are returned as lazy views
+    of the steps present at the time of the call.
     """
     def __init__(self, history, num_generated_bits, num_added_bits):
         assert len(history) % (num_generated_bits + num_added_bits) == 0
@@ -46,41 +83,93 @@ class Historian:
     def get_history(self):
         return self.history
 
+    def append_step(self, generated, added=()):
+        """Appends the bits of a new step to the history.
+        """
+        if (len(generated) != self.num_generated_bits or
+                len(added) != self.num_added_bits):
+            raise ValueError("Expecting %s generated and %s added bits." % (
+                self.num_generated_bits, self.num_added_bits))
+        self.history += generated
+        self.history += added
+
     def get_generated_positions(self):
-        positions = []
-        for start in self._get_step_starts():
-            for i in xrange(self.num_generated_bits):
-                positions.append(start + i)
-        return positions
+        step_len = self._get_step_len()
+        if self.num_added_bits == 0:
+            return xrange(self._get_num_steps() * step_len)
+        return _StepPositions(step_len, self.num_generated_bits,
+                self._get_num_steps())
 
     def get_factored_positions(self):
-        on_factors = []
-        for i in xrange(self.num_generated_bits):
-            positions = []
-            for start in self._get_step_starts(offset=i):
-                positions.append(start)
-
-            on_factors.append(positions)
-        return on_factors
+        step_len = self._get_step_len()
+        end = self._get_num_steps() * step_len
+        return [xrange(i, end, step_len)
+                for i in xrange(self.num_generated_bits)]
 
     def get_steps(self):
         """Returns (generated, added) bits for each step.
         """
-        steps = []
-        for start in self._get_step_starts():
-            generated_end = start + self.num_generated_bits
-            added_start = generated_end
-            added_end = added_start + self.num_added_bits
-            generated = self.history[start:generated_end]
-            added = self.history[added_start:added_end]
-            steps.append((generated, added))
+        return _Steps(self.history, self.num_generated_bits,
+                self.num_added_bits, self._get_num_steps())
 
-        return steps
+    def _get_step_len(self):
+        return self.num_generated_bits + self.num_added_bits
 
-    def _get_step_starts(self, offset=0):
-        step_len = self.num_generated_bits + self.num_added_bits
-        num_steps = len(self.history) // step_len
-        return [offset + i * step_len for i in xrange(num_steps)]
+    def _get_num_steps(self):
+        return len(self.history) // self._get_step_len()
 
 
+class _StepPositions:
+    """The positions of the generated bits of the given number of steps.
+    """
+    def __init__(self, step_len, num_generated_bits, num_steps):
+        self.step_len = step_len
+        self.num_generated_bits = num_generated_bits
+        self.length = num_generated_bits * num_steps
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("position index out of range: %s" % index)
+        step, offset = divmod(index, self.num_generated_bits)
+        return step * self.step_len + offset
+
+    def __iter__(self):
+        for start in xrange(0, self.length // self.num_generated_bits *
+                self.step_len, self.step_len):
+            for position in xrange(start, start + self.num_generated_bits):
+                yield position
 
+
+class _Steps:
+    """The (generated, added) bits of the given number of steps.
+    The bits are sliced from the history on access.
+    """
+    def __init__(self, history, num_generated_bits, num_added_bits,
+            num_steps):
+        self.history = history
+        self.num_generated_bits = num_generated_bits
+        self.num_added_bits = num_added_bits
+        self.num_steps = num_steps
+
+    def __len__(self):
+        return self.num_steps
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.num_steps
+        if not 0 <= index < self.num_steps:
+            raise IndexError("step index out of range: %s" % index)
+        start = index * (self.num_generated_bits + self.num_added_bits)
+        generated_end = start + self.num_generated_bits
+        added_end = generated_end + self.num_added_bits
+        return (self.history[start:generated_end],
+                self.history[generated_end:added_end])
+
+    def __iter__(self):
+        for index in xrange(self.num_steps):
+            yield self[index]
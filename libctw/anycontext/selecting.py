@@ -1,13 +1,20 @@
 
 import math
 import logging
+import bisect
 
 from libctw import extracting
 
-def select_vartree(history, positions, min_index=None, vartree_max_depth=3):
+# The subtrees at this depth are built in parallel, if a pool is given.
+PARALLEL_DEPTH = 2
+
+def select_vartree(history, positions, min_index=None, vartree_max_depth=3,
+        pool=None):
     """Returns a tree of vars.
     The selected vars should be helpful in classifying
     the bits on the given positions.
+    With a multiprocessing pool, the subtrees are built in parallel.
+    The result is the same as without the pool.
     """
     if not positions:
         return None
@@ -19,21 +26,47 @@ def select_vartree(history, positions, min_index=None, vartree_max_depth=3):
 
     var_indexes = range(-1, min_index - 1, -1)
     logging.info("building tree for factor %s", positions[0])
-    return _TreeBuilder(history, vartree_max_depth).build_tree(
-            positions, var_indexes)
+    builder = _TreeBuilder(history, vartree_max_depth, pool)
+    return _wait_for_subtrees(builder.build_tree(positions, var_indexes))
+
+
+def _build_subtree(history, max_depth, positions, var_indexes, depth):
+    return _TreeBuilder(history, max_depth).build_tree(positions,
+            var_indexes, depth)
+
+
+def _wait_for_subtrees(tree):
+    """Replaces the pending results of the pool by the built subtrees.
+    """
+    if tree is None:
+        return None
+    if not isinstance(tree, extracting.Var):
+        return tree.get()
+
+    tree.children = tuple(_wait_for_subtrees(child)
+            for child in tree.children)
+    return tree
 
 
 class _TreeBuilder:
-    def __init__(self, history, max_depth):
+    def __init__(self, history, max_depth, pool=None):
         self.history = history
         self.max_depth = max_depth
+        self.pool = pool
+        self.correlator = _Correlator(history)
 
     def build_tree(self, positions, var_indexes, depth=0):
+        """Returns the built tree.
+        The subtrees built by the pool are returned as pending results.
+        """
         if self.max_depth is not None and depth > self.max_depth:
             return None
+        if self.pool is not None and depth == PARALLEL_DEPTH:
+            return self.pool.apply_async(_build_subtree, (self.history,
+                self.max_depth, positions, var_indexes, depth))
 
         var_index, on_0, on_1 = _choose_split(self.history, positions,
-                var_indexes)
+                var_indexes, self.correlator)
         if var_index != -(depth + 1):
             logging.debug("best var at %s: %s", depth, var_index)
         if var_index is None:
@@ -48,27 +81,93 @@ class _TreeBuilder:
         return extracting.Var(var_index, children)
 
 
-def _choose_split(history, positions, var_indexes):
+def _choose_split(history, positions, var_indexes, correlator=None):
     """Select the best predictor of the bit on the given positions.
     The index of the predictor is an index in the history (e.g., -1).
     Returns (var_index, positions_with_0_in_var, positions_with_1_in_var).
+
+    The branch sizes of all vars are counted in bulk by the correlator,
+    so a var is evaluated in constant time.
     """
+    if correlator is None:
+        correlator = _Correlator(history)
+    positives = [pos for pos in positions if history[pos]]
+    ones_on = correlator.count_ones(positions)
+    ones_on_positives = correlator.count_ones(positives)
+    sorted_positions = sorted(positions)
+    sorted_positives = sorted(positives)
+
     best_var_index = None
-    best_on_0 = None
-    best_on_1 = None
     min_complexity = None
     for var_index in var_indexes:
-        on_0 = _filter_poss(history, positions, var_index, 0)
-        on_1 = _filter_poss(history, positions, var_index, 1)
-        complexity = (_get_complexity(history, on_0) +
-                _get_complexity(history, on_1))
+        lag = -var_index
+        # The positions before the lag miss the var.
+        # They are counted in both branches, as in _filter_poss().
+        num_missing = bisect.bisect_left(sorted_positions, lag)
+        num_missing_positive = bisect.bisect_left(sorted_positives, lag)
+        complexity = (
+                _get_complexity(len(positions) - ones_on[lag],
+                    len(positives) - ones_on_positives[lag]) +
+                _get_complexity(ones_on[lag] + num_missing,
+                    ones_on_positives[lag] + num_missing_positive))
         if min_complexity is None or complexity < min_complexity:
             min_complexity = complexity
             best_var_index = var_index
-            best_on_0 = on_0
-            best_on_1 = on_1
 
-    return best_var_index, best_on_0, best_on_1
+    if best_var_index is None:
+        return None, None, None
+    return (best_var_index,
+            _filter_poss(history, positions, best_var_index, 0),
+            _filter_poss(history, positions, best_var_index, 1))
+
+
+class _Correlator:
+    """Counts the ones in the history at every lag before given positions.
+    The history bits and the positions are packed into fields
+    of two long integers. The coefficients of their product
+    are then the counts for all lags.
+    CPython multiplies long integers with the Karatsuba algorithm,
+    so it is faster than counting the lags one by one.
+    """
+    def __init__(self, history):
+        self.length = len(history)
+        # A field has to hold a count of up to len(history) positions.
+        self.num_digits = len("%x" % self.length) + 1
+        self.zero = "0" * self.num_digits
+        self.one = self.zero[:-1] + "1"
+        # The history is packed in the reversed order.
+        self.packed_history = _parse_hex("".join(
+            self.one if bit else self.zero for bit in history))
+
+    def count_ones(self, positions):
+        """Returns a list with the number of ones
+        on the history[pos - lag] for the given unique positions.
+        The list is indexed by the lag, from 0 to len(history).
+        """
+        num_lags = self.length + 1
+        if not positions:
+            return [0] * num_lags
+
+        max_pos = max(positions)
+        fields = [self.zero] * (max_pos + 1)
+        for pos in positions:
+            fields[max_pos - pos] = self.one
+        product = _parse_hex("".join(fields)) * self.packed_history
+
+        # The count for the lag is in the field (len(history) - 1 + lag).
+        field_bits = 4 * self.num_digits
+        counts = "%x" % (product >> (field_bits * (self.length - 1)))
+        counts = counts.zfill(self.num_digits * num_lags)[
+                -self.num_digits * num_lags:]
+        num_digits = self.num_digits
+        return [int(counts[start - num_digits:start], 16)
+                for start in xrange(len(counts), 0, -num_digits)]
+
+
+def _parse_hex(digits):
+    if not digits:
+        return 0L
+    return long(digits, 16)
 
 
 def _filter_poss(history, positions, var_index, needed_value):
@@ -86,20 +185,15 @@ def _filter_poss(history, positions, var_index, needed_value):
     return matching
 
 
-def _get_complexity(history, positions):
+def _get_complexity(num_positions, num_positive):
     """Returns the expected number of bits
     needed to encode the sequence.
     """
-    num_positive = _count_positive(history, positions)
-    if num_positive == 0 or num_positive == len(positions):
+    if num_positive == 0 or num_positive == num_positions:
         return 0.0
 
-    p = num_positive / float(len(positions))
-    return len(positions) * _entropy(p)
-
-
-def _count_positive(history, positions):
-    return sum(history[pos] for pos in positions)
+    p = num_positive / float(num_positions)
+    return num_positions * _entropy(p)
 
 
 def _entropy(p):
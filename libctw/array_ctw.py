@@ -0,0 +1,268 @@
+"""A context tree stored in flat typed arrays.
+
+A node is an index into the arrays. It takes 40 bytes,
+instead of the hundreds of bytes needed by a _Node object
+with its own dict, counts list and children list.
+"""
+
+from array import array
+import copy
+
+from libctw import ctw, extracting
+from libctw.ctw import LOG_ONE, LOG_ONE_HALF, LOG_ZERO
+
+ROOT = 0
+# The root is never a child, so its index marks a missing child.
+NO_CHILD = ROOT
+
+
+class _ArrayCtModel(ctw._CtModel):
+    def __init__(self, estim_update, context_extractor):
+        """Creates a Context Tree model with an array-backed tree.
+        """
+        self.estim_update = estim_update
+        self.extractor = context_extractor
+        self.history = self._create_history()
+        self.nodes = _NodeArrays()
+
+    def fork(self):
+        """Returns a copy-on-write copy of the model.
+        The fork keeps its changes of the columns in overlays.
+        The model must not be modified while its forks are used.
+        """
+        forked = copy.copy(self)
+        forked.history = extracting.OverlayHistory(self.history)
+        forked.nodes = self.nodes.fork()
+        return forked
+
+    def _get_context_path(self, context, save_nodes=False):
+        """Returns a list of node indexes from the root
+        to the start of the context.
+        The missing nodes are always created.
+        A detached node could not be addressed by an index.
+        """
+        children = self.nodes.children
+        path = [ROOT]
+        node = ROOT
+        for bit in context:
+            child = children[bit][node]
+            if child == NO_CHILD:
+                child = self.nodes.add_node()
+                children[bit][node] = child
+
+            path.append(child)
+            node = child
+
+        return path
+
+    def _get_existing_path(self, context):
+        children = self.nodes.children
+        path = [ROOT]
+        node = ROOT
+        for bit in context:
+            node = children[bit][node]
+            if node == NO_CHILD:
+                break
+            path.append(node)
+
+        return path
+
+    def _calc_log_pw_after(self, path, context, bit):
+        nodes = self.nodes
+        depth = self._get_path_depth(path, context)
+        log_pw = ctw._calc_new_path_log_pw(depth + 1 - len(path), bit,
+                self.estim_update)
+        for i in xrange(len(path) - 1, -1, -1):
+            node = path[i]
+            log_p_estim = nodes.log_p_estim[node] + self.estim_update(bit,
+                    nodes.get_counts(node))
+            if i == depth:
+                child0 = nodes.get_child(node, 0)
+                child1 = nodes.get_child(node, 1)
+                if child0 == NO_CHILD and child1 == NO_CHILD:
+                    log_pw = log_p_estim
+                else:
+                    childrens_log_p = (nodes.get_log_pw(child0) +
+                            nodes.get_log_pw(child1) +
+                            nodes.log_p_uncovered[node] + LOG_ONE_HALF)
+                    log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+            else:
+                if i + 1 < len(path):
+                    child_bit = int(nodes.get_child(node, 1) == path[i + 1])
+                else:
+                    child_bit = context[i]
+                sibling = nodes.get_child(node, 1 - child_bit)
+                childrens_log_p = (log_pw + nodes.get_log_pw(sibling) +
+                        nodes.log_p_uncovered[node])
+                log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+
+        return log_pw
+
+    def _update_path(self, path, bit):
+        nodes = self.nodes
+        log_p_estim = nodes.log_p_estim
+        counts = nodes.counts
+        nodes.log_p_uncovered[path[-1]] += LOG_ONE_HALF
+
+        for node in reversed(path):
+            log_p_estim[node] += self.estim_update(bit, nodes.get_counts(node))
+            counts[bit][node] += 1
+            nodes.recalculate_pw(node)
+
+    def _revert_path(self, path, bit):
+        nodes = self.nodes
+        log_p_estim = nodes.log_p_estim
+        counts = nodes.counts
+        nodes.log_p_uncovered[path[-1]] -= LOG_ONE_HALF
+
+        for node in reversed(path):
+            counts[bit][node] -= 1
+            node_counts = nodes.get_counts(node)
+            decrement = self.estim_update(bit, node_counts)
+            if decrement == LOG_ZERO:
+                log_p_estim[node] = ctw._recalculate_log_p_estim(node_counts,
+                        self.estim_update)
+            else:
+                log_p_estim[node] -= decrement
+            nodes.recalculate_pw(node)
+
+    def get_history_log_p(self):
+        return self.nodes.log_pw[ROOT]
+
+
+# The names and typecodes of the node columns.
+COLUMNS = [
+        ("log_p_estim", "d"),
+        ("log_pw", "d"),
+        ("log_p_uncovered", "d"),
+        ("counts0", "I"),
+        ("counts1", "I"),
+        ("children0", "I"),
+        ("children1", "I"),
+        ]
+
+
+class _NodeArrays:
+    """Columns of node fields.
+    The i-th item of each column belongs to the i-th node.
+    """
+    # The attributes with a column or a tuple of columns.
+    COLUMN_ATTRS = ["log_p_estim", "log_pw", "log_p_uncovered", "counts",
+            "children"]
+
+    def __init__(self, columns=None):
+        """Creates columns with just the root node.
+        Existing columns could be given instead, in the COLUMNS order.
+        """
+        if columns is None:
+            columns = [array(typecode) for name, typecode in COLUMNS]
+            _init_columns(self, columns)
+            self.add_node()
+        else:
+            _init_columns(self, columns)
+
+    def get_columns(self):
+        """Returns the columns in the COLUMNS order.
+        """
+        return ([self.log_p_estim, self.log_pw, self.log_p_uncovered] +
+                list(self.counts) + list(self.children))
+
+    def __len__(self):
+        return len(self.log_pw)
+
+    def fork(self):
+        """Returns a copy with overlays of the columns.
+        The columns are not copied.
+        """
+        forked = copy.copy(self)
+        for name in self.COLUMN_ATTRS:
+            columns = getattr(self, name)
+            if isinstance(columns, tuple):
+                overlay = tuple(_OverlayColumn(column) for column in columns)
+            else:
+                overlay = _OverlayColumn(columns)
+            setattr(forked, name, overlay)
+        return forked
+
+    def add_node(self):
+        """Appends a new node and returns its index.
+        """
+        node = len(self.log_pw)
+        self.log_p_estim.append(LOG_ONE)
+        self.log_pw.append(LOG_ONE)
+        self.log_p_uncovered.append(LOG_ONE)
+        for column in self.counts + self.children:
+            column.append(0)
+        return node
+
+    def get_child(self, node, bit):
+        return self.children[bit][node]
+
+    def get_counts(self, node):
+        return [self.counts[0][node], self.counts[1][node]]
+
+    def recalculate_pw(self, node):
+        """Recalculates the weighted probability of the node.
+        """
+        child0 = self.get_child(node, 0)
+        child1 = self.get_child(node, 1)
+        # No weighting is used, if the node has no children.
+        if child0 == NO_CHILD and child1 == NO_CHILD:
+            self.log_pw[node] = self.log_p_estim[node]
+        else:
+            childrens_log_p = (self.get_log_pw(child0) +
+                    self.get_log_pw(child1) +
+                    self.log_p_uncovered[node])
+            self.log_pw[node] = ctw._avg_log_p(self.log_p_estim[node],
+                    childrens_log_p)
+
+    def get_log_pw(self, node):
+        if node == NO_CHILD:
+            return LOG_ONE
+        return self.log_pw[node]
+
+
+class _OverlayColumn:
+    """A column continuing a base column without modifying it.
+    The changed and appended items are kept in a dict.
+    """
+    def __init__(self, base):
+        self.base = base
+        self.num_base = len(base)
+        self.length = self.num_base
+        self.changes = {}
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("column index out of range: %s" % index)
+        try:
+            return self.changes[index]
+        except KeyError:
+            return self.base[index]
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("column index out of range: %s" % index)
+        self.changes[index] = value
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self[index]
+
+    def append(self, value):
+        self.changes[self.length] = value
+        self.length += 1
+
+
+def _init_columns(nodes, columns):
+    (nodes.log_p_estim, nodes.log_pw, nodes.log_p_uncovered,
+            counts0, counts1, children0, children1) = columns
+    nodes.counts = (counts0, counts1)
+    nodes.children = (children0, children1)
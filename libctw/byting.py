@@ -1,27 +1,44 @@
+"""Conversions between bytes and bits.
+
+The conversions look up whole bytes in precomputed tables.
+The highest bit of a byte goes first.
+The bytes could be given as a str, bytearray, buffer or memoryview.
+"""
+
+import itertools
+
+# The bits of each byte value.
+BYTE_BITS = [tuple((value >> i) & 1 for i in xrange(7, -1, -1))
+        for value in xrange(256)]
+_BYTE_SEQS = ["".join("01"[bit] for bit in bits) for bits in BYTE_BITS]
+_SEQ_BYTES = dict((seq, chr(value)) for value, seq in enumerate(_BYTE_SEQS))
+_BITS_BYTES = dict((bits, chr(value)) for value, bits in enumerate(BYTE_BITS))
 
 
 def to_binseq(bytes):
-    seq = []
-    for byte in bytes:
-        value = ord(byte)
-        for i in xrange(7, -1, -1):
-            one = value & 2**i
-            seq.append("1" if one else "0")
+    """Returns a string of 0s and 1s.
+    """
+    return "".join(map(_BYTE_SEQS.__getitem__, bytearray(bytes)))
+
+
+def to_bytes(seq):
+    """Returns the bytes of a string of 0s and 1s.
+    """
+    assert len(seq) % 8 == 0
+    return "".join([_SEQ_BYTES[seq[index:index + 8]]
+        for index in xrange(0, len(seq), 8)])
+
 
-    return "".join(seq)
+def to_bits(bytes):
+    """Returns a list of the bits of the bytes.
+    """
+    return list(itertools.chain.from_iterable(
+        map(BYTE_BITS.__getitem__, bytearray(bytes))))
 
 
-def to_bytes(bits):
+def from_bits(bits):
+    """Returns the bytes of a list of bits.
+    """
     assert len(bits) % 8 == 0
-    bytes = []
-    index = 0
-    while index < len(bits):
-        value = 0
-        for i in xrange(7, -1, -1):
-            if bits[index + (7 - i)] == "1":
-                value |= 2**i
-
-        bytes.append(chr(value))
-        index += 8
-
-    return "".join(bytes)
+    return "".join([_BITS_BYTES[tuple(bits[index:index + 8])]
+        for index in xrange(0, len(bits), 8)])
@@ -0,0 +1,277 @@
+"""Compression by arithmetic coding with CTW predictions.
+
+The binary arithmetic coder is the classic one from:
+"Arithmetic Coding for Data Compression"
+Ian H. Witten, Radford M. Neal, John G. Cleary
+
+The compressed stream starts with a header describing the model.
+Each byte is preceded by a flag bit saying that more bytes follow.
+The flag bit is coded with a fixed, nearly certain probability,
+so the input length doesn't have to be known in advance.
+"""
+
+import struct
+
+from libctw import ctw, byting, factored as _factored
+
+MAGIC = "CTWZ"
+FORMAT_VERSION = 1
+DEFAULT_MAX_DEPTH = 16
+CHUNK_SIZE = 64 * 1024
+_HEADER = struct.Struct("<4sBBBHQ")
+_NO_DEPTH = 0xffff
+
+_CODE_BITS = 32
+_MAX_CODE = 2**_CODE_BITS - 1
+_HALF = 2**(_CODE_BITS - 1)
+_QUARTER = 2**(_CODE_BITS - 2)
+# The probabilities are quantized to integers of this precision.
+_PROB_BITS = 16
+_PROB_SCALE = 2**_PROB_BITS
+_MORE_BYTES_P = 1 - 1.0 / _PROB_SCALE
+
+
+def compress(input, output, max_depth=DEFAULT_MAX_DEPTH, factored=True,
+        storage="nodes", memory_budget=0):
+    """Compresses the input file to the output file.
+    The bytes are predicted by a factored model with a tree per bit position,
+    or by a single context tree.
+    Returns the number of (input, output) bytes.
+    """
+    depth_field = _NO_DEPTH if max_depth is None else max_depth
+    output.write(_HEADER.pack(MAGIC, FORMAT_VERSION, int(factored),
+        ctw.STORAGES.index(storage), depth_field, memory_budget))
+    model = _create_model(factored, storage, max_depth, memory_budget)
+    writer = _BitWriter(output)
+    encoder = _Encoder(writer)
+    num_input_bytes = 0
+    while True:
+        chunk = input.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        for byte in chunk:
+            encoder.encode(1, _MORE_BYTES_P)
+            for bit in byting.BYTE_BITS[ord(byte)]:
+                encoder.encode(bit, model.predict_one())
+                model.see_generated([bit])
+        num_input_bytes += len(chunk)
+
+    encoder.encode(0, _MORE_BYTES_P)
+    encoder.finish()
+    writer.flush()
+    return num_input_bytes, _HEADER.size + writer.num_bytes
+
+
+def decompress(input, output):
+    """Decompresses the input file to the output file.
+    Returns the number of (input, output) bytes.
+    """
+    header = input.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise ValueError("Missing header.")
+    magic, version, factored, storage_index, depth_field, memory_budget = (
+            _HEADER.unpack(header))
+    if magic != MAGIC:
+        raise ValueError("Not a compressed stream.")
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported format version: %s" % version)
+
+    max_depth = None if depth_field == _NO_DEPTH else depth_field
+    model = _create_model(factored, ctw.STORAGES[storage_index], max_depth,
+            memory_budget)
+    reader = _BitReader(input)
+    decoder = _Decoder(reader)
+    chunk = []
+    num_output_bytes = 0
+    while decoder.decode(_MORE_BYTES_P):
+        value = 0
+        for i in xrange(8):
+            bit = decoder.decode(model.predict_one())
+            model.see_generated([bit])
+            value = (value << 1) | bit
+
+        chunk.append(chr(value))
+        if len(chunk) == CHUNK_SIZE:
+            output.write("".join(chunk))
+            num_output_bytes += len(chunk)
+            chunk = []
+
+    output.write("".join(chunk))
+    num_output_bytes += len(chunk)
+    return _HEADER.size + reader.num_bytes, num_output_bytes
+
+
+def _create_model(factored, storage, max_depth, memory_budget):
+    memory_budget = memory_budget or None
+    if factored:
+        return _factored.create_model(max_depth=max_depth, storage=storage,
+                memory_budget=memory_budget)
+    return ctw.create_model(max_depth=max_depth, storage=storage,
+            memory_budget=memory_budget)
+
+
+def _get_zero_scale(one_p):
+    """Returns the quantized P(bit=0).
+    Both bits keep a non-zero probability.
+    """
+    one_scale = int(one_p * _PROB_SCALE)
+    one_scale = min(max(one_scale, 1), _PROB_SCALE - 1)
+    return _PROB_SCALE - one_scale
+
+
+class _Encoder:
+    def __init__(self, writer):
+        self.writer = writer
+        self.low = 0
+        self.high = _MAX_CODE
+        self.num_pending = 0
+
+    def encode(self, bit, one_p):
+        """Encodes the bit predicted with the given P(bit=1).
+        """
+        size = self.high - self.low + 1
+        split = self.low + ((size * _get_zero_scale(one_p)) >> _PROB_BITS) - 1
+        if bit:
+            self.low = split + 1
+        else:
+            self.high = split
+
+        while True:
+            if self.high < _HALF:
+                self._write_with_pending(0)
+            elif self.low >= _HALF:
+                self._write_with_pending(1)
+                self.low -= _HALF
+                self.high -= _HALF
+            elif self.low >= _QUARTER and self.high < 3 * _QUARTER:
+                self.num_pending += 1
+                self.low -= _QUARTER
+                self.high -= _QUARTER
+            else:
+                break
+
+            self.low = 2 * self.low
+            self.high = 2 * self.high + 1
+
+    def finish(self):
+        """Writes the bits to select a number inside the final interval.
+        """
+        self.num_pending += 1
+        if self.low < _QUARTER:
+            self._write_with_pending(0)
+        else:
+            self._write_with_pending(1)
+
+    def _write_with_pending(self, bit):
+        self.writer.write(bit)
+        for i in xrange(self.num_pending):
+            self.writer.write(1 - bit)
+        self.num_pending = 0
+
+
+class _Decoder:
+    def __init__(self, reader):
+        self.reader = reader
+        self.low = 0
+        self.high = _MAX_CODE
+        self.value = 0
+        for i in xrange(_CODE_BITS):
+            self.value = (self.value << 1) | reader.read()
+
+    def decode(self, one_p):
+        """Decodes a bit predicted with the given P(bit=1).
+        """
+        size = self.high - self.low + 1
+        split = self.low + ((size * _get_zero_scale(one_p)) >> _PROB_BITS) - 1
+        if self.value > split:
+            bit = 1
+            self.low = split + 1
+        else:
+            bit = 0
+            self.high = split
+
+        while True:
+            if self.high < _HALF:
+                pass
+            elif self.low >= _HALF:
+                self.low -= _HALF
+                self.high -= _HALF
+                self.value -= _HALF
+            elif self.low >= _QUARTER and self.high < 3 * _QUARTER:
+                self.low -= _QUARTER
+                self.high -= _QUARTER
+                self.value -= _QUARTER
+            else:
+                break
+
+            self.low = 2 * self.low
+            self.high = 2 * self.high + 1
+            self.value = 2 * self.value + self.reader.read()
+
+        return bit
+
+
+class _BitWriter:
+    def __init__(self, output):
+        self.output = output
+        self.buffer = bytearray()
+        self.byte = 0
+        self.num_bits = 0
+        self.num_bytes = 0
+
+    def write(self, bit):
+        self.byte = (self.byte << 1) | bit
+        self.num_bits += 1
+        if self.num_bits == 8:
+            self.buffer.append(self.byte)
+            self.byte = 0
+            self.num_bits = 0
+            if len(self.buffer) >= CHUNK_SIZE:
+                self._write_buffer()
+
+    def flush(self):
+        """Writes the buffered bits.
+        The last byte is padded with zeros.
+        """
+        while self.num_bits:
+            self.write(0)
+        self._write_buffer()
+
+    def _write_buffer(self):
+        self.output.write(str(self.buffer))
+        self.num_bytes += len(self.buffer)
+        self.buffer = bytearray()
+
+
+class _BitReader:
+    def __init__(self, input):
+        self.input = input
+        self.chunk = ""
+        self.index = 0
+        self.byte = 0
+        self.num_bits = 0
+        self.num_bytes = 0
+
+    def read(self):
+        """Returns the next bit.
+        Zeros are returned after the end of the input.
+        """
+        if self.num_bits == 0:
+            self.byte = self._read_byte()
+            self.num_bits = 8
+
+        self.num_bits -= 1
+        return (self.byte >> self.num_bits) & 1
+
+    def _read_byte(self):
+        if self.index == len(self.chunk):
+            self.chunk = self.input.read(CHUNK_SIZE)
+            self.index = 0
+            if not self.chunk:
+                return 0
+            self.num_bytes += len(self.chunk)
+
+        byte = ord(self.chunk[self.index])
+        self.index += 1
+        return byte
@@ -0,0 +1,357 @@
+"""A path-compressed context tree.
+
+A chain of nodes with a single child is collapsed into its bottom node,
+if the chain nodes saw exactly the updates of the bottom node.
+The chain nodes then have the same counts and p_estim
+and no uncovered bits. Their log_pw is computed in a closed form:
+    pw_top = (1 - 0.5**skip) * p_estim + 0.5**skip * pw_bottom
+A chain is split lazily, when a context diverges from it
+or ends inside it. The probabilities stay exact.
+
+The context bits of a chain are not copied.
+The chain keeps the context that created it.
+The suffix contexts of unbounded depth point into the history,
+which is then kept whole and packed.
+The bits of a bounded context are copied,
+so the bounded history forgets the old bits as in other storages.
+A chain is matched to a context by comparing packed words.
+The generated bits have to be reverted by revert_generated(),
+not by revert_added().
+
+A new context creates just one node, so a context of unbounded depth
+is walked only up to its divergence from the seen contexts.
+"""
+
+import math
+
+from libctw import ctw, extracting
+from libctw.ctw import LOG_ONE, LOG_ONE_HALF, LOG_ZERO, NO_CHILDREN
+
+
+class _CompressedCtModel(ctw._CtModel):
+    def __init__(self, estim_update, context_extractor):
+        """Creates a Context Tree model with a path-compressed tree.
+        """
+        self.estim_update = estim_update
+        self.extractor = context_extractor
+        self.history = self._create_history()
+        self.root = _CompressedNode(0, 0, None)
+
+    def _create_label(self, context):
+        """Returns the context as a sequence not changed by later bits.
+        A suffix of unbounded depth points into the kept history.
+        The bits of a bounded suffix are copied,
+        because the bounded history forgets them.
+        """
+        if not isinstance(context, extracting._ReversedSuffix):
+            return context
+        if self.extractor.get_max_lookback() is None:
+            return _FrozenSuffix(context.history, len(context.history))
+        return extracting.PackedHistory(context)
+
+    def fork(self):
+        """Returns a copy-on-write copy of the model.
+        The model must not be modified while its forks are used.
+        """
+        return _ForkedCompressedCtModel(self)
+
+    def _get_own_child(self, node, bit):
+        """Returns the child that could be modified.
+        """
+        return node.children[bit]
+
+    def _get_context_path(self, context, save_nodes=False):
+        """Returns the nodes from the root to the start of the context.
+        The chains are split at the divergence from the context,
+        so the last node is at the depth of the whole context.
+        A missing bottom node is created as a single chain.
+        """
+        path = [self.root]
+        node = self.root
+        depth = 0
+        label = None
+        while depth < len(context):
+            bit = context[depth]
+            child = self._get_own_child(node, bit)
+            if child is None:
+                if label is None:
+                    label = self._create_label(context)
+                child = _CompressedNode(len(context), len(context) - depth - 1,
+                        label)
+                if save_nodes:
+                    node.children[bit] = child
+            else:
+                num_matched = _match_label(child, context, depth + 1)
+                if num_matched < child.skip:
+                    child = _split(node, bit, child, num_matched)
+
+            path.append(child)
+            node = child
+            depth = child.depth
+
+        return path
+
+    def _get_existing_path(self, context):
+        """Returns the existing nodes on the context path.
+        The path ends before a chain diverging from the context.
+        No nodes are created or split.
+        """
+        path = [self.root]
+        node = self.root
+        while node.depth < len(context):
+            child = node.children[context[node.depth]]
+            if child is None or child.depth > len(context) or (
+                    _match_label(child, context, node.depth + 1) < child.skip):
+                break
+            path.append(child)
+            node = child
+
+        return path
+
+    def _calc_log_pw_after(self, path, context, bit):
+        """Returns the root log_pw after seeing the bit.
+        The given path could end before the start of the context.
+        The missing nodes are treated as a new chain
+        and the diverging chain as split.
+        """
+        estim_update = self.estim_update
+        node = path[-1]
+        log_p_estim = node.log_p_estim + estim_update(bit, node.counts)
+        if node.depth == len(context):
+            # The bit is uncovered by the children of the deepest node.
+            if node.children == NO_CHILDREN:
+                log_pw = log_p_estim
+            else:
+                childrens_log_p = (_child_log_pw(node, 0) +
+                        _child_log_pw(node, 1) +
+                        node.log_p_uncovered + LOG_ONE_HALF)
+                log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+        else:
+            child_bit = context[node.depth]
+            below_log_pw = self._calc_diverged_log_pw(node, context, bit)
+            childrens_log_p = (below_log_pw +
+                    _child_log_pw(node, 1 - child_bit) +
+                    node.log_p_uncovered)
+            log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+
+        for i in xrange(len(path) - 2, -1, -1):
+            child_log_p_estim = log_p_estim
+            node = path[i]
+            child_bit = context[node.depth]
+            log_p_estim = node.log_p_estim + estim_update(bit, node.counts)
+            childrens_log_p = (
+                    _chain_log_pw(path[i + 1].skip, child_log_p_estim, log_pw) +
+                    _child_log_pw(node, 1 - child_bit) +
+                    node.log_p_uncovered)
+            log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+
+        return log_pw
+
+    def _calc_diverged_log_pw(self, node, context, bit):
+        """Returns the log_pw of the child of the node after seeing the bit.
+        The child is missing or its chain diverges from the context.
+        """
+        estim_update = self.estim_update
+        # A new chain has the same p_estim in all nodes.
+        new_log_p_estim = estim_update(bit, [0, 0])
+        child = node.children[context[node.depth]]
+        if child is None:
+            return new_log_p_estim
+
+        num_matched = _match_label(child, context, node.depth + 1)
+        middle_depth = node.depth + 1 + num_matched
+        log_p_estim = child.log_p_estim + estim_update(bit, child.counts)
+        rest_log_pw = _chain_log_pw(child.skip - num_matched - 1,
+                child.log_p_estim, child.log_pw)
+        if middle_depth == len(context):
+            childrens_log_p = rest_log_pw + LOG_ONE_HALF
+        else:
+            childrens_log_p = rest_log_pw + new_log_p_estim
+        middle_log_pw = ctw._avg_log_p(log_p_estim, childrens_log_p)
+        return _chain_log_pw(num_matched, log_p_estim, middle_log_pw)
+
+    def _update_path(self, path, bit):
+        path[-1].log_p_uncovered += LOG_ONE_HALF
+        for node in reversed(path):
+            node.log_p_estim += self.estim_update(bit, node.counts)
+            node.counts[bit] += 1
+            node.recalculate_pw()
+
+    def _revert_path(self, path, bit):
+        """Reverts the update of the path.
+        The nodes without counts are removed,
+        so no chain points to the reverted history.
+        """
+        path[-1].log_p_uncovered -= LOG_ONE_HALF
+        for i in xrange(len(path) - 1, -1, -1):
+            node = path[i]
+            node.counts[bit] -= 1
+            if i > 0 and node.counts == [0, 0]:
+                parent = path[i - 1]
+                parent.children[parent.children.index(node)] = None
+                continue
+
+            decrement = self.estim_update(bit, node.counts)
+            if decrement == LOG_ZERO:
+                node.log_p_estim = ctw._recalculate_log_p_estim(node.counts,
+                        self.estim_update)
+            else:
+                node.log_p_estim -= decrement
+            node.recalculate_pw()
+
+
+class _ForkedCompressedCtModel(_CompressedCtModel):
+    def __init__(self, base):
+        """Creates a fork sharing the nodes of the base model.
+        The shared nodes are copied before they are modified.
+        """
+        self.estim_update = base.estim_update
+        self.extractor = base.extractor
+        self.history = extracting.OverlayHistory(base.history)
+        self.root = _copy_node(base.root)
+        # The ids of the nodes owned by the fork.
+        self.owned = set([id(self.root)])
+
+    def _get_own_child(self, node, bit):
+        """Returns an owned child.
+        A shared child is replaced by its copy.
+        The node has to be owned.
+        """
+        child = node.children[bit]
+        if child is not None and id(child) not in self.owned:
+            child = _copy_node(child)
+            node.children[bit] = child
+            self.owned.add(id(child))
+        return child
+
+    def _get_context_path(self, context, save_nodes=False):
+        path = _CompressedCtModel._get_context_path(self, context, save_nodes)
+        # The created and split nodes are owned too.
+        self.owned.update(id(node) for node in path)
+        return path
+
+
+def _copy_node(node):
+    copy = _CompressedNode(node.depth, node.skip, node.label)
+    copy.log_p_estim = node.log_p_estim
+    copy.log_pw = node.log_pw
+    copy.log_p_uncovered = node.log_p_uncovered
+    copy.counts = node.counts[:]
+    copy.children = node.children[:]
+    return copy
+
+
+class _FrozenSuffix:
+    """A reversed suffix of the history at the given end.
+    The history bits before the end have to stay unchanged.
+    """
+    def __init__(self, history, end):
+        self.history = history
+        self.end = end
+
+    def __getitem__(self, index):
+        return self.history[self.end - 1 - index]
+
+
+def _match_label(node, context, start):
+    """Returns the number of the chain bits of the node
+    matching the context from the given start.
+    The suffixes of packed histories are compared by whole words.
+    """
+    label = node.label
+    limit = min(node.skip, len(context) - start)
+    if limit <= 0:
+        return 0
+    if (isinstance(label, _FrozenSuffix) and
+            isinstance(context, extracting._ReversedSuffix) and
+            isinstance(label.history, extracting.PackedHistory) and
+            isinstance(context.history, extracting.PackedHistory)):
+        return _count_common_tail(label.history, label.end - start,
+                context.history, len(context.history) - start, limit)
+
+    num_matched = 0
+    while num_matched < limit and (label[start + num_matched] ==
+            context[start + num_matched]):
+        num_matched += 1
+    return num_matched
+
+
+def _count_common_tail(history1, end1, history2, end2, limit):
+    """Returns the number of the equal bits before the ends
+    of the packed histories, up to the limit.
+    The compared words grow, so a long match takes few comparisons.
+    """
+    num_common = 0
+    size = 256
+    while num_common < limit:
+        size = min(size, limit - num_common)
+        diff = (history1.get_value(end1 - num_common - size,
+                    end1 - num_common) ^
+                history2.get_value(end2 - num_common - size,
+                    end2 - num_common))
+        if diff:
+            # The lowest bits are the nearest to the ends.
+            return num_common + (diff & -diff).bit_length() - 1
+        num_common += size
+        size *= 4
+    return num_common
+
+
+def _split(parent, bit, child, num_matched):
+    """Makes an explicit node from the chain node
+    after the given number of the matched chain bits.
+    Returns the new node.
+    """
+    depth = child.depth - child.skip + num_matched
+    middle = _CompressedNode(depth, num_matched, child.label)
+    middle.log_p_estim = child.log_p_estim
+    middle.counts = child.counts[:]
+    middle.children[child.label[depth]] = child
+    child.skip -= num_matched + 1
+    parent.children[bit] = middle
+    middle.recalculate_pw()
+    return middle
+
+
+def _chain_log_pw(skip, log_p_estim, log_pw):
+    """Returns the log_pw of the top of a chain.
+    The chain has the given number of nodes above its bottom node.
+    The chain nodes share the log_p_estim of the bottom node.
+    """
+    if skip == 0:
+        return log_pw
+    log_weight = skip * LOG_ONE_HALF
+    # log(p_estim * (1 - weight) + pw * weight)
+    return ctw._avg_log_p(log_p_estim + math.log1p(-math.exp(log_weight)),
+            log_pw + log_weight) - LOG_ONE_HALF
+
+
+def _child_log_pw(node, child_bit):
+    child = node.children[child_bit]
+    if child is None:
+        return LOG_ONE
+    return _chain_log_pw(child.skip, child.log_p_estim, child.log_pw)
+
+
+class _CompressedNode(ctw._Node):
+    def __init__(self, depth, skip, label):
+        """Creates a node at the given depth.
+        The node is the bottom of a chain with the given number
+        of the collapsed nodes above it.
+        The label gives the context bits of the chain by their depth.
+        """
+        ctw._Node.__init__(self)
+        self.depth = depth
+        self.skip = skip
+        self.label = label
+
+    def recalculate_pw(self):
+        """Recalculates the weighted probability
+        based on the p_estim and the probability of children.
+        """
+        if self.children == NO_CHILDREN:
+            self.log_pw = self.log_p_estim
+        else:
+            childrens_log_p = (_child_log_pw(self, 0) +
+                    _child_log_pw(self, 1) + self.log_p_uncovered)
+            self.log_pw = ctw._avg_log_p(self.log_p_estim, childrens_log_p)
@@ -12,20 +12,53 @@ http://lessoned.blogspot.com/2011/06/bayesian-sequence-predictor.html
 import math
 from libctw import formatting, extracting
 
-def create_model(deterministic=False, max_depth=None):
-    extractor = extracting.SuffixExtractor(max_depth)
-    return create_context_based_model(extractor, deterministic=deterministic)
-
+STORAGES = ["nodes", "arrays", "hashed", "compressed"]
 
-def create_context_based_model(context_extractor, deterministic=False):
+def create_model(deterministic=False, max_depth=None, storage="nodes",
+        memory_budget=None):
+    extractor = extracting.SuffixExtractor(max_depth)
+    return create_context_based_model(extractor, deterministic=deterministic,
+            storage=storage, memory_budget=memory_budget)
+
+
+def create_context_based_model(context_extractor, deterministic=False,
+        storage="nodes", memory_budget=None):
+    """Creates a model with the given storage of the context tree.
+    The "nodes" storage uses a Python object per node.
+    The "arrays" storage keeps the nodes in flat typed arrays.
+    The "hashed" storage uses a fixed-size hash table.
+    Its size is given by the memory budget in bytes.
+    The "compressed" storage collapses the chains of single-child nodes.
+    It allows to use an unbounded depth on long histories.
+    """
     if deterministic:
         estim_update = _determ_estim_update
     else:
         estim_update = _kt_estim_update
 
-    return _CtModel(estim_update, context_extractor)
+    if storage == "nodes":
+        return _CtModel(estim_update, context_extractor)
+    elif storage == "arrays":
+        # Imported here to avoid a circular import.
+        from libctw import array_ctw
+        return array_ctw._ArrayCtModel(estim_update, context_extractor)
+    elif storage == "hashed":
+        from libctw import hashed_ctw
+        if memory_budget is None:
+            memory_budget = hashed_ctw.DEFAULT_MEMORY_BUDGET
+        return hashed_ctw._HashedCtModel(estim_update, context_extractor,
+                memory_budget)
+    elif storage == "compressed":
+        from libctw import compressed_ctw
+        return compressed_ctw._CompressedCtModel(estim_update,
+                context_extractor)
+    else:
+        raise ValueError("Unknown storage: %r" % storage)
 
 
+# The number of bits that can be reverted
+# when the history is bounded by the max depth.
+NUM_REVERTIBLE_BITS = 4096
 NO_CHILDREN = [None, None]
 LOG_ONE = 0.0
 LOG_ONE_HALF = math.log(0.5)
@@ -48,7 +81,7 @@ class _CtModel:
         """
         self.estim_update = estim_update
         self.extractor = context_extractor
-        self.history = []
+        self.history = self._create_history()
         self.root = _Node()
 
     def see_generated(self, bits):
@@ -64,7 +97,18 @@ class _CtModel:
         with an empty history.
         It allows to switch between sequence examples.
         """
-        self.history = []
+        self.history = self._create_history()
+
+    def _create_history(self):
+        """Creates an empty history.
+        Only the needed recent bits are remembered,
+        if the context depth is limited.
+        Otherwise, the bits are stored packed.
+        """
+        max_lookback = self.extractor.get_max_lookback()
+        if max_lookback is None:
+            return extracting.PackedHistory()
+        return extracting.BoundedHistory(max_lookback + NUM_REVERTIBLE_BITS)
 
     def see_added(self, bits):
         """Adds the historic bits without affecting the model parameters.
@@ -78,8 +122,12 @@ class _CtModel:
         on the context path.
         """
         context = self._get_context()
-        path = _get_context_path(self.root, context, save_nodes=True)
+        path = self._get_context_path(context, save_nodes=True)
+        self._update_path(path, bit)
+        self.history.append(bit)
+        self._check_immpossible_history()
 
+    def _update_path(self, path, bit):
         # If the node children are not updated by the bit,
         # their model is later complemented with p_uncovered.
         # The "THE CONTEXT-TREE WEIGHTING METHOD: EXTENSIONS" paper
@@ -93,19 +141,18 @@ class _CtModel:
             node.counts[bit] += 1
             node.recalculate_pw()
 
-        self.history.append(bit)
-        self._check_immpossible_history()
-
     def _check_immpossible_history(self):
-        log_pw = self.root.log_pw
+        log_pw = self.get_history_log_p()
         if math.isnan(log_pw) or math.isinf(log_pw):
             raise ImpossibleHistoryError(self.history)
 
     def _revert_bit(self):
         bit = self.history.pop(-1)
         context = self._get_context()
-        path = _get_context_path(self.root, context)
+        path = self._get_context_path(context)
+        self._revert_path(path, bit)
 
+    def _revert_path(self, path, bit):
         path[-1].log_p_uncovered -= LOG_ONE_HALF
         for node in reversed(path):
             node.counts[bit] -= 1
@@ -120,30 +167,118 @@ class _CtModel:
     def predict_one(self):
         """Computes the conditional probability
         P(Next_bit=1|history).
+        The model is not modified by the prediction.
+        It is safe to predict from multiple threads,
+        if no thread updates the model.
         """
-        log_pw = self.root.log_pw
-        try:
-            self._see_generated_bit(1)
-        except ImpossibleHistoryError:
-            self._revert_bit()
+        context = self._get_context()
+        path = self._get_existing_path(context)
+        return self._predict_one_on_path(path, context)
+
+    def advance(self):
+        """Generates deterministically the next bit and sees it.
+        The context path is walked just once.
+        Returns a (bit, prediction_probability) pair.
+        """
+        context = self._get_context()
+        path = self._get_context_path(context, save_nodes=True)
+        bit, p = choose_bit(self._predict_one_on_path(path, context))
+        self._update_path(path, bit)
+        self.history.append(bit)
+        self._check_immpossible_history()
+        return bit, p
+
+    def _predict_one_on_path(self, path, context):
+        new_log_pw = self._calc_log_pw_after(path, context, 1)
+        if math.isnan(new_log_pw) or math.isinf(new_log_pw):
             return 0.0
 
-        new_log_pw = self.root.log_pw
-        self._revert_bit()
-        return math.exp(new_log_pw - log_pw)
+        return math.exp(new_log_pw - self.get_history_log_p())
+
+    def _calc_log_pw_after(self, path, context, bit):
+        """Returns the root log_pw after seeing the bit.
+        The given path could end before the start of the context.
+        The missing nodes are treated as new empty nodes.
+        """
+        depth = self._get_path_depth(path, context)
+        log_pw = _calc_new_path_log_pw(depth + 1 - len(path), bit,
+                self.estim_update)
+        for i in xrange(len(path) - 1, -1, -1):
+            node = path[i]
+            log_p_estim = node.log_p_estim + self.estim_update(bit,
+                    node.counts)
+            if i == depth:
+                # The bit is uncovered by the children of the deepest node.
+                if node.children == NO_CHILDREN:
+                    log_pw = log_p_estim
+                else:
+                    childrens_log_p = (_child_log_pw(node, 0) +
+                            _child_log_pw(node, 1) +
+                            node.log_p_uncovered + LOG_ONE_HALF)
+                    log_pw = _avg_log_p(log_p_estim, childrens_log_p)
+            else:
+                if i + 1 < len(path):
+                    child_bit = 0 if node.children[0] is path[i + 1] else 1
+                else:
+                    child_bit = context[i]
+                childrens_log_p = (log_pw +
+                        _child_log_pw(node, 1 - child_bit) +
+                        node.log_p_uncovered)
+                log_pw = _avg_log_p(log_p_estim, childrens_log_p)
+
+        return log_pw
 
     def revert_generated(self, num_bits):
+        num_revertible = self._get_num_revertible_bits()
+        if num_bits > num_revertible:
+            raise ValueError("At most %s bits can be reverted."
+                    % num_revertible)
         for i in xrange(num_bits):
             self._revert_bit()
 
+    def _get_num_revertible_bits(self):
+        """Returns the number of the recent bits
+        with a remembered context.
+        The contexts of older bits are forgotten by a bounded history.
+        """
+        num_forgotten = _get_num_forgotten(self.history)
+        if num_forgotten == 0:
+            return len(self.history)
+        max_lookback = self.extractor.get_max_lookback()
+        return max(0, len(self.history) - num_forgotten - max_lookback)
+
     def revert_added(self, num_bits):
         if num_bits > 0:
             del self.history[-num_bits:]
 
     def _get_context(self):
         """Returns the recent context.
+        The most recent bit is the first one.
+        """
+        return self.extractor.extract_reversed(self.history)
+
+    def _get_context_path(self, context, save_nodes=False):
+        return _get_context_path(self.root, context, save_nodes)
+
+    def _get_path_depth(self, path, context):
+        """Returns the depth of the deepest node
+        that would be updated by the next bit.
+        """
+        return len(context)
+
+    def _get_existing_path(self, context):
+        """Returns the existing nodes on the context path.
+        No nodes are created.
         """
-        return self.extractor.extract_context(self.history)
+        path = [self.root]
+        node = self.root
+        for bit in context:
+            node = node.children[bit]
+            if node is None:
+                break
+            path.append(node)
+
+        return path
 
     def get_history_log_p(self):
         """Returns the log(probability) of the whole history.
@@ -152,13 +287,72 @@ class _CtModel:
         """
         return self.root.log_pw
 
+    def fork(self):
+        """Returns a copy-on-write copy of the model.
+        Only the nodes modified by the copy are copied,
+        so the copy is cheap to create and to drop.
+        The model must not be modified while its forks are used.
+        """
+        return _ForkedCtModel(self)
+
+
+class _ForkedCtModel(_CtModel):
+    def __init__(self, base):
+        """Creates a fork sharing the nodes of the base model.
+        The shared nodes are copied before they are modified.
+        """
+        self.estim_update = base.estim_update
+        self.extractor = base.extractor
+        self.history = extracting.OverlayHistory(base.history)
+        self.root = _copy_node(base.root)
+        # The ids of the nodes owned by the fork.
+        # The owned nodes are alive, so their ids are unique.
+        self.owned = set([id(self.root)])
+
+    def _get_context_path(self, context, save_nodes=False):
+        """Returns a path of owned nodes.
+        The shared nodes on the path are replaced by their copies,
+        because the nodes on the path are modified by updates and reverts.
+        """
+        owned = self.owned
+        path = [self.root]
+        node = self.root
+        for bit in context:
+            child = node.children[bit]
+            if child is None:
+                child = _Node()
+                if save_nodes:
+                    node.children[bit] = child
+                    owned.add(id(child))
+            elif id(child) not in owned:
+                child = _copy_node(child)
+                node.children[bit] = child
+                owned.add(id(child))
+
+            path.append(child)
+            node = child
+
+        return path
+
+
+def choose_bit(one_p):
+    """Chooses the more probable bit.
+    Returns a (bit, prediction_probability) pair.
+    """
+    assert 0 <= one_p <= 1.0, "invalid P: %s" % one_p
+    if one_p >= 0.5:
+        return 1, one_p
+    else:
+        return 0, (1 - one_p)
+
 
 def _get_context_path(root, context, save_nodes=False):
     """Returns a path from the root to the start of the context.
+    The context starts with the most recent bit.
     """
     path = [root]
     node = root
-    for i, bit in enumerate(reversed(context)):
+    for bit in context:
         child = node.children[bit]
         if child is None:
             child = _Node()
@@ -171,9 +365,40 @@ def _get_context_path(root, context, save_nodes=False):
     return path
 
 
+def _get_num_forgotten(history):
+    """Returns the number of the old bits forgotten by the history.
+    """
+    while isinstance(history, extracting.OverlayHistory):
+        history = history.base
+    if isinstance(history, extracting.BoundedHistory):
+        return history.start
+    return 0
+
+
+def _calc_new_path_log_pw(num_nodes, bit, estim_update):
+    """Returns the log_pw of the top node
+    of a chain of new nodes after seeing the bit.
+    The bit is uncovered by the children of the bottom node.
+    """
+    if num_nodes <= 0:
+        return None
+
+    log_p_estim = estim_update(bit, [0, 0])
+    log_pw = log_p_estim
+    for i in xrange(num_nodes - 1):
+        log_pw = _avg_log_p(log_p_estim, log_pw)
+    return log_pw
+
+
 def _avg_log_p(a_log_p, b_log_p):
     """Returns log(0.5 * (a_p + b_p)).
     It is equal to: log(0.5) + log(b_p * (1 +  a_p/b_p)).
+
+    The log(1 + e**x) is computed by log1p(), which is faster
+    and has an error below 1 ulp even for a tiny e**x.
+    For x >= 100, the dropped log(1 + e**-x) is below 4e-44,
+    much smaller than a rounding error of x.
+    A nan input, or -inf for both inputs, gives nan.
     """
     log_rate = a_log_p - b_log_p
     # It is OK to use x instead of log(1 + e**x) if x is big.
@@ -181,7 +406,7 @@ def _avg_log_p(a_log_p, b_log_p):
     if log_rate >= 100:
         log_one_plus = log_rate
     else:
-        log_one_plus = math.log(1 + math.exp(log_rate))
+        log_one_plus = math.log1p(math.exp(log_rate))
 
     return LOG_ONE_HALF + b_log_p + log_one_plus
 
@@ -226,34 +451,49 @@ class _Node:
             counts=self.counts))
 
 
+def _copy_node(node):
+    copy = _Node()
+    copy.log_p_estim = node.log_p_estim
+    copy.log_pw = node.log_pw
+    copy.log_p_uncovered = node.log_p_uncovered
+    copy.counts = node.counts[:]
+    copy.children = node.children[:]
+    return copy
+
+
 def _determ_estim_update(new_bit, counts):
     """Beliefs only a sequence of all ones or zeros.
     """
-    new_counts = counts[:]
-    new_counts[new_bit] += 1
-    if new_counts[0] > 0 and new_counts[1] > 0:
+    if counts[1 - new_bit] > 0:
         return LOG_ZERO
+    if counts[new_bit] == 0:
+        # The first bit has P = 0.5.
+        return LOG_ONE_HALF
+    return LOG_ONE
 
-    log_p_new = _determ_log_p(new_counts)
-    log_p_old = _determ_log_p(counts)
-    return log_p_new - log_p_old
 
+def _create_kt_table(size):
+    """Returns a table of log((count + 0.5) / (total + 1))
+    indexed by [total][count].
+    """
+    return [[math.log((count + 0.5) / float(total + 1))
+        for count in xrange(total + 1)]
+        for total in xrange(size)]
 
-def _determ_log_p(counts):
-    if counts[0] == 0 and counts[1] == 0:
-        return LOG_ONE
-    if counts[0] == 0:
-        return LOG_ONE_HALF
-    if counts[1] == 0:
-        return LOG_ONE_HALF
-    return LOG_ZERO
+# The KT increments for the totals below the table size.
+KT_TABLE_SIZE = 128
+_KT_TABLE = _create_kt_table(KT_TABLE_SIZE)
 
 
 def _kt_estim_update(new_bit, counts):
     """Computes log(P(Next_bit=new_bit|counts))
     for the the Krichevski-Trofimov estimator.
+    The small counts are looked up in a precomputed table.
     """
-    return math.log((counts[new_bit] + 0.5) / float((sum(counts) + 1)))
+    total = counts[0] + counts[1]
+    if total < KT_TABLE_SIZE:
+        return _KT_TABLE[total][counts[new_bit]]
+    return math.log((counts[new_bit] + 0.5) / float(total + 1))
 
 def _recalculate_log_p_estim(counts, estim_update):
     # Only the deterministic prior needs recomputing.
@@ -1,4 +1,11 @@
 
+import binascii
+import itertools
+from array import array
+
+from libctw import byting
+
+
 class SuffixExtractor:
     def __init__(self, max_depth=None):
         self.max_depth = max_depth
@@ -6,12 +13,30 @@ class SuffixExtractor:
     def extract_context(self, history):
         """Extracts the history suffix.
         """
-        context = history
-        if self.max_depth is not None and len(context) > self.max_depth:
-            context = context[len(context) - self.max_depth:]
+        if self.max_depth is not None and len(history) > self.max_depth:
+            context = history[len(history) - self.max_depth:]
             assert len(context) == self.max_depth
+        else:
+            context = history[:]
         return context
 
+    def extract_reversed(self, history):
+        """Returns the history suffix in reversed order,
+        the most recent bit first.
+        The suffix is a view. The history is not copied.
+        """
+        length = len(history)
+        if self.max_depth is not None and length > self.max_depth:
+            length = self.max_depth
+        return _ReversedSuffix(history, length)
+
+    def get_max_lookback(self):
+        """Returns the number of the recent bits
+        needed to extract a context.
+        None means the whole history.
+        """
+        return self.max_depth
+
 
 class VarExtractor:
     """An extractor of custom contexts.
@@ -22,11 +47,90 @@ class VarExtractor:
         self.root_var = root_var
         self.suffix_extractor = SuffixExtractor(max_depth)
         #TODO: assert that the depth of the vars isn't bigger that max_depth
+        self._compile()
+
+    def _compile(self):
+        """Compiles the var tree to flat lists.
+        A branch has a var index and two children.
+        A child is a branch number or ~leaf_number.
+        A leaf has the history offsets of its context bits
+        in the reversed context order.
+        """
+        self.branch_indexes = []
+        self.branch_children = []
+        self.leaf_offsets = []
+        self.leaf_tails = []
+        self.root = self._compile_var(self.root_var, [])
+        # The offsets are valid only if all vars can be read
+        # and the history is long enough for the whole suffix.
+        self.min_compiled_length = _get_max_var_depth(self.root_var)
+        if self.suffix_extractor.max_depth is not None:
+            self.min_compiled_length = max(self.min_compiled_length,
+                    self.suffix_extractor.max_depth)
+
+    def _compile_var(self, var, used_indexes):
+        if var is None:
+            return ~self._add_leaf(used_indexes)
+
+        branch = len(self.branch_indexes)
+        self.branch_indexes.append(var.index)
+        self.branch_children.append(None)
+        used_indexes = used_indexes + [var.index]
+        self.branch_children[branch] = [self._compile_var(child, used_indexes)
+                for child in var.children]
+        return branch
+
+    def _add_leaf(self, used_indexes):
+        max_depth = self.suffix_extractor.max_depth
+        if max_depth is None:
+            # The suffix is the whole history without the used bits.
+            # The bits older than the used bits are not compiled.
+            num_recent = max([0] + [-index for index in used_indexes])
+        else:
+            num_recent = max_depth
+
+        # The unused suffix is found by the slow extraction of offsets.
+        suffix = self._get_unused_suffix(range(-num_recent, 0),
+                used_indexes[:])
+        suffix.reverse()
+        self.leaf_offsets.append(used_indexes + suffix)
+        self.leaf_tails.append(num_recent)
+        return len(self.leaf_offsets) - 1
 
     def extract_context(self, history):
         """Extracts a context based on the tree of var indexes.
         After extracting all the var values, suffixes are used as a fallback.
         """
+        context = self.extract_reversed(history)
+        context.reverse()
+        return context
+
+    def extract_reversed(self, history):
+        """Returns the context in reversed order, the most recent bit first.
+        The bits are gathered from the compiled offsets.
+        """
+        if len(history) < self.min_compiled_length:
+            context = self._extract_short_context(history)
+            context.reverse()
+            return context
+
+        indexes = self.branch_indexes
+        children = self.branch_children
+        node = self.root
+        while node >= 0:
+            node = children[node][history[indexes[node]]]
+
+        leaf = ~node
+        context = [history[offset] for offset in self.leaf_offsets[leaf]]
+        if self.suffix_extractor.max_depth is None:
+            context.extend(itertools.islice(reversed(history),
+                self.leaf_tails[leaf], None))
+        return context
+
+    def _extract_short_context(self, history):
+        """Extracts the context without the compiled offsets.
+        Some vars could point before the start of the history.
+        """
         context = []
         used_indexes = []
 
@@ -42,6 +146,12 @@ class VarExtractor:
 
         return self._get_unused_suffix(history, used_indexes) + context
 
+    def get_max_lookback(self):
+        max_depth = self.suffix_extractor.max_depth
+        if max_depth is None:
+            return None
+        return max(max_depth, _get_max_var_depth(self.root_var))
+
     def _get_unused_suffix(self, history, used_indexes):
         context = self.suffix_extractor.extract_context(history)
         if used_indexes:
@@ -50,11 +160,18 @@ class VarExtractor:
             for index in used_indexes:
                 if -index < len(context):
                     del context[index]
-                else:
+                elif context:
                     del context[0]
         return context
 
 
+def _get_max_var_depth(var):
+    if var is None:
+        return 0
+    return max(-var.index, *[_get_max_var_depth(child)
+        for child in var.children])
+
+
 class Var:
     """A var specifies what to prepend to the context.
     The var index is the index of a bit in the history.
@@ -66,3 +183,275 @@ class Var:
         self.index = index
         self.children = children
 
+
+
+class _ReversedSuffix:
+    """A view of the last bits of the history.
+    The most recent bit is the first one.
+    """
+    def __init__(self, history, length):
+        self.history = history
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("context index out of range")
+        return self.history[-1 - index]
+
+    def __iter__(self):
+        return itertools.islice(reversed(self.history), self.length)
+
+
+class BoundedHistory:
+    """A history remembering only the given number of the recent bits.
+    The bits are stored in a ring buffer.
+    The len() and the indexes still count all the seen bits.
+    Older bits are forgotten and can't be accessed or reverted.
+    """
+    def __init__(self, capacity, num_forgotten=0):
+        """Creates an empty history.
+        It could start after the given number of already forgotten bits.
+        """
+        assert capacity > 0
+        self.bits = array("B", [0]) * capacity
+        self.capacity = capacity
+        # The remembered bits are on the [start, end) indexes.
+        self.start = num_forgotten
+        self.end = num_forgotten
+
+    def __len__(self):
+        return self.end
+
+    def _get_offset(self, index):
+        if index < 0:
+            index += self.end
+        if not self.start <= index < self.end:
+            raise IndexError("history index out of range: %s" % index)
+        return index % self.capacity
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.end)
+            return [self[i] for i in xrange(start, stop, step)]
+        return self.bits[self._get_offset(index)]
+
+    def __iter__(self):
+        for i in xrange(self.start, self.end):
+            yield self.bits[i % self.capacity]
+
+    def __reversed__(self):
+        for i in xrange(self.end - 1, self.start - 1, -1):
+            yield self.bits[i % self.capacity]
+
+    def append(self, bit):
+        self.bits[self.end % self.capacity] = bit
+        self.end += 1
+        if self.end - self.start > self.capacity:
+            self.start = self.end - self.capacity
+
+    def extend(self, bits):
+        for bit in bits:
+            self.append(bit)
+
+    def __iadd__(self, bits):
+        self.extend(bits)
+        return self
+
+    def pop(self, index=-1):
+        assert index == -1, "only the last bit can be popped"
+        bit = self[-1]
+        self.end -= 1
+        return bit
+
+    def __delitem__(self, index):
+        """Deletes the last bits.
+        Only the del history[-num_bits:] form is supported.
+        """
+        assert isinstance(index, slice)
+        start, stop, step = index.indices(self.end)
+        assert stop == self.end and step == 1
+        if start < self.start:
+            raise IndexError("the bits to delete are forgotten")
+        self.end = start
+
+
+_REVERSED_BYTE_BITS = [bits[::-1] for bits in byting.BYTE_BITS]
+
+
+class PackedHistory:
+    """A history storing 8 bits in a byte.
+    The first bit of a byte is its highest bit.
+    The unused bits of the last byte are zeros.
+    """
+    def __init__(self, bits=()):
+        self.data = bytearray()
+        self.length = 0
+        self.extend(bits)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step == 1 and start % 8 == 0 and start < stop:
+                bits = byting.to_bits(buffer(self.data, start // 8,
+                    (stop - start + 7) // 8))
+                del bits[stop - start:]
+                return bits
+            return [self[i] for i in xrange(start, stop, step)]
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("history index out of range: %s" % index)
+        return (self.data[index >> 3] >> (7 - (index & 7))) & 1
+
+    def __iter__(self):
+        bits = itertools.chain.from_iterable(
+                itertools.imap(byting.BYTE_BITS.__getitem__, self.data))
+        return itertools.islice(bits, self.length)
+
+    def __reversed__(self):
+        num_tail = self.length % 8
+        if num_tail == 0:
+            tail = ()
+            data = reversed(self.data)
+        else:
+            tail = _REVERSED_BYTE_BITS[self.data[-1]][8 - num_tail:]
+            data = itertools.islice(reversed(self.data), 1, None)
+        return itertools.chain(tail, itertools.chain.from_iterable(
+            itertools.imap(_REVERSED_BYTE_BITS.__getitem__, data)))
+
+    def append(self, bit):
+        shift = 7 - (self.length & 7)
+        if shift == 7:
+            self.data.append(bit << 7)
+        elif bit:
+            self.data[-1] |= 1 << shift
+        self.length += 1
+
+    def extend(self, bits):
+        for bit in bits:
+            self.append(bit)
+
+    def get_value(self, start, stop):
+        """Returns the bits on the [start, stop) indexes as an integer.
+        The first bit is the highest.
+        The bits are converted by whole bytes.
+        """
+        assert 0 <= start <= stop <= self.length
+        if start == stop:
+            return 0
+        first = start // 8
+        last = (stop + 7) // 8
+        value = long(binascii.hexlify(buffer(self.data, first, last - first)),
+                16)
+        return (value >> (8 * last - stop)) & ((1 << (stop - start)) - 1)
+
+    def extend_bytes(self, bytes):
+        """Appends the bits of the bytes.
+        The bytes are copied without unpacking,
+        if the history ends on a byte boundary.
+        """
+        if self.length % 8 == 0:
+            self.data.extend(bytes)
+            self.length = 8 * len(self.data)
+        else:
+            self.extend(byting.to_bits(bytes))
+
+    def __iadd__(self, bits):
+        self.extend(bits)
+        return self
+
+    def pop(self, index=-1):
+        assert index == -1, "only the last bit can be popped"
+        bit = self[-1]
+        del self[-1:]
+        return bit
+
+    def __delitem__(self, index):
+        """Deletes the last bits.
+        Only the del history[-num_bits:] form is supported.
+        """
+        assert isinstance(index, slice)
+        start, stop, step = index.indices(self.length)
+        assert stop == self.length and step == 1
+        self.length = start
+        del self.data[(start + 7) // 8:]
+        num_tail = start % 8
+        if num_tail:
+            self.data[-1] &= (0xff << (8 - num_tail)) & 0xff
+
+
+class OverlayHistory:
+    """A history continuing a base history without modifying it.
+    The base history has to stay unchanged.
+    The base bits could be removed from the overlay.
+    They are then only hidden.
+    """
+    def __init__(self, base):
+        self.base = base
+        # The number of the visible base bits.
+        self.num_base = len(base)
+        self.bits = []
+
+    def __len__(self):
+        return self.num_base + len(self.bits)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return [self[i] for i in xrange(start, stop, step)]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range: %s" % index)
+        if index < self.num_base:
+            return self.base[index]
+        return self.bits[index - self.num_base]
+
+    def __iter__(self):
+        bits = list(reversed(self))
+        bits.reverse()
+        return iter(bits)
+
+    def __reversed__(self):
+        return itertools.chain(reversed(self.bits),
+                itertools.islice(reversed(self.base),
+                    len(self.base) - self.num_base, None))
+
+    def append(self, bit):
+        self.bits.append(bit)
+
+    def extend(self, bits):
+        self.bits.extend(bits)
+
+    def __iadd__(self, bits):
+        self.extend(bits)
+        return self
+
+    def pop(self, index=-1):
+        assert index == -1, "only the last bit can be popped"
+        if self.bits:
+            return self.bits.pop()
+        bit = self[-1]
+        self.num_base -= 1
+        return bit
+
+    def __delitem__(self, index):
+        """Deletes the last bits.
+        Only the del history[-num_bits:] form is supported.
+        """
+        assert isinstance(index, slice)
+        start, stop, step = index.indices(len(self))
+        assert stop == len(self) and step == 1
+        if start >= self.num_base:
+            del self.bits[start - self.num_base:]
+        else:
+            self.bits = []
+            self.num_base = start
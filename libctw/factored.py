@@ -1,10 +1,12 @@
 
-from libctw import ctw
+from libctw import ctw, extracting
 
-def create_model(deterministic=False, max_depth=None, num_factors=8):
+def create_model(deterministic=False, max_depth=None, num_factors=8,
+        storage="nodes", memory_budget=None):
     cts = []
     for i in xrange(num_factors):
-        cts.append(ctw.create_model(deterministic, max_depth))
+        cts.append(ctw.create_model(deterministic, max_depth, storage,
+            memory_budget))
 
     return _Factored(cts)
 
@@ -18,16 +20,33 @@ def create_factored_model(bit_models):
 
 
 class _Factored:
-    def __init__(self, cts):
+    """The context trees share a single history.
+    A bit is appended to the history only by the tree predicting it.
+    The other trees see it without any work.
+    """
+    def __init__(self, cts, history=None):
+        """Creates a model with the given trees.
+        The trees will share the given history
+        or a copy of the history of the first tree.
+        """
         self.cts = cts
         self.offset = 0
+        if history is None:
+            first_history = cts[0].history
+            num_forgotten = 0
+            if isinstance(first_history, extracting.BoundedHistory):
+                num_forgotten = first_history.start
+            history = _create_shared_history(cts, num_forgotten)
+            history += first_history
+        self.history = history
+        self._share_history()
+
+    def _share_history(self):
+        for ct in self.cts:
+            ct.history = self.history
 
     def see_generated(self, bits):
         for bit in bits:
-            for i, ct in enumerate(self.cts):
-                if i != self.offset:
-                    ct.see_added([bit])
-
             try:
                 self.cts[self.offset].see_generated([bit])
             except ctw.ImpossibleHistoryError:
@@ -36,26 +55,101 @@ class _Factored:
                 self.offset = (self.offset + 1) % len(self.cts)
 
     def see_added(self, bits):
-        for ct in self.cts:
-            ct.see_added(bits)
+        self.history += bits
 
     def predict_one(self):
         return self.cts[self.offset].predict_one()
 
+    def advance(self):
+        bit, p = self.cts[self.offset].advance()
+        self.offset = (self.offset + 1) % len(self.cts)
+        return bit, p
+
     def switch_history(self):
         self.offset = 0
-        for ct in self.cts:
-            ct.switch_history()
+        self.history = self._create_history()
+        self._share_history()
+
+    def _create_history(self):
+        return _create_shared_history(self.cts)
 
     def revert_generated(self, num_bits):
+        num_revertible = min(ct._get_num_revertible_bits() for ct in self.cts)
+        if num_bits > num_revertible:
+            raise ValueError("At most %s bits can be reverted."
+                    % num_revertible)
         for ignored in xrange(num_bits):
             self.offset = (self.offset - 1) % len(self.cts)
-            for i, ct in enumerate(self.cts):
-                if i == self.offset:
-                    ct.revert_generated(1)
-                else:
-                    ct.revert_added(1)
+            self.cts[self.offset].revert_generated(1)
 
     def get_history_log_p(self):
         return sum(ct.get_history_log_p() for ct in self.cts)
 
+    def fork(self):
+        """Returns a copy-on-write copy of the model.
+        The model must not be modified while its forks are used.
+        """
+        forked = _Factored([ct.fork() for ct in self.cts],
+                extracting.OverlayHistory(self.history))
+        forked.offset = self.offset
+        return forked
+
+    def predict_distribution(self):
+        """Returns the probabilities of all values
+        of the remaining bits of the current symbol.
+        The value is formed by the bits with the first bit as the highest.
+        E.g., P(Next_byte=value) for a byte model at a byte boundary.
+
+        A bit is predicted only by its own context tree,
+        so the trees are not updated by the symbol prefixes.
+        The prefixes are only appended to an overlay of the history,
+        so the history is not modified.
+        Each prefix is then predicted just once.
+        """
+        num_bits = len(self.cts) - self.offset
+        probs = [0.0] * 2**num_bits
+        overlay = extracting.OverlayHistory(self.history)
+        for ct in self.cts:
+            ct.history = overlay
+        try:
+            self._fill_distribution(probs, overlay, self.offset, 0, 1.0)
+        finally:
+            self._share_history()
+        return probs
+
+    def _fill_distribution(self, probs, overlay, offset, value, prefix_p):
+        if offset == len(self.cts):
+            probs[value] = prefix_p
+            return
+
+        one_p = self.cts[offset].predict_one()
+        for bit, bit_p in [(0, 1 - one_p), (1, one_p)]:
+            if bit_p == 0:
+                continue
+            overlay.append(bit)
+            try:
+                self._fill_distribution(probs, overlay, offset + 1,
+                        2 * value + bit, prefix_p * bit_p)
+            finally:
+                overlay.pop()
+
+
+def get_most_probable(probs, num_values):
+    """Returns the given number of (value, probability) pairs
+    with the highest probabilities.
+    The smaller value goes first on a tie.
+    """
+    ranked = sorted(enumerate(probs), key=lambda pair: (-pair[1], pair[0]))
+    return ranked[:num_values]
+
+
+def _create_shared_history(cts, num_forgotten=0):
+    """Creates an empty history long enough for all the context trees.
+    """
+    histories = [ct._create_history() for ct in cts]
+    if not all(isinstance(history, extracting.BoundedHistory)
+            for history in histories):
+        return extracting.PackedHistory()
+
+    capacity = max(history.capacity for history in histories)
+    return extracting.BoundedHistory(capacity, num_forgotten)
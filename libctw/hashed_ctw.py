@@ -0,0 +1,182 @@
+"""A context tree stored in a fixed-size hash table.
+
+The table is preallocated for the given memory budget.
+A node is addressed by a hash of its parent slot and its context bit,
+so no child indexes are stored.
+When no free slot is found for a new node, the node is not created
+and the context path ends at its parent.
+The bit is then uncovered by the children of the parent.
+The model stays a valid CTW model with a shorter context.
+"""
+
+from array import array
+
+from libctw import array_ctw
+from libctw.array_ctw import ROOT, NO_CHILD
+from libctw.ctw import LOG_ONE
+
+DEFAULT_MEMORY_BUDGET = 64 * 2**20
+# A key, three doubles and two counts.
+BYTES_PER_NODE = 8 + 3 * 8 + 2 * 4
+MAX_PROBES = 16
+EMPTY = -1
+
+
+class _HashedCtModel(array_ctw._ArrayCtModel):
+    def __init__(self, estim_update, context_extractor,
+            memory_budget=DEFAULT_MEMORY_BUDGET):
+        """Creates a Context Tree model with a hashed tree.
+        The memory budget is given in bytes.
+        """
+        self.estim_update = estim_update
+        self.extractor = context_extractor
+        self.history = self._create_history()
+        self.nodes = _HashedNodes(memory_budget // BYTES_PER_NODE)
+
+    def _get_context_path(self, context, save_nodes=False):
+        """Returns a list of node slots from the root
+        to the start of the context.
+        The path ends early, if a node could not be created.
+        """
+        if not save_nodes:
+            return self._get_existing_path(context)
+
+        nodes = self.nodes
+        path = [ROOT]
+        node = ROOT
+        for bit in context:
+            child = nodes.get_child(node, bit)
+            if child == NO_CHILD:
+                child = nodes.add_child(node, bit)
+                if child == NO_CHILD:
+                    break
+
+            path.append(child)
+            node = child
+
+        return path
+
+    def _get_existing_path(self, context):
+        nodes = self.nodes
+        path = [ROOT]
+        node = ROOT
+        for bit in context:
+            node = nodes.get_child(node, bit)
+            if node == NO_CHILD:
+                break
+            path.append(node)
+
+        return path
+
+    def _get_path_depth(self, path, context):
+        """Returns the depth of the deepest node
+        that would be updated by the next bit.
+        The depth is limited by the free slots for the missing nodes.
+        """
+        depth = len(path) - 1
+        # The allocation of the missing nodes is simulated.
+        taken = set()
+        parent = path[-1]
+        while depth < len(context):
+            slot = self.nodes.find_free_slot(parent, context[depth], taken)
+            if slot == NO_CHILD:
+                break
+            taken.add(slot)
+            parent = slot
+            depth += 1
+
+        return depth
+
+    def get_table_stats(self):
+        """Returns statistics about the usage of the hash table.
+        """
+        nodes = self.nodes
+        return dict(
+                num_slots=nodes.num_slots,
+                num_nodes=len(nodes),
+                num_collisions=nodes.num_collisions,
+                num_dropped=nodes.num_dropped,
+                memory=nodes.num_slots * BYTES_PER_NODE)
+
+
+class _HashedNodes(array_ctw._NodeArrays):
+    """Preallocated columns of node fields.
+    The i-th item of each column belongs to the node in the i-th slot.
+    The key of a node identifies its parent slot and its context bit.
+    """
+    COLUMN_ATTRS = ["keys", "log_p_estim", "log_pw", "log_p_uncovered",
+            "counts"]
+
+    def __init__(self, num_slots):
+        if num_slots < 1:
+            raise ValueError("The memory budget is too small.")
+        self.num_slots = num_slots
+        self.num_probes = min(MAX_PROBES, num_slots)
+        self.keys = array("l", [EMPTY]) * num_slots
+        self.log_p_estim = array("d", [LOG_ONE]) * num_slots
+        self.log_pw = array("d", [LOG_ONE]) * num_slots
+        self.log_p_uncovered = array("d", [LOG_ONE]) * num_slots
+        self.counts = (array("I", [0]) * num_slots,
+                array("I", [0]) * num_slots)
+        self.num_nodes = 1
+        # The number of probed slots occupied by other nodes.
+        self.num_collisions = 0
+        # The number of nodes not created for lack of free slots.
+        self.num_dropped = 0
+        self.keys[ROOT] = 0
+
+    def __len__(self):
+        return self.num_nodes
+
+    def _iter_slots(self, key):
+        slot = ((key * 2654435761) & 0xffffffff) % self.num_slots
+        for i in xrange(self.num_probes):
+            yield slot
+            slot = (slot + 1) % self.num_slots
+
+    def get_child(self, node, bit):
+        # The probing is inlined, because it is on the hot path.
+        key = 2 * node + bit + 1
+        keys = self.keys
+        slot = ((key * 2654435761) & 0xffffffff) % self.num_slots
+        for i in xrange(self.num_probes):
+            slot_key = keys[slot]
+            if slot_key == key:
+                return slot
+            if slot_key == EMPTY:
+                break
+            slot += 1
+            if slot == self.num_slots:
+                slot = 0
+        return NO_CHILD
+
+    def find_free_slot(self, node, bit, taken=()):
+        """Returns the slot that a new child would get.
+        The taken slots are treated as occupied.
+        Returns NO_CHILD when no free slot is found.
+        """
+        for slot in self._iter_slots(_get_key(node, bit)):
+            if self.keys[slot] == EMPTY and slot not in taken:
+                return slot
+        return NO_CHILD
+
+    def add_child(self, node, bit):
+        """Creates a new child in a free slot.
+        Returns NO_CHILD when the child could not be created.
+        The slots are never freed, so the child will stay missing.
+        """
+        key = _get_key(node, bit)
+        for slot in self._iter_slots(key):
+            if self.keys[slot] == EMPTY:
+                self.keys[slot] = key
+                self.num_nodes += 1
+                return slot
+            self.num_collisions += 1
+
+        self.num_dropped += 1
+        return NO_CHILD
+
+
+def _get_key(node, bit):
+    # The root has the zero key.
+    return 2 * node + bit + 1
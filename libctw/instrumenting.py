@@ -0,0 +1,259 @@
+"""Opt-in instrumentation of models.
+
+The methods of an instrumented model are replaced on the instance
+by wrappers that count the calls, measure the time
+and collect histograms of the context and path lengths.
+The class methods stay untouched, so models without instrumentation
+have no overhead.
+
+The timers can nest. E.g., the "advance" timer includes
+the time of the "extract", "walk" and "update" timers.
+"""
+
+from array import array
+import json
+import sys
+import timeit
+
+from libctw import ctw, extracting, array_ctw, hashed_ctw
+from libctw import factored as _factored
+
+_timer = timeit.default_timer
+
+# The timed methods of _CtModel and the names of their timers.
+_CT_TIMERS = [
+        ("_get_context", "extract"),
+        ("_get_context_path", "walk"),
+        ("_get_existing_path", "walk_existing"),
+        ("_update_path", "update"),
+        ("_revert_path", "revert"),
+        ("_predict_one_on_path", "predict"),
+        ("advance", "advance"),
+        ]
+
+
+def instrument(model):
+    """Starts recording the activity of a _CtModel or a _Factored model.
+    Returns a recorder with the collected statistics.
+    """
+    if isinstance(model, _factored._Factored):
+        return _FactoredRecorder(model)
+    return _Recorder(model)
+
+
+class _Recorder:
+    """Records the activity of a context tree model.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.counters = {}
+        self.timers = {}
+        self.histograms = {}
+        self.wrapped = []
+
+        observers = {
+                "_get_context": self._observe_context,
+                "_update_path": self._observe_update,
+                }
+        for name, timer_name in _CT_TIMERS:
+            self._wrap(model, name, timer_name, observers.get(name))
+        self._wrap(model, "_check_immpossible_history", "check",
+                counted_error=ctw.ImpossibleHistoryError)
+        if isinstance(model.extractor, extracting.VarExtractor):
+            self._wrap(model.extractor, "_extract_short_context",
+                    "extract_short")
+
+    def _wrap(self, obj, name, timer_name, observe=None,
+            counted_error=None):
+        """Replaces the method of the object by a timed wrapper.
+        An observer is called with the method arguments and result.
+        The raised counted errors are counted.
+        """
+        method = getattr(obj, name)
+        timer = self.timers.setdefault(timer_name, [0, 0.0])
+        counters = self.counters
+        def wrapper(*args, **kwargs):
+            start = _timer()
+            try:
+                result = method(*args, **kwargs)
+            except Exception, e:
+                if counted_error is not None and isinstance(e, counted_error):
+                    error_name = counted_error.__name__
+                    counters[error_name] = counters.get(error_name, 0) + 1
+                raise
+            finally:
+                timer[0] += 1
+                timer[1] += _timer() - start
+
+            if observe is not None:
+                observe(args, result)
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        setattr(obj, name, wrapper)
+        self.wrapped.append((obj, name))
+
+    def _observe_context(self, args, context):
+        _add_to_histogram(self.histograms, "context_length", len(context))
+
+    def _observe_update(self, args, result):
+        path = args[0]
+        _add_to_histogram(self.histograms, "path_length", len(path))
+
+    def detach(self):
+        """Restores the original methods.
+        The collected statistics are kept.
+        """
+        for obj, name in reversed(self.wrapped):
+            if name in obj.__dict__:
+                del obj.__dict__[name]
+        self.wrapped = []
+
+    def reset(self):
+        """Clears the collected statistics.
+        """
+        self.counters.clear()
+        for timer in self.timers.itervalues():
+            timer[:] = [0, 0.0]
+        self.histograms.clear()
+
+    def get_stats(self):
+        """Returns a dict with the collected statistics
+        and the current size of the model.
+        """
+        num_nodes = count_nodes(self.model)
+        return dict(
+                counters=dict(self.counters),
+                timers=_format_timers(self.timers),
+                histograms=_format_histograms(self.histograms),
+                num_nodes=num_nodes,
+                history_length=len(self.model.history),
+                memory=estimate_memory(self.model))
+
+    def dump(self, output):
+        """Writes the statistics as JSON to the output file.
+        """
+        json.dump(self.get_stats(), output, indent=1, sort_keys=True)
+        output.write("\n")
+
+
+class _FactoredRecorder:
+    """Records the activity of all context trees of a factored model.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.recorders = [_Recorder(ct) for ct in model.cts]
+
+    def detach(self):
+        for recorder in self.recorders:
+            recorder.detach()
+
+    def reset(self):
+        for recorder in self.recorders:
+            recorder.reset()
+
+    def get_stats(self):
+        """Returns the statistics summed over the factors.
+        The statistics of each factor are under the "factors" key.
+        """
+        factors = [recorder.get_stats() for recorder in self.recorders]
+        counters = {}
+        timers = {}
+        histograms = {}
+        for recorder in self.recorders:
+            for name, value in recorder.counters.iteritems():
+                counters[name] = counters.get(name, 0) + value
+            for name, (num_calls, seconds) in recorder.timers.iteritems():
+                timer = timers.setdefault(name, [0, 0.0])
+                timer[0] += num_calls
+                timer[1] += seconds
+            for name, histogram in recorder.histograms.iteritems():
+                for value, count in histogram.iteritems():
+                    _add_to_histogram(histograms, name, value, count)
+
+        return dict(
+                counters=counters,
+                timers=_format_timers(timers),
+                histograms=_format_histograms(histograms),
+                num_nodes=sum(stats["num_nodes"] for stats in factors),
+                history_length=len(self.model.history),
+                memory=estimate_memory(self.model),
+                factors=factors)
+
+    def dump(self, output):
+        json.dump(self.get_stats(), output, indent=1, sort_keys=True)
+        output.write("\n")
+
+
+def _add_to_histogram(histograms, name, value, count=1):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = {}
+    histogram[value] = histogram.get(value, 0) + count
+
+
+def _format_timers(timers):
+    result = {}
+    for name, (num_calls, seconds) in timers.iteritems():
+        if num_calls:
+            result[name] = dict(calls=num_calls, seconds=seconds)
+    return result
+
+
+def _format_histograms(histograms):
+    # JSON keys are strings, so the histograms are lists of pairs.
+    return dict((name, sorted(histogram.iteritems()))
+            for name, histogram in histograms.iteritems())
+
+
+def count_nodes(model):
+    """Returns the number of context tree nodes of the model.
+    """
+    if isinstance(model, _factored._Factored):
+        return sum(count_nodes(ct) for ct in model.cts)
+    if isinstance(model, array_ctw._ArrayCtModel):
+        return len(model.nodes)
+
+    num_nodes = 0
+    stack = [model.root]
+    while stack:
+        node = stack.pop()
+        num_nodes += 1
+        stack.extend(child for child in node.children if child is not None)
+    return num_nodes
+
+
+def estimate_memory(model):
+    """Returns the approximate number of bytes used by the model.
+    Only the context trees and the histories are counted.
+    """
+    history_bytes = sys.getsizeof(model.history)
+    if isinstance(model.history, extracting.BoundedHistory):
+        history_bytes += sys.getsizeof(model.history.bits)
+
+    if isinstance(model, _factored._Factored):
+        # The trees share the history.
+        return history_bytes + sum(estimate_memory(ct) - history_bytes
+                for ct in model.cts)
+
+    if isinstance(model, hashed_ctw._HashedCtModel):
+        # The table is preallocated.
+        return (model.nodes.num_slots * hashed_ctw.BYTES_PER_NODE +
+                history_bytes)
+    elif isinstance(model, array_ctw._ArrayCtModel):
+        node_bytes = sum(array(typecode).itemsize
+                for name, typecode in array_ctw.COLUMNS)
+    else:
+        node_bytes = _get_node_object_bytes()
+
+    return count_nodes(model) * node_bytes + history_bytes
+
+
+def _get_node_object_bytes():
+    node = ctw._Node()
+    node_bytes = (sys.getsizeof(node) + sys.getsizeof(node.__dict__) +
+            sys.getsizeof(node.counts) + sys.getsizeof(node.children))
+    # The log_p_* floats are not shared after an update.
+    node_bytes += 3 * sys.getsizeof(1.0)
+    return node_bytes
@@ -0,0 +1,182 @@
+"""Merging of context trees trained on separate sequences.
+
+The estimates of a node depend only on its counts,
+its uncovered bits and its children. A sequence after
+switch_history() updates the nodes independently of the other
+sequences, so the trees trained on separate sequences can be merged
+by summing the counts and the uncovered terms. The estimates are then
+recomputed bottom-up on the merged nodes.
+The merged model is equal to a model trained on all the sequences
+serially, up to the rounding errors.
+"""
+
+from array import array
+import math
+import multiprocessing
+
+from libctw import ctw, array_ctw, storing
+from libctw import factored as _factored
+
+_LOG_GAMMA_HALF = math.lgamma(0.5)
+
+
+def merge(model, other):
+    """Adds the trained context trees of the other model to the model.
+    The model has to use the "nodes" storage.
+    The other model could use any storage.
+    The history of the model is kept.
+    ImpossibleHistoryError is raised if the merged counts
+    are impossible for the deterministic estimator.
+    """
+    if isinstance(model, _factored._Factored):
+        if not isinstance(other, _factored._Factored) or (
+                len(other.cts) != len(model.cts)):
+            raise ValueError("The models have different factors.")
+        for ct, other_ct in zip(model.cts, other.cts):
+            merge(ct, other_ct)
+        return
+
+    _check_mergeable(model, other)
+    _merge_nodes(model, storing.get_node_arrays(other))
+    model._check_immpossible_history()
+
+
+def train_sharded(model, sequences, num_processes=None):
+    """Trains the model on the given sequences of bits.
+    The sequences are split to shards trained by separate processes.
+    A process per CPU is used if num_processes is None.
+    The result is equal to a serial training
+    with switch_history() before each sequence.
+    The model is left with an empty history.
+    """
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    if isinstance(model, _factored._Factored):
+        cts = model.cts
+        config = [_get_config(ct) for ct in cts]
+    else:
+        cts = [model]
+        config = _get_config(model)
+    for ct in cts:
+        _check_storage(ct)
+
+    shards = _split_to_shards(sequences, num_processes)
+
+    pool = multiprocessing.Pool(len(shards))
+    try:
+        results = pool.map(_train_shard,
+                [(config, shard) for shard in shards])
+    finally:
+        pool.terminate()
+
+    for trees in results:
+        for ct, columns in zip(cts, trees):
+            _merge_nodes(ct, array_ctw._NodeArrays(
+                [array(typecode, data) for typecode, data in columns]))
+    model.switch_history()
+    for ct in cts:
+        ct._check_immpossible_history()
+
+
+def _check_storage(model):
+    if model.__class__ is not ctw._CtModel:
+        raise ValueError("Only a model with the nodes storage"
+                " could be merged into.")
+
+
+def _check_mergeable(model, other):
+    _check_storage(model)
+    if isinstance(other, _factored._Factored):
+        raise ValueError("The models have different factors.")
+    if model.estim_update is not other.estim_update:
+        raise ValueError("The models have different estimators.")
+    if (storing._describe_extractor(model.extractor) !=
+            storing._describe_extractor(other.extractor)):
+        raise ValueError("The models have different contexts.")
+
+
+def _merge_nodes(model, nodes):
+    """Adds the nodes from the _NodeArrays to the tree of the model.
+    The merged nodes are recomputed after their children.
+    """
+    estim_update = model.estim_update
+    stack = [(model.root, array_ctw.ROOT, False)]
+    while stack:
+        node, index, children_merged = stack.pop()
+        if children_merged:
+            node.log_p_estim = _calc_log_p_estim(node.counts, estim_update)
+            node.recalculate_pw()
+            continue
+
+        node.counts[0] += nodes.counts[0][index]
+        node.counts[1] += nodes.counts[1][index]
+        node.log_p_uncovered += nodes.log_p_uncovered[index]
+        stack.append((node, index, True))
+        for bit in [0, 1]:
+            child_index = nodes.get_child(index, bit)
+            if child_index == array_ctw.NO_CHILD:
+                continue
+            child = node.children[bit]
+            if child is None:
+                child = ctw._Node()
+                node.children[bit] = child
+            stack.append((child, child_index, False))
+
+
+def _calc_log_p_estim(counts, estim_update):
+    """Returns the log_p_estim of a node with the given counts.
+    """
+    if estim_update is ctw._determ_estim_update:
+        return ctw._recalculate_log_p_estim(counts, estim_update)
+
+    # The KT probability is a product of the (count + 0.5)/(total + 1)
+    # updates. It is independent of the order of the bits.
+    num_zeros, num_ones = counts
+    return (math.lgamma(num_zeros + 0.5) + math.lgamma(num_ones + 0.5) -
+            2 * _LOG_GAMMA_HALF - math.lgamma(num_zeros + num_ones + 1))
+
+
+def _split_to_shards(sequences, num_shards):
+    """Splits the sequences to shards with similar numbers of bits.
+    No shard is empty.
+    """
+    num_shards = max(1, min(num_shards, len(sequences)))
+    shards = [[] for i in xrange(num_shards)]
+    sizes = [0] * num_shards
+    for seq in sorted(sequences, key=len, reverse=True):
+        smallest = sizes.index(min(sizes))
+        shards[smallest].append(seq)
+        sizes[smallest] += len(seq)
+    return shards
+
+
+def _get_config(model):
+    """Returns a picklable description of an untrained copy.
+    The tree of the model isn't pickled.
+    """
+    return (storing.get_estimator_name(model.estim_update), model.extractor)
+
+
+def _train_shard(args):
+    config, shard = args
+    if isinstance(config, list):
+        model = _factored.create_factored_model(
+                [_create_untrained(ct_config) for ct_config in config])
+        cts = model.cts
+    else:
+        model = _create_untrained(config)
+        cts = [model]
+
+    for seq in shard:
+        model.switch_history()
+        model.see_generated(seq)
+
+    return [[(column.typecode, column.tostring())
+        for column in storing.get_node_arrays(ct).get_columns()]
+        for ct in cts]
+
+
+def _create_untrained(config):
+    estimator, extractor = config
+    return ctw.create_context_based_model(extractor,
+            deterministic=(estimator == "determ"))
@@ -9,19 +9,31 @@ http://www.sps.ele.tue.nl/members/F.M.J.Willems/RESEARCH_files/CTW/ResearchCTW.h
 
 import math
 
+MAX_EXACT_KT_COUNT = 170
+LOG_ONE = 0.0
+LOG_ONE_HALF = math.log(0.5)
+LOG_ZERO = float("-inf")
 
-def create_model(deterministic=False):
+
+def create_model(deterministic=False, indexed=False, max_depth=None):
+    """Creates a model computing the textbook recursion.
+    The indexed model computes the same probabilities
+    in the log space, in time proportional to the number
+    of the context occurrences.
+    """
     if deterministic:
         estimator = _estim_determ_p
     else:
         estimator = _estim_kt_p
 
-    return _CtwModel(estimator)
+    if indexed:
+        return _CtwModel(_IndexedContexted(estimator, max_depth))
+    return _CtwModel(_Contexted(estimator, max_depth))
 
 
 class _CtwModel:
-    def __init__(self, estimator):
-        self.contexted = _Contexted(estimator)
+    def __init__(self, contexted):
+        self.contexted = contexted
         self.seen = ""
 
     def see_generated(self, bits):
@@ -31,13 +43,17 @@ class _CtwModel:
         """Computes the conditional probability
         P(next_bit=1|seen_bits).
         """
-        return (self.contexted.calc_p("", self.seen + "1") /
-                float(self.contexted.calc_p("", self.seen)))
+        return math.exp(self.contexted.calc_log_p("", self.seen + "1") -
+                self.contexted.calc_log_p("", self.seen))
 
 
 class _Contexted:
-    def __init__(self, estimator):
+    def __init__(self, estimator, max_depth=None):
         self.estimator = estimator
+        self.max_depth = max_depth
+
+    def calc_log_p(self, context, seq):
+        return math.log(self.calc_p(context, seq))
 
     def calc_p(self, context, seq):
         """Estimates the probability of some bits from the given sequence.
@@ -47,6 +63,8 @@ class _Contexted:
         num_zeros, num_ones = _count_followers(context, seq)
         if num_zeros == 0 and num_ones == 0:
             return 1.0
+        if len(context) == self.max_depth:
+            return self.estimator(num_zeros, num_ones)
 
         p0context = self.calc_p("0" + context, seq)
         p1context = self.calc_p("1" + context, seq)
@@ -68,6 +86,193 @@ class _Contexted:
         return result
 
 
+class _IndexedContexted:
+    """Computes the same recursion as _Contexted in the log space,
+    so long sequences don't underflow.
+    The occurrences of a context are found from the occurrences
+    of its parent context. The occurrences are partitioned
+    by the bit before them, so no context is searched for.
+
+    A context occurring once has P = 0.5, so its subtree is cut off.
+    A run of contexts extended by the same bits at all their occurrences
+    is weighted without visiting each context.
+    Such contexts differ only by the occurrences at the sequence start.
+    The runs are found by comparing the bits before the occurrences,
+    so a repeated sequence is not walked context by context.
+    """
+    def __init__(self, estimator, max_depth=None):
+        self.estimator = estimator
+        self.max_depth = max_depth
+        # A context followed by one bit is weighted with its
+        # children contexts followed by the same bit.
+        # Its probability is the estimated probability of one bit.
+        assert estimator(1, 0) == estimator(0, 1) == 0.5
+
+    def calc_p(self, context, seq):
+        return math.exp(self.calc_log_p(context, seq))
+
+    def calc_log_p(self, context, seq):
+        # An occurrence is given by the index of its following bit.
+        ends = [i + len(context) for i in xrange(len(seq) - len(context))
+                if seq.startswith(context, i)]
+        reversed_seq = seq[::-1]
+        # An explicit stack is used instead of a recursion,
+        # because the contexts could be long.
+        results = []
+        stack = [(ends, len(context), None)]
+        while stack:
+            ends, depth, bottom = stack.pop()
+            if bottom is not None:
+                p1context = results.pop()
+                p0context = results.pop()
+                childrens_log_p = p0context + p1context
+                if bottom in ends:
+                    # The context is at the sequence start.
+                    childrens_log_p += LOG_ONE_HALF
+                alive = [end for end in ends if end >= bottom]
+                log_pw = self._weight(_count_followers_at(alive, seq),
+                        childrens_log_p)
+                results.append(self._weight_run(ends, depth, bottom, seq,
+                    log_pw))
+                continue
+
+            if len(ends) <= 1:
+                results.append(LOG_ONE_HALF if ends else LOG_ONE)
+                continue
+
+            bottom = self._find_branching(ends, depth, reversed_seq)
+            alive = [end for end in ends if end >= bottom]
+            if bottom == self.max_depth:
+                log_pw = self._log_estim(_count_followers_at(alive, seq))
+            elif len(alive) == 1:
+                log_pw = LOG_ONE_HALF
+            else:
+                children = ([], [])
+                for end in alive:
+                    if end > bottom:
+                        children[seq[end - bottom - 1] == "1"].append(end)
+                stack.append((ends, depth, bottom))
+                stack.append((children[1], bottom + 1, None))
+                stack.append((children[0], bottom + 1, None))
+                continue
+
+            results.append(self._weight_run(ends, depth, bottom, seq, log_pw))
+
+        return results[0]
+
+    def _find_branching(self, ends, depth, reversed_seq):
+        """Returns the depth of the first context below the given depth
+        with two children, a single occurrence or the max depth.
+        The contexts above it have at most one child.
+        """
+        ends = sorted(ends)
+        longest = ends[-1]
+        # Only the longest occurrence is left below the second longest.
+        bottom = ends[-2] + 1
+        if self.max_depth is not None:
+            bottom = min(bottom, self.max_depth)
+        longest_start = len(reversed_seq) - (longest - depth)
+        for end in ends[:-1]:
+            num_before = end - depth
+            num_common = _count_common_prefix(reversed_seq,
+                    len(reversed_seq) - num_before, longest_start,
+                    min(num_before, bottom - depth))
+            if num_common < num_before:
+                bottom = min(bottom, depth + num_common)
+        return bottom
+
+    def _weight_run(self, ends, depth, bottom, seq, log_pw):
+        """Returns the log_pw of the context at the given depth.
+        The log_pw of the context at the bottom depth is given.
+        The contexts above the bottom have at most one child.
+        They lose only the occurrences at the sequence start.
+        """
+        alive = [end for end in ends if end >= bottom]
+        counts = _count_followers_at(alive, seq)
+        node_depth = bottom
+        for end in sorted((end for end in ends if end < bottom),
+                reverse=True):
+            log_pw = self._weight_chain(counts, node_depth - end - 1, log_pw)
+            counts[seq[end] == "1"] += 1
+            # The context is at the sequence start.
+            log_pw = self._weight(counts, log_pw + LOG_ONE_HALF)
+            node_depth = end
+        return self._weight_chain(counts, node_depth - depth, log_pw)
+
+    def _weight_chain(self, counts, num_contexts, log_pw):
+        """Returns the log_pw of the top of a chain
+        of the given number of contexts with the same counts.
+        The log_pw of the context below the chain is given.
+        """
+        if num_contexts == 0:
+            return log_pw
+        log_weight = num_contexts * LOG_ONE_HALF
+        # log((1 - weight) * p_estim + weight * pw)
+        return _log_add(
+                math.log1p(-math.exp(log_weight)) + self._log_estim(counts),
+                log_weight + log_pw)
+
+    def _weight(self, counts, childrens_log_p):
+        return LOG_ONE_HALF + _log_add(self._log_estim(counts),
+                childrens_log_p)
+
+    def _log_estim(self, counts):
+        num_zeros, num_ones = counts
+        if (self.estimator is _estim_kt_p and
+                num_zeros + num_ones > MAX_EXACT_KT_COUNT):
+            return _log_estim_kt_p(num_zeros, num_ones)
+
+        p = self.estimator(num_zeros, num_ones)
+        if p == 0:
+            return LOG_ZERO
+        return math.log(p)
+
+
+def _count_followers_at(ends, seq):
+    """Returns the numbers of the zeros and ones at the given indexes.
+    """
+    num_ones = 0
+    for end in ends:
+        if seq[end] == "1":
+            num_ones += 1
+    return [len(ends) - num_ones, num_ones]
+
+
+def _log_add(a_log_p, b_log_p):
+    """Returns log(exp(a_log_p) + exp(b_log_p)).
+    """
+    if a_log_p < b_log_p:
+        a_log_p, b_log_p = b_log_p, a_log_p
+    if b_log_p == LOG_ZERO:
+        return a_log_p
+    return a_log_p + math.log1p(math.exp(b_log_p - a_log_p))
+
+
+def _count_common_prefix(text, start1, start2, limit):
+    """Returns the number of the equal chars from the given starts,
+    up to the limit.
+    The compared slices grow, so a short prefix is found fast.
+    """
+    num_common = 0
+    size = 1
+    while num_common < limit:
+        end = min(num_common + size, limit)
+        if (text[start1 + num_common:start1 + end] !=
+                text[start2 + num_common:start2 + end]):
+            # The first difference is found by bisection.
+            while end - num_common > 1:
+                middle = (num_common + end) // 2
+                if (text[start1 + num_common:start1 + middle] ==
+                        text[start2 + num_common:start2 + middle]):
+                    num_common = middle
+                else:
+                    end = middle
+            return num_common
+        num_common = end
+        size *= 2
+    return num_common
+
+
 def _count_followers(context, seq):
     # Efficiency is ignored here.
     # Better algorithms exist.
@@ -103,6 +308,10 @@ def _estim_kt_p(num_zeros, num_ones):
         with Dirichlet(1/2.0,1/2.0) prior P(theta).
     The resulting Bayesian mixture is a "Krichevski-Trofimov" estimator.
     """
+    if num_zeros + num_ones > MAX_EXACT_KT_COUNT:
+        # The factorial would not fit into a float.
+        return math.exp(_log_estim_kt_p(num_zeros, num_ones))
+
     a_mul = 1.0
     for i in xrange(num_zeros):
         a_mul *= i + 0.5
@@ -113,3 +322,7 @@ def _estim_kt_p(num_zeros, num_ones):
 
     return a_mul * b_mul / float(math.factorial(num_zeros + num_ones))
 
+
+def _log_estim_kt_p(num_zeros, num_ones):
+    return (math.lgamma(num_zeros + 0.5) + math.lgamma(num_ones + 0.5) -
+            2 * math.lgamma(0.5) - math.lgamma(num_zeros + num_ones + 1))
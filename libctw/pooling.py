@@ -0,0 +1,142 @@
+"""Serving of many sessions by one model.
+
+Each session has its own history, but all sessions share
+the context tree of the model. The history of a session is attached
+to the model before each operation, so the tree is never copied.
+
+The generated bits of a session update the tree lazily.
+They are appended to the session history at once,
+so the next predictions use the right context,
+but the tree is updated by them only on flush().
+Until then, all sessions are predicted by the same tree.
+
+A pool is not thread-safe.
+"""
+
+from libctw import ctw
+from libctw import factored as _factored
+
+# The pending bits have to stay revertible in a bounded history.
+MAX_PENDING_BITS = ctw.NUM_REVERTIBLE_BITS
+
+
+class SessionPool:
+    def __init__(self, model):
+        """Creates a pool serving sessions by the given
+        _CtModel or _Factored model.
+        """
+        self.model = model
+        self.sessions = {}
+        # The sessions with pending bits, in the order of their bits.
+        self.pending_ids = []
+        self.next_id = 0
+
+    def open_session(self):
+        """Starts a session with an empty history.
+        Returns the session id.
+        """
+        session_id = self.next_id
+        self.next_id += 1
+        self.sessions[session_id] = _Session(self.model._create_history())
+        return session_id
+
+    def close_session(self, session_id):
+        """Forgets the session history.
+        Its pending bits update the tree before that.
+        """
+        self._flush_session(session_id)
+        del self.sessions[session_id]
+
+    def get_num_sessions(self):
+        return len(self.sessions)
+
+    def see_generated(self, session_id, bits):
+        """Appends the generated bits to the session history.
+        The tree is updated by them on flush().
+        The bits are queued in chunks of at most MAX_PENDING_BITS.
+        The pending bits are applied before they would overflow.
+        """
+        session = self.sessions[session_id]
+        for start in xrange(0, len(bits), MAX_PENDING_BITS):
+            chunk = bits[start:start + MAX_PENDING_BITS]
+            if session.num_pending + len(chunk) > MAX_PENDING_BITS:
+                self._flush_session(session_id)
+
+            if session.num_pending == 0:
+                self.pending_ids.append(session_id)
+            session.history += chunk
+            session.offset += len(chunk)
+            session.num_pending += len(chunk)
+
+    def see_added(self, session_id, bits):
+        """Appends the bits to the session history.
+        The bits never update the tree.
+        """
+        self._flush_session(session_id)
+        self.sessions[session_id].history += bits
+
+    def predict_one(self, session_id):
+        """Returns P(Next_bit=1|session history).
+        """
+        self._attach(self.sessions[session_id])
+        return self.model.predict_one()
+
+    def predict_many(self, session_ids):
+        """Returns a list of predictions for the given sessions.
+        """
+        return [self.predict_one(session_id) for session_id in session_ids]
+
+    def flush(self):
+        """Updates the tree by the pending bits of all sessions.
+        The sessions are applied in the order of their first pending bit.
+        A session is removed from the pending sessions
+        only after its bits are applied.
+        A failed session is removed too, its pending bits were consumed.
+        """
+        num_applied = 0
+        try:
+            for session_id in self.pending_ids:
+                num_applied += 1
+                self._apply_pending(self.sessions[session_id])
+        finally:
+            del self.pending_ids[:num_applied]
+
+    def _flush_session(self, session_id):
+        session = self.sessions[session_id]
+        if session.num_pending > 0:
+            self.pending_ids.remove(session_id)
+            self._apply_pending(session)
+
+    def _apply_pending(self, session):
+        """Sees the pending bits by the model.
+        They are removed from the history and seen again.
+        """
+        num_pending = session.num_pending
+        bits = session.history[-num_pending:]
+        del session.history[-num_pending:]
+        session.offset -= num_pending
+        session.num_pending = 0
+        self._attach(session)
+        try:
+            self.model.see_generated(bits)
+        finally:
+            if isinstance(self.model, _factored._Factored):
+                session.offset = self.model.offset
+            else:
+                session.offset += num_pending
+
+    def _attach(self, session):
+        model = self.model
+        model.history = session.history
+        if isinstance(model, _factored._Factored):
+            model._share_history()
+            model.offset = session.offset % len(model.cts)
+
+
+class _Session:
+    def __init__(self, history):
+        self.history = history
+        # The number of seen generated bits.
+        # It selects the factor of a factored model.
+        self.offset = 0
+        self.num_pending = 0
@@ -0,0 +1,96 @@
+"""Search for the most probable continuations.
+
+The beam search keeps the given number of the most probable
+continuations. The model is moved between them by reverting
+and seeing bits, so no model is copied.
+The continuations are visited in the lexicographic order,
+so the neighbouring continuations share long prefixes
+and only their different suffixes are reverted and seen.
+"""
+
+import math
+
+from libctw import ctw
+
+DEFAULT_BEAM_WIDTH = 16
+
+
+def search(model, num_bits, beam_width=DEFAULT_BEAM_WIDTH, num_results=1):
+    """Returns the most probable continuations of the given length.
+    Returns a list of (bits, probability) pairs
+    sorted by a decreasing probability.
+    The probability of a continuation includes the model updates
+    by the continuation bits.
+    The model is returned to its original state,
+    up to the rounding errors of the reverting.
+    """
+    if beam_width < 1 or num_results < 1:
+        raise ValueError("The beam width and the number of results"
+                " have to be positive.")
+    if num_bits > ctw.NUM_REVERTIBLE_BITS:
+        raise ValueError("At most %s bits can be searched."
+                % ctw.NUM_REVERTIBLE_BITS)
+
+    mover = _Mover(model)
+    # The beam has (log_p, bits) pairs.
+    beam = [(ctw.LOG_ONE, ())]
+    candidates = beam
+    try:
+        for i in xrange(num_bits):
+            candidates = []
+            for log_p, bits in sorted(beam, key=_get_bits):
+                mover.move_to(bits)
+                one_p = model.predict_one()
+                for bit, bit_p in [(0, 1 - one_p), (1, one_p)]:
+                    # The impossible continuations are not seen,
+                    # so the deterministic prior doesn't fail.
+                    if bit_p > 0:
+                        candidates.append((log_p + math.log(bit_p),
+                            bits + (bit,)))
+
+            candidates.sort(key=_get_order)
+            beam = candidates[:beam_width]
+    finally:
+        mover.move_to(())
+
+    # The results are taken from all the last candidates,
+    # so more results than the beam width could be returned.
+    return [(list(bits), math.exp(log_p))
+            for log_p, bits in candidates[:num_results]]
+
+
+def _get_bits(hypothesis):
+    return hypothesis[1]
+
+
+def _get_order(hypothesis):
+    # The more probable first. The ties are broken toward the bigger bits,
+    # as by choose_bit(), so a beam of width 1 equals the greedy advance().
+    log_p, bits = hypothesis
+    return -log_p, [-bit for bit in bits]
+
+
+class _Mover:
+    """Moves the model between continuations.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.bits = ()
+
+    def move_to(self, bits):
+        """Lets the model see the given continuation.
+        Only the bits after the common prefix
+        with the current continuation are reverted and seen.
+        """
+        common_len = _get_common_prefix_len(self.bits, bits)
+        self.model.revert_generated(len(self.bits) - common_len)
+        self.model.see_generated(bits[common_len:])
+        self.bits = bits
+
+
+def _get_common_prefix_len(a, b):
+    length = min(len(a), len(b))
+    for i in xrange(length):
+        if a[i] != b[i]:
+            return i
+    return length
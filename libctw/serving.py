@@ -0,0 +1,305 @@
+"""A server keeping warm models in memory.
+
+The clients send requests as lines of JSON.
+A response line is sent for each request, in the order of the requests.
+The requests received in one poll are executed as a batch.
+The batch is grouped by the model, so a model handles
+its requests together and repeated predictions are computed once.
+
+A connection isn't read while it has too many unanswered requests
+or unsent responses. The client is then slowed down by TCP.
+
+Request examples:
+{"op": "create", "model": "m", "depth": 16}
+{"op": "see_generated", "model": "m", "bits": "0110"}
+{"op": "predict", "model": "m"}
+{"op": "generate", "model": "m", "num_bits": 8}
+"""
+
+import asynchat
+import asyncore
+import json
+import logging
+import os
+import socket
+import stat
+
+from libctw import ctw, byting, formatting
+from libctw import factored as _factored
+
+MAX_PENDING_REQUESTS = 64
+MAX_GENERATED_BITS = 2**16
+MAX_MEMORY_MB = 2**16
+MAX_LINE_LENGTH = 16 * 2**20
+POLL_TIMEOUT = 1.0
+
+
+class ModelRegistry:
+    """Named models and the execution of requests on them.
+    """
+    def __init__(self):
+        self.models = {}
+
+    def execute(self, request):
+        return self.execute_batch([request])[0]
+
+    def execute_batch(self, requests):
+        """Returns the responses to the requests.
+        The requests of the same model are executed in their order.
+        """
+        by_model = {}
+        model_names = []
+        for index, request in enumerate(requests):
+            name = None
+            if isinstance(request, dict):
+                name = request.get("model")
+            if name not in by_model:
+                by_model[name] = []
+                model_names.append(name)
+            by_model[name].append(index)
+
+        responses = [None] * len(requests)
+        for name in model_names:
+            # The prediction is reused until the model is changed.
+            cache = {}
+            for index in by_model[name]:
+                responses[index] = self._execute(requests[index], cache)
+        return responses
+
+    def _execute(self, request, cache):
+        response = {}
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("A request has to be a JSON object.")
+            response["id"] = request.get("id")
+            op = request.get("op")
+            handler = getattr(self, "_op_" + str(op), None)
+            if handler is None:
+                raise ValueError("Unknown op: %s" % op)
+            if op != "predict":
+                cache.clear()
+            response["result"] = handler(request, cache)
+            response["ok"] = True
+        except (ValueError, KeyError, TypeError,
+                ctw.ImpossibleHistoryError), e:
+            cache.clear()
+            response["ok"] = False
+            response["error"] = str(e)
+        except Exception, e:
+            # A failed request must not stop the other requests.
+            logging.exception("request failed: %r", request)
+            cache.clear()
+            response["ok"] = False
+            response["error"] = str(e)
+        return response
+
+    def _get_model(self, request):
+        name = request["model"]
+        if name not in self.models:
+            raise ValueError("Unknown model: %s" % name)
+        return self.models[name]
+
+    def _op_create(self, request, cache):
+        name = request["model"]
+        if name in self.models and not request.get("replace"):
+            raise ValueError("The model exists: %s" % name)
+        storage = request.get("storage", "nodes")
+        if storage not in ctw.STORAGES:
+            raise ValueError("Unknown storage: %s" % storage)
+
+        deterministic = request.get("estimator", "kt") == "determ"
+        depth = request.get("depth")
+        if depth is not None:
+            depth = _get_int(request, "depth", 0, None)
+        memory_budget = _get_int(request, "memory", 1, MAX_MEMORY_MB,
+                default=64) * 2**20
+        if request.get("bytes"):
+            model = _factored.create_model(deterministic, depth,
+                    storage=storage, memory_budget=memory_budget)
+        else:
+            model = ctw.create_model(deterministic, depth,
+                    storage=storage, memory_budget=memory_budget)
+        self.models[name] = model
+        return name
+
+    def _op_delete(self, request, cache):
+        self._get_model(request)
+        del self.models[request["model"]]
+        return None
+
+    def _op_list(self, request, cache):
+        return sorted(self.models)
+
+    def _op_see_generated(self, request, cache):
+        bits = _get_bits(request)
+        self._get_model(request).see_generated(bits)
+        return len(bits)
+
+    def _op_see_added(self, request, cache):
+        bits = _get_bits(request)
+        self._get_model(request).see_added(bits)
+        return len(bits)
+
+    def _op_switch_history(self, request, cache):
+        self._get_model(request).switch_history()
+        return None
+
+    def _op_predict(self, request, cache):
+        """Returns P(Next_bit=1|history).
+        A byte model at a byte boundary could return
+        the most probable bytes, if "top" is given.
+        """
+        model = self._get_model(request)
+        num_top = request.get("top")
+        if num_top is None:
+            if "p" not in cache:
+                cache["p"] = model.predict_one()
+            return cache["p"]
+
+        if not isinstance(model, _factored._Factored):
+            raise ValueError("Only byte models predict the top bytes.")
+        if "probs" not in cache:
+            cache["probs"] = model.predict_distribution()
+        return _factored.get_most_probable(cache["probs"], num_top)
+
+    def _op_generate(self, request, cache):
+        """Generates the most probable bits one by one.
+        Returns the bits and their probability.
+        """
+        model = self._get_model(request)
+        num_bits = _get_int(request, "num_bits", 0, MAX_GENERATED_BITS)
+        bits = []
+        probability = 1.0
+        for i in xrange(num_bits):
+            bit, bit_p = model.advance()
+            bits.append(bit)
+            probability *= bit_p
+        return dict(bits=formatting.to_seq(bits), p=probability)
+
+
+def _get_int(request, name, min_value, max_value, default=None):
+    """Returns the integer field of the request.
+    The value has to be in the [min_value, max_value] range.
+    A None max_value means no upper bound.
+    """
+    value = request.get(name, default)
+    if value is None:
+        raise KeyError(name)
+    if not isinstance(value, (int, long)) or isinstance(value, bool):
+        raise ValueError("The %s has to be an integer." % name)
+    if value < min_value or (max_value is not None and value > max_value):
+        raise ValueError("The %s is out of range: %s" % (name, value))
+    return value
+
+
+def _get_bits(request):
+    if "bytes" in request:
+        return byting.to_bits(request["bytes"].encode("latin-1"))
+
+    seq = str(request["bits"])
+    if len(seq.strip("01")) > 0:
+        raise ValueError("Expecting a sequence of 0s and 1s.")
+    return formatting.to_bits(seq)
+
+
+class Server(asyncore.dispatcher):
+    def __init__(self, address, registry=None):
+        """Listens on a (host, port) TCP address
+        or on a Unix socket path.
+        """
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        if registry is None:
+            registry = ModelRegistry()
+        self.registry = registry
+        self.queue = []
+
+        if isinstance(address, basestring):
+            _remove_stale_socket(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(5)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Connection(pair[0], self)
+
+    def enqueue(self, connection, line):
+        self.queue.append((connection, line))
+
+    def poll(self, timeout=POLL_TIMEOUT):
+        """Serves the ready sockets and executes the received requests.
+        """
+        asyncore.loop(timeout, map=self.map, count=1)
+        self.process_queue()
+
+    def process_queue(self):
+        queue = self.queue
+        self.queue = []
+        if not queue:
+            return
+
+        requests = []
+        for connection, line in queue:
+            try:
+                requests.append(json.loads(line))
+            except ValueError:
+                requests.append("invalid JSON")
+
+        responses = self.registry.execute_batch(requests)
+        for (connection, line), response in zip(queue, responses):
+            connection.send_response(response)
+
+    def serve_forever(self):
+        logging.info("serving on %s", self.socket.getsockname())
+        while True:
+            self.poll()
+
+
+class _Connection(asynchat.async_chat):
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.set_terminator("\n")
+        self.buffer = []
+        self.buffer_len = 0
+        self.num_pending = 0
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+        self.buffer_len += len(data)
+        if self.buffer_len > MAX_LINE_LENGTH:
+            logging.warning("closing a connection with a too long line")
+            self.close()
+
+    def found_terminator(self):
+        line = "".join(self.buffer)
+        self.buffer = []
+        self.buffer_len = 0
+        if line.strip():
+            self.num_pending += 1
+            self.server.enqueue(self, line)
+
+    def readable(self):
+        # No more requests are read, if the client isn't keeping up.
+        return (self.num_pending < MAX_PENDING_REQUESTS and
+                len(self.producer_fifo) < MAX_PENDING_REQUESTS and
+                asynchat.async_chat.readable(self))
+
+    def send_response(self, response):
+        self.num_pending -= 1
+        if self.connected:
+            self.push(json.dumps(response) + "\n")
+
+
+def _remove_stale_socket(path):
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if stat.S_ISSOCK(mode):
+        os.remove(path)
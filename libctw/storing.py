@@ -0,0 +1,287 @@
+"""Saving and loading of trained models.
+
+The file starts with a magic string.
+The node columns of the context trees follow, aligned to 8 bytes.
+A JSON header with the model configuration and the column offsets
+is at the end. It is located by the last 16 bytes of the file.
+
+A loaded model uses the "arrays" storage with memory-mapped columns.
+The pages of the file are read lazily, when the nodes are accessed.
+The mapping is private, so updates of the loaded model
+don't modify the file.
+"""
+
+from array import array
+import json
+import mmap
+import struct
+import sys
+
+from libctw import ctw, extracting, array_ctw, hashed_ctw, compressed_ctw
+from libctw import factored as _factored
+
+MAGIC = "LIBCTW\0\0"
+FORMAT_VERSION = 1
+_FOOTER = struct.Struct("<QQ")
+_ALIGNMENT = 8
+
+
+def save(model, filename):
+    """Saves a _CtModel or a _Factored model.
+    """
+    output = open(filename, "wb")
+    try:
+        _Writer(output).write_model(model)
+    finally:
+        output.close()
+
+
+def load(filename):
+    """Loads a saved model.
+    The node columns are memory-mapped.
+    """
+    input = open(filename, "rb")
+    try:
+        buffer = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_COPY)
+    finally:
+        input.close()
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a saved model: %s" % filename)
+    header_offset, header_len = _FOOTER.unpack_from(buffer,
+            len(buffer) - _FOOTER.size)
+    header = json.loads(buffer[header_offset:header_offset + header_len])
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported format version: %s" % header["version"])
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Unsupported byte order: %s" % header["byteorder"])
+
+    cts = [_load_tree(buffer, tree) for tree in header["trees"]]
+    if not header["factored"]:
+        return cts[0]
+
+    model = _factored.create_factored_model(cts)
+    model.offset = header["offset"]
+    return model
+
+
+class _Writer:
+    def __init__(self, output):
+        self.output = output
+        self.output.write(MAGIC)
+        self.position = len(MAGIC)
+
+    def write_model(self, model):
+        if isinstance(model, _factored._Factored):
+            header = dict(factored=True, offset=model.offset,
+                    trees=[self._write_tree(ct) for ct in model.cts])
+        else:
+            header = dict(factored=False,
+                    trees=[self._write_tree(model)])
+
+        header.update(version=FORMAT_VERSION, byteorder=sys.byteorder)
+        header_offset = self.position
+        data = json.dumps(header)
+        self.output.write(data)
+        self.output.write(_FOOTER.pack(header_offset, len(data)))
+
+    def _write_tree(self, model):
+        nodes = get_node_arrays(model)
+        columns = {}
+        for (name, typecode), column in zip(array_ctw.COLUMNS,
+                nodes.get_columns()):
+            if not isinstance(column, array):
+                column = array(typecode, column)
+            columns[name] = self._write_column(column)
+
+        history = array("B", model.history)
+        return dict(
+                estimator=get_estimator_name(model.estim_update),
+                extractor=_describe_extractor(model.extractor),
+                num_nodes=len(nodes),
+                columns=columns,
+                history_len=len(model.history),
+                history=self._write_column(history))
+
+    def _write_column(self, column):
+        padding = -self.position % _ALIGNMENT
+        self.output.write("\0" * padding)
+        self.position += padding
+
+        offset = self.position
+        column.tofile(self.output)
+        self.position += len(column) * column.itemsize
+        return dict(offset=offset, typecode=column.typecode,
+                length=len(column))
+
+
+def get_estimator_name(estim_update):
+    if estim_update is ctw._determ_estim_update:
+        return "determ"
+    elif estim_update is ctw._kt_estim_update:
+        return "kt"
+    else:
+        raise ValueError("Unknown estimator: %r" % estim_update)
+
+
+def get_node_arrays(model):
+    """Returns the context tree of the model as _NodeArrays.
+    The trees of other storages are copied.
+    The chains of a compressed tree are expanded.
+    """
+    if isinstance(model, hashed_ctw._HashedCtModel):
+        nodes = model.nodes
+        def get_children(slot):
+            return [_none_if_missing(nodes.get_child(slot, bit))
+                    for bit in [0, 1]]
+        def get_fields(slot):
+            return (nodes.log_p_estim[slot], nodes.log_pw[slot],
+                    nodes.log_p_uncovered[slot],
+                    nodes.counts[0][slot], nodes.counts[1][slot])
+        return _copy_tree(array_ctw.ROOT, get_children, get_fields)
+    elif isinstance(model, array_ctw._ArrayCtModel):
+        return model.nodes
+    elif isinstance(model, compressed_ctw._CompressedCtModel):
+        # A chain node is addressed by its bottom node and its depth.
+        def get_children(item):
+            node, depth = item
+            if depth < node.depth:
+                children = [None, None]
+                children[node.label[depth]] = (node, depth + 1)
+                return children
+            return [None if child is None else
+                    (child, child.depth - child.skip)
+                    for child in node.children]
+        def get_fields(item):
+            node, depth = item
+            if depth < node.depth:
+                return (node.log_p_estim, compressed_ctw._chain_log_pw(
+                    node.depth - depth, node.log_p_estim, node.log_pw),
+                    ctw.LOG_ONE, node.counts[0], node.counts[1])
+            return (node.log_p_estim, node.log_pw, node.log_p_uncovered,
+                    node.counts[0], node.counts[1])
+        return _copy_tree((model.root, 0), get_children, get_fields)
+    else:
+        def get_fields(node):
+            return (node.log_p_estim, node.log_pw, node.log_p_uncovered,
+                    node.counts[0], node.counts[1])
+        return _copy_tree(model.root, lambda node: node.children, get_fields)
+
+
+def _none_if_missing(slot):
+    if slot == array_ctw.NO_CHILD:
+        return None
+    return slot
+
+
+def _copy_tree(root, get_children, get_fields):
+    """Copies a tree to new _NodeArrays.
+    The nodes are numbered in the depth-first order.
+    """
+    result = array_ctw._NodeArrays()
+    stack = [(root, array_ctw.ROOT)]
+    while stack:
+        node, index = stack.pop()
+        (result.log_p_estim[index], result.log_pw[index],
+                result.log_p_uncovered[index],
+                result.counts[0][index], result.counts[1][index],
+                ) = get_fields(node)
+        for bit, child in enumerate(get_children(node)):
+            if child is not None:
+                child_index = result.add_node()
+                result.children[bit][index] = child_index
+                stack.append((child, child_index))
+
+    return result
+
+
+def _describe_extractor(extractor):
+    if isinstance(extractor, extracting.VarExtractor):
+        return dict(type="var",
+                max_depth=extractor.suffix_extractor.max_depth,
+                root_var=_describe_var(extractor.root_var))
+    else:
+        return dict(type="suffix", max_depth=extractor.max_depth)
+
+
+def _describe_var(var):
+    if var is None:
+        return None
+    return [var.index] + [_describe_var(child) for child in var.children]
+
+
+def _create_extractor(description):
+    if description["type"] == "var":
+        return extracting.VarExtractor(_create_var(description["root_var"]),
+                description["max_depth"])
+    else:
+        return extracting.SuffixExtractor(description["max_depth"])
+
+
+def _create_var(description):
+    if description is None:
+        return None
+    index, child0, child1 = description
+    return extracting.Var(index, (_create_var(child0), _create_var(child1)))
+
+
+def _load_tree(buffer, tree):
+    model = ctw.create_context_based_model(
+            _create_extractor(tree["extractor"]),
+            deterministic=(tree["estimator"] == "determ"),
+            storage="arrays")
+    model.nodes = array_ctw._NodeArrays([
+        _MappedColumn(buffer, tree["columns"][name])
+        for name, typecode in array_ctw.COLUMNS])
+
+    bits = array("B", buffer[_get_column_slice(tree["history"])])
+    history = model._create_history()
+    if isinstance(history, extracting.BoundedHistory):
+        history = extracting.BoundedHistory(history.capacity,
+                tree["history_len"] - len(bits))
+    history += bits.tolist()
+    model.history = history
+    return model
+
+
+def _get_column_slice(description):
+    itemsize = array(str(description["typecode"])).itemsize
+    start = description["offset"]
+    return slice(start, start + description["length"] * itemsize)
+
+
+class _MappedColumn:
+    """A column of numbers stored in a memory-mapped file.
+    New items are appended to an in-memory array.
+    """
+    def __init__(self, buffer, description):
+        typecode = str(description["typecode"])
+        self.buffer = buffer
+        self.offset = description["offset"]
+        self.num_mapped = description["length"]
+        self.struct = struct.Struct("=" + typecode)
+        self.appended = array(typecode)
+        assert self.struct.size == self.appended.itemsize
+
+    def __len__(self):
+        return self.num_mapped + len(self.appended)
+
+    def __getitem__(self, index):
+        if index < self.num_mapped:
+            return self.struct.unpack_from(self.buffer,
+                    self.offset + index * self.struct.size)[0]
+        return self.appended[index - self.num_mapped]
+
+    def __setitem__(self, index, value):
+        if index < self.num_mapped:
+            self.struct.pack_into(self.buffer,
+                    self.offset + index * self.struct.size, value)
+        else:
+            self.appended[index - self.num_mapped] = value
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def append(self, value):
+        self.appended.append(value)
@@ -0,0 +1,82 @@
+"""Streaming of bits from files to models and from models to files.
+
+The functions are generators or consume generators,
+so an input of any length is processed chunk by chunk.
+The memory is then bounded by the model.
+Use a depth limit or the "hashed" storage to bound the model too.
+"""
+
+from libctw import byting, formatting, modeling
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\r\n"
+
+
+def read_chunks(input, chunk_size=CHUNK_SIZE):
+    """Yields chunks of the file content.
+    """
+    while True:
+        chunk = input.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_bit_chunks(chunks, bytes=False):
+    """Converts text chunks of 0s and 1s, or raw bytes, to lists of bits.
+    Whitespace is ignored in the text chunks.
+    """
+    for chunk in chunks:
+        if bytes:
+            if chunk:
+                yield byting.to_bits(chunk)
+            continue
+
+        seq = chunk.translate(None, _WHITESPACE)
+        if len(seq.strip("01")) > 0:
+            raise ValueError("Expecting a sequence of 0s and 1s.")
+        if seq:
+            yield formatting.to_bits(seq)
+
+
+def train(model, bit_chunks):
+    """Lets the model see the generated bits.
+    Returns the number of seen bits.
+    """
+    num_bits = 0
+    for bits in bit_chunks:
+        model.see_generated(bits)
+        num_bits += len(bits)
+    return num_bits
+
+
+def iter_predictions(model, num_bits):
+    """Yields (bit, probability) pairs of the generated continuation.
+    """
+    for i in xrange(num_bits):
+        symbol, p = modeling.advance(model)
+        yield int(symbol), p
+
+
+def write_predictions(output, predictions, bytes=False):
+    """Writes a line for each predicted bit: "bit probability".
+    With bytes, a line is written for each predicted byte:
+    "hex_value probability_of_bit_1 ... probability_of_bit_8".
+    """
+    bits = []
+    probs = []
+    for bit, p in predictions:
+        if not bytes:
+            output.write("%s %f\n" % (bit, p))
+            output.flush()
+            continue
+
+        bits.append(bit)
+        probs.append(p)
+        if len(bits) == 8:
+            value = ord(byting.from_bits(bits))
+            output.write("%02x %s\n" % (value,
+                " ".join("%f" % bit_p for bit_p in probs)))
+            output.flush()
+            bits = []
+            probs = []
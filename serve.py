@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Usage: %prog [options]
+Keeps CTW models in memory and serves requests on them.
+A request and its response are lines of JSON.
+
+Example:
+$ serve.py --port 8765 &
+$ printf '%s\\n' '{"op": "create", "model": "m"}' \\
+    '{"op": "see_generated", "model": "m", "bits": "01101"}' \\
+    '{"op": "generate", "model": "m", "num_bits": 10}' | nc -q 1 localhost 8765
+"""
+
+import optparse
+import logging
+
+from libctw import serving
+
+DEFAULTS = {
+        "host": "127.0.0.1",
+        "port": 8765,
+        "verbose": 0,
+        }
+
+def _parse_args():
+    parser = optparse.OptionParser(__doc__)
+    parser.add_option("--host",
+            help="the address to listen on (default=%(host)s)" % DEFAULTS)
+    parser.add_option("-p", "--port", type="int",
+            help="the TCP port to listen on (default=%(port)s)" % DEFAULTS)
+    parser.add_option("-u", "--unix", metavar="PATH",
+            help="listen on a Unix socket instead of TCP")
+    parser.add_option("-v", "--verbose", action="count",
+            help="increase verbosity")
+    parser.set_defaults(**DEFAULTS)
+
+    options, args = parser.parse_args()
+    if args:
+        parser.error("No arguments are expected.")
+    level = max(logging.DEBUG, logging.WARNING - 10*options.verbose)
+    logging.basicConfig(level=level)
+    return options
+
+
+def main():
+    options = _parse_args()
+    if options.unix:
+        address = options.unix
+    else:
+        address = (options.host, options.port)
+
+    server = serving.Server(address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
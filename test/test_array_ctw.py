@@ -0,0 +1,158 @@
+
+from nose.tools import eq_
+import random
+
+from libctw import ctw, factored
+from libctw.anycontext import creating
+from libctw.formatting import to_bits
+
+from test_ctw import eq_float_, iter_all_seqs
+
+
+def test_see():
+    for determ in [False, True]:
+        for max_depth in [None, 0, 3]:
+            for seq in iter_all_seqs(seq_len=8):
+                model = ctw.create_model(determ, max_depth, storage="arrays")
+                verifier = ctw.create_model(determ, max_depth)
+                _check_same_see(model, verifier, to_bits(seq))
+
+
+def test_predict_one():
+    for determ in [False, True]:
+        for max_depth in [None, 2]:
+            model = ctw.create_model(determ, max_depth, storage="arrays")
+            verifier = ctw.create_model(determ, max_depth)
+            for bit in to_bits("0110100110111"):
+                eq_float_(model.predict_one(), verifier.predict_one())
+                _check_same_see(model, verifier, [bit])
+
+
+def test_predict_without_updating():
+    model = ctw.create_model(storage="arrays")
+    model.see_generated(to_bits("0110100"))
+    num_nodes = len(model.nodes)
+    log_p = model.get_history_log_p()
+    model.predict_one()
+    eq_(len(model.nodes), num_nodes)
+    eq_(model.get_history_log_p(), log_p)
+
+
+def test_advance():
+    model = ctw.create_model(max_depth=4, storage="arrays")
+    verifier = ctw.create_model(max_depth=4)
+    model.see_generated(to_bits("0110"))
+    verifier.see_generated(to_bits("0110"))
+    for i in xrange(20):
+        eq_(model.advance(), verifier.advance())
+        eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+
+def test_revert_generated():
+    rand = random.Random(1)
+    bits = [rand.randint(0, 1) for i in xrange(50)]
+    model = ctw.create_model(max_depth=5, storage="arrays")
+    model.see_generated(bits[:30])
+    expected_log_p = model.get_history_log_p()
+
+    model.see_generated(bits[30:])
+    full_log_p = model.get_history_log_p()
+    model.revert_generated(20)
+    eq_float_(model.get_history_log_p(), expected_log_p)
+    eq_(list(model.history), bits[:30])
+
+    model.see_generated(bits[30:])
+    eq_float_(model.get_history_log_p(), full_log_p)
+
+
+def test_impossible_history():
+    model = ctw.create_model(deterministic=True, max_depth=2,
+            storage="arrays")
+    model.see_generated([0, 0, 0])
+    eq_(0.0, model.predict_one())
+
+    model.revert_generated(3)
+    eq_(0.5, model.predict_one())
+    model.see_generated([1, 1, 1])
+    eq_(1.0, model.predict_one())
+
+
+def test_switch_history():
+    model = ctw.create_model(deterministic=True, storage="arrays")
+    verifier = ctw.create_model(deterministic=True)
+    for seq in ["1101", "11", "0"]:
+        model.switch_history()
+        verifier.switch_history()
+        model.see_added([0])
+        verifier.see_added([0])
+        _check_same_see(model, verifier, to_bits(seq))
+
+
+def test_var_contexts():
+    bits = to_bits("0110111001011101111000110101")
+    for factored in [False, True]:
+        models = []
+        for storage in ctw.STORAGES:
+            historian = creating.Historian(bits, 4 if factored else 1, 0)
+            model = creating.create_model(historian, factored=factored,
+                    min_var_index=None, storage=storage)
+            model.see_generated(bits)
+            models.append(model)
+
+        eq_float_(models[0].get_history_log_p(),
+                models[1].get_history_log_p())
+        eq_float_(models[0].predict_one(), models[1].predict_one())
+
+
+def test_fork():
+    for storage in ctw.STORAGES:
+        for max_depth in [None, 3]:
+            model = ctw.create_model(max_depth=max_depth, storage=storage)
+            model.see_generated(to_bits("0110100"))
+            log_p = model.get_history_log_p()
+            p = model.predict_one()
+
+            forked = model.fork()
+            forked.see_generated(to_bits("1101"))
+            expected = ctw.create_model(max_depth=max_depth)
+            expected.see_generated(to_bits("01101001101"))
+            eq_float_(forked.get_history_log_p(),
+                    expected.get_history_log_p())
+            eq_float_(forked.predict_one(), expected.predict_one())
+
+            forked.revert_generated(6)
+            expected.revert_generated(6)
+            eq_float_(forked.get_history_log_p(),
+                    expected.get_history_log_p())
+            nested = forked.fork()
+            eq_(nested.advance(), expected.advance())
+
+            eq_(model.get_history_log_p(), log_p)
+            eq_(model.predict_one(), p)
+            eq_(list(model.history), to_bits("0110100"))
+
+
+def test_fork_factored():
+    for storage in ctw.STORAGES:
+        model = factored.create_model(max_depth=4, num_factors=3,
+                storage=storage)
+        model.see_generated([1, 0, 0, 1])
+        log_p = model.get_history_log_p()
+        forked = model.fork()
+        forked.see_generated([0, 1, 1])
+        eq_(model.get_history_log_p(), log_p)
+        model.see_generated([0, 1, 1])
+        eq_float_(forked.get_history_log_p(), model.get_history_log_p())
+
+
+def _check_same_see(model, verifier, bits):
+    errors = []
+    for m in [model, verifier]:
+        try:
+            m.see_generated(bits)
+        except ctw.ImpossibleHistoryError:
+            m.revert_generated(1)
+            errors.append(m)
+
+    eq_(len(errors) in [0, 2], True)
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
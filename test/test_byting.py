@@ -17,3 +17,12 @@ def test_to_bytes():
 def test_conversion():
     eq_(byting.to_bytes(byting.to_binseq("hello world")), "hello world")
 
+
+
+def test_packed_conversion():
+    data = "".join(chr(value) for value in xrange(256))
+    bits = byting.to_bits(data)
+    eq_(bits, [int(bit) for bit in byting.to_binseq(data)])
+    eq_(byting.from_bits(bits), data)
+    eq_(byting.to_bits(bytearray("AC")), byting.to_bits(memoryview("AC")))
+    eq_(byting.to_bits(""), [])
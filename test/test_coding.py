@@ -0,0 +1,63 @@
+
+from nose.tools import eq_
+from StringIO import StringIO
+import random
+
+from libctw import coding
+
+
+def _roundtrip(data, **kwargs):
+    compressed = StringIO()
+    eq_(coding.compress(StringIO(data), compressed, **kwargs)[0], len(data))
+    output = StringIO()
+    num_compressed, num_original = coding.decompress(
+            StringIO(compressed.getvalue()), output)
+    eq_(output.getvalue(), data)
+    eq_(num_compressed, len(compressed.getvalue()))
+    eq_(num_original, len(data))
+    return compressed.getvalue()
+
+
+def test_roundtrip():
+    _roundtrip("")
+    _roundtrip("a")
+    _roundtrip("hello world " * 5, max_depth=None)
+    _roundtrip("\x00\xff\x80\x7f" * 3, factored=False)
+    _roundtrip("abracadabra", storage="hashed", memory_budget=2000)
+
+
+def test_random_roundtrip():
+    rand = random.Random(7)
+    data = "".join(chr(rand.randint(0, 255)) for i in xrange(100))
+    _roundtrip(data, max_depth=4)
+
+
+def test_compression():
+    data = "0123456789" * 30
+    compressed = _roundtrip(data)
+    eq_(len(compressed) < len(data) / 4, True)
+
+
+def test_extreme_probabilities():
+    rand = random.Random(8)
+    bits = [rand.randint(0, 1) for i in xrange(500)]
+    probs = [rand.choice([0.0, 1.0, 1e-9, 0.5, 0.999]) for bit in bits]
+    output = StringIO()
+    writer = coding._BitWriter(output)
+    encoder = coding._Encoder(writer)
+    for bit, one_p in zip(bits, probs):
+        encoder.encode(bit, one_p)
+    encoder.finish()
+    writer.flush()
+
+    decoder = coding._Decoder(coding._BitReader(
+        StringIO(output.getvalue())))
+    eq_([decoder.decode(one_p) for one_p in probs], bits)
+
+
+def test_invalid_header():
+    try:
+        coding.decompress(StringIO("ABCD" + "\0" * 20), StringIO())
+        assert False, "ValueError is expected"
+    except ValueError:
+        pass
@@ -0,0 +1,174 @@
+
+from nose.tools import eq_
+import random
+
+from libctw import ctw, factored, instrumenting, compressed_ctw
+from libctw.extracting import PackedHistory, BoundedHistory
+from libctw.formatting import to_bits
+
+from test_ctw import eq_float_, iter_all_seqs
+
+
+def test_see():
+    for determ in [False, True]:
+        for max_depth in [None, 0, 3]:
+            for seq in iter_all_seqs(seq_len=8):
+                model = ctw.create_model(determ, max_depth,
+                        storage="compressed")
+                verifier = ctw.create_model(determ, max_depth)
+                _check_same_see(model, verifier, to_bits(seq))
+
+
+def test_predict_one():
+    for determ in [False, True]:
+        for max_depth in [None, 2]:
+            model = ctw.create_model(determ, max_depth, storage="compressed")
+            verifier = ctw.create_model(determ, max_depth)
+            for bit in to_bits("0110100110111000101"):
+                eq_float_(model.predict_one(), verifier.predict_one())
+                _check_same_see(model, verifier, [bit])
+
+
+def test_predict_without_updating():
+    model = ctw.create_model(storage="compressed")
+    model.see_generated(to_bits("0110100"))
+    num_nodes = instrumenting.count_nodes(model)
+    log_p = model.get_history_log_p()
+    model.predict_one()
+    eq_(instrumenting.count_nodes(model), num_nodes)
+    eq_(model.get_history_log_p(), log_p)
+
+
+def test_advance():
+    model = ctw.create_model(storage="compressed")
+    verifier = ctw.create_model()
+    model.see_generated(to_bits("0110"))
+    verifier.see_generated(to_bits("0110"))
+    for i in xrange(20):
+        bit, p = model.advance()
+        expected_bit, expected_p = verifier.advance()
+        eq_(bit, expected_bit)
+        eq_float_(p, expected_p)
+        eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+
+def test_revert_generated():
+    rand = random.Random(1)
+    bits = [rand.randint(0, 1) for i in xrange(50)]
+    model = ctw.create_model(storage="compressed")
+    model.see_generated(bits[:30])
+    expected_log_p = model.get_history_log_p()
+    num_nodes = instrumenting.count_nodes(model)
+
+    model.see_generated(bits[30:])
+    full_log_p = model.get_history_log_p()
+    model.revert_generated(20)
+    eq_float_(model.get_history_log_p(), expected_log_p)
+    eq_(list(model.history), bits[:30])
+
+    # The other bits don't follow the removed chains.
+    model.see_generated([1 - bit for bit in bits[30:]])
+    model.revert_generated(20)
+    eq_float_(model.get_history_log_p(), expected_log_p)
+    eq_(instrumenting.count_nodes(model) >= num_nodes, True)
+
+    model.see_generated(bits[30:])
+    eq_float_(model.get_history_log_p(), full_log_p)
+
+
+def test_switch_history():
+    model = ctw.create_model(storage="compressed")
+    verifier = ctw.create_model()
+    for seq in ["1101", "110100", "0", "1101001"]:
+        model.switch_history()
+        verifier.switch_history()
+        model.see_added([0])
+        verifier.see_added([0])
+        _check_same_see(model, verifier, to_bits(seq))
+        eq_float_(model.predict_one(), verifier.predict_one())
+
+
+def test_factored():
+    bits = to_bits("011001110110011101100111")
+    model = factored.create_model(num_factors=3, storage="compressed")
+    verifier = factored.create_model(num_factors=3)
+    for bit in bits:
+        eq_float_(model.predict_one(), verifier.predict_one())
+        model.see_generated([bit])
+        verifier.see_generated([bit])
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+
+def test_long_history():
+    rand = random.Random(2)
+    bits = [rand.randint(0, 1) for i in xrange(2000)]
+    model = ctw.create_model(storage="compressed")
+    model.see_generated(bits)
+    # A new context adds at most two nodes.
+    eq_(instrumenting.count_nodes(model) <= 2 * len(bits) + 1, True)
+
+    verifier = ctw.create_model(max_depth=60)
+    verifier.see_generated(bits)
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+
+def test_bounded_history():
+    rand = random.Random(5)
+    bits = [rand.randint(0, 1) for i in xrange(ctw.NUM_REVERTIBLE_BITS + 500)]
+    model = ctw.create_model(max_depth=12, storage="compressed")
+    verifier = ctw.create_model(max_depth=12)
+    eq_(isinstance(model.history, BoundedHistory), True)
+    model.see_generated(bits)
+    verifier.see_generated(bits)
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+    eq_float_(model.predict_one(), verifier.predict_one())
+
+
+def test_repeated_history():
+    rand = random.Random(3)
+    block = [rand.randint(0, 1) for i in xrange(37)]
+    bits = block * 12
+    model = ctw.create_model(storage="compressed")
+    verifier = ctw.create_model()
+    for i in xrange(0, len(bits), 50):
+        eq_float_(model.predict_one(), verifier.predict_one())
+        model.see_generated(bits[i:i + 50])
+        verifier.see_generated(bits[i:i + 50])
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+    # The long repeated contexts are matched by words.
+    model = ctw.create_model(storage="compressed")
+    model.see_generated(block * 60)
+    eq_(instrumenting.count_nodes(model) <= 2 * len(block) * 60 + 1, True)
+
+
+def test_count_common_tail():
+    rand = random.Random(4)
+    bits = [rand.randint(0, 1) for i in xrange(300)]
+    history = PackedHistory(bits + bits[:200])
+    other = PackedHistory(bits[:150])
+    for end1, end2, limit in [(500, 200, 200), (500, 200, 150),
+            (500, 201, 200), (450, 150, 150), (150, 150, 150),
+            (437, 300, 250), (7, 150, 7)]:
+        expected = 0
+        while (expected < limit and history[end1 - 1 - expected] ==
+                history[end2 - 1 - expected]):
+            expected += 1
+        eq_(compressed_ctw._count_common_tail(history, end1, history, end2,
+            limit), expected)
+        if end2 <= len(other):
+            eq_(compressed_ctw._count_common_tail(history, end1, other,
+                end2, limit), expected)
+
+
+def _check_same_see(model, verifier, bits):
+    errors = []
+    for m in [model, verifier]:
+        try:
+            m.see_generated(bits)
+        except ctw.ImpossibleHistoryError:
+            m.revert_generated(1)
+            errors.append(m)
+
+    eq_(len(errors) in [0, 2], True)
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
@@ -2,6 +2,7 @@
 from nose.tools import eq_
 import itertools
 import math
+import random
 
 from libctw import ctw, naive_ctw
 from libctw.formatting import to_bits
@@ -52,6 +53,55 @@ def test_predict_one():
                         precision=10)
 
 
+def test_predict_long_seq():
+    rand = random.Random(5)
+    seq = "".join(rand.choice("0011") for i in xrange(300))
+    for determ in [False, True]:
+        model = ctw.create_model(determ)
+        verifier = naive_ctw.create_model(determ, indexed=True)
+        for i in xrange(0, len(seq), 10):
+            bits = to_bits(seq[i:i + 10])
+            model.see_generated(bits)
+            verifier.see_generated(bits)
+            eq_float_(model.predict_one(), verifier.predict_one(),
+                    precision=10)
+
+
+def test_storages_long_seq():
+    rand = random.Random(6)
+    bits = [rand.randint(0, 1) for i in xrange(2000)]
+    for seq in [bits, bits[:50] * 40]:
+        verifier = naive_ctw.create_model(indexed=True, max_depth=16)
+        models = [ctw.create_model(max_depth=16, storage=storage)
+                for storage in ctw.STORAGES]
+        for i in xrange(0, len(seq), 500):
+            verifier.see_generated(seq[i:i + 500])
+            expected = verifier.predict_one()
+            for model in models:
+                model.see_generated(seq[i:i + 500])
+                eq_float_(model.predict_one(), expected, precision=10)
+
+
+def test_predict_without_updating():
+    for max_depth in [None, 3]:
+        model = ctw.create_model(max_depth=max_depth)
+        model.see_generated(to_bits("0110100"))
+        history = list(model.history)
+        log_p = model.get_history_log_p()
+        num_nodes = _count_nodes(model.root)
+
+        model.predict_one()
+        eq_(list(model.history), history)
+        eq_(model.get_history_log_p(), log_p)
+        eq_(_count_nodes(model.root), num_nodes)
+
+
+def _count_nodes(node):
+    if node is None:
+        return 0
+    return 1 + sum(_count_nodes(child) for child in node.children)
+
+
 def test_max_depth():
     model = ctw.create_model(max_depth=0)
     eq_(_get_history_p(model), 1.0)
@@ -74,6 +124,29 @@ def test_max_depth_sum():
         eq_float_(total, 1.0, precision=15)
 
 
+def test_revert_forgotten():
+    bits = [1, 0, 0] * 2000
+    for storage in ctw.STORAGES:
+        model = ctw.create_model(max_depth=3, storage=storage)
+        model.see_generated(bits)
+        log_p = model.get_history_log_p()
+        p = model.predict_one()
+        try:
+            model.revert_generated(ctw.NUM_REVERTIBLE_BITS + 1)
+            assert False, "ValueError is expected"
+        except ValueError:
+            pass
+        eq_(model.get_history_log_p(), log_p)
+        eq_(model.predict_one(), p)
+        eq_(len(model.history), len(bits))
+
+        model.revert_generated(ctw.NUM_REVERTIBLE_BITS)
+        expected = ctw.create_model(max_depth=3)
+        expected.see_generated(bits[:-ctw.NUM_REVERTIBLE_BITS])
+        eq_float_(model.get_history_log_p(), expected.get_history_log_p(),
+                precision=10)
+
+
 def test_max_depth_example():
     # The calculated probablities are from the
     # 'Reflections on "The Context-Tree Weighting Method: Basic Properties"'
@@ -129,3 +202,74 @@ def _check_estim_update(estim_update, estimator):
 def eq_float_(value, expected, precision=13):
     eq_("%.*f" % (precision, value),
             "%.*f" % (precision, expected))
+
+
+def test_advance():
+    for determ in [False, True]:
+        for max_depth in [None, 2]:
+            model = ctw.create_model(determ, max_depth)
+            verifier = ctw.create_model(determ, max_depth)
+            model.see_generated(to_bits("0010"))
+            verifier.see_generated(to_bits("0010"))
+            for i in xrange(20):
+                bit, p = model.advance()
+                expected_bit, expected_p = ctw.choose_bit(
+                        verifier.predict_one())
+                verifier.see_generated([expected_bit])
+                eq_(bit, expected_bit)
+                eq_float_(p, expected_p)
+                eq_float_(model.get_history_log_p(),
+                        verifier.get_history_log_p())
+
+
+def test_kt_table():
+    for counts in [[0, 0], [3, 5], [0, 127], [200, 7], [1000, 1000]]:
+        for bit in [0, 1]:
+            eq_(ctw._kt_estim_update(bit, counts), math.log(
+                (counts[bit] + 0.5) / float(sum(counts) + 1)))
+
+
+def test_determ_update():
+    eq_(ctw._determ_estim_update(1, [0, 0]), math.log(0.5))
+    eq_(ctw._determ_estim_update(1, [0, 3]), 0.0)
+    eq_(ctw._determ_estim_update(0, [0, 3]), float("-inf"))
+    eq_(ctw._determ_estim_update(1, [2, 3]), float("-inf"))
+
+
+def test_avg_log_p():
+    eq_float_(ctw._avg_log_p(math.log(0.2), math.log(0.4)), math.log(0.3))
+    eq_float_(ctw._avg_log_p(-40.0, 0.0), math.log(0.5))
+    eq_float_(ctw._avg_log_p(-2000.0, -2150.0), math.log(0.5) - 2000.0,
+            precision=10)
+    eq_float_(ctw._avg_log_p(float("-inf"), -3.0), math.log(0.5) - 3.0)
+    assert math.isnan(ctw._avg_log_p(float("-inf"), float("-inf")))
+
+
+def test_fork():
+    for max_depth in [None, 3]:
+        model = ctw.create_model(max_depth=max_depth)
+        model.see_generated(to_bits("0110100"))
+        log_p = model.get_history_log_p()
+        num_nodes = _count_nodes(model.root)
+
+        forked = model.fork()
+        forked.see_generated(to_bits("1101"))
+        expected = ctw.create_model(max_depth=max_depth)
+        expected.see_generated(to_bits("01101001101"))
+        eq_float_(forked.get_history_log_p(), expected.get_history_log_p())
+        eq_float_(forked.predict_one(), expected.predict_one())
+        eq_(list(forked.history), to_bits("01101001101"))
+
+        eq_(model.get_history_log_p(), log_p)
+        eq_(_count_nodes(model.root), num_nodes)
+        eq_(list(model.history), to_bits("0110100"))
+
+        # The bits seen by the base could be reverted by the fork.
+        forked.revert_generated(6)
+        expected.revert_generated(6)
+        eq_float_(forked.get_history_log_p(), expected.get_history_log_p())
+        eq_(model.get_history_log_p(), log_p)
+
+        nested = forked.fork()
+        eq_(nested.advance(), expected.advance())
+        eq_float_(nested.get_history_log_p(), expected.get_history_log_p())
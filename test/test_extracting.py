@@ -1,8 +1,10 @@
 
 from nose.tools import eq_
+import itertools
 
 from libctw.formatting import to_bits
-from libctw.extracting import VarExtractor, Var
+from libctw.extracting import VarExtractor, Var, SuffixExtractor, BoundedHistory
+from libctw.extracting import OverlayHistory, PackedHistory
 
 def test_var_following():
     extractor = VarExtractor(
@@ -43,3 +45,122 @@ def _assert_context(extractor, history_seq, expected_seq):
     eq_(extractor.extract_context(to_bits(history_seq)),
             to_bits(expected_seq))
 
+
+
+def test_extract_reversed():
+    extractor = VarExtractor(Var(-2, (None, Var(-4))), max_depth=3)
+    for seq in ["1", "01", "0010", "11001", "110101"]:
+        bits = to_bits(seq)
+        eq_(list(extractor.extract_reversed(bits)),
+                extractor.extract_context(bits)[::-1])
+
+    extractor = SuffixExtractor(max_depth=2)
+    eq_(list(extractor.extract_reversed(to_bits("1"))), [1])
+    eq_(list(extractor.extract_reversed(to_bits("0110"))), [0, 1])
+    eq_(extractor.extract_reversed(to_bits("0110"))[1], 1)
+
+
+def test_get_max_lookback():
+    eq_(SuffixExtractor(3).get_max_lookback(), 3)
+    eq_(VarExtractor(Var(-2, (None, Var(-5)))).get_max_lookback(), None)
+    eq_(VarExtractor(Var(-2, (None, Var(-5))), 3).get_max_lookback(), 5)
+    eq_(VarExtractor(None, 3).get_max_lookback(), 3)
+
+
+def test_bounded_history():
+    history = BoundedHistory(3)
+    history += [0, 1, 1]
+    history.append(0)
+    eq_(len(history), 4)
+    eq_(list(history), [1, 1, 0])
+    eq_(list(reversed(history)), [0, 1, 1])
+    eq_(history[-3:], [1, 1, 0])
+    eq_(history[1], 1)
+
+    eq_(history.pop(), 0)
+    del history[-1:]
+    eq_(list(history), [1])
+    history.append(1)
+    eq_(history[-2:], [1, 1])
+    try:
+        history[0]
+        assert False, "IndexError is expected"
+    except IndexError:
+        pass
+
+
+def test_compiled_offsets():
+    root_vars = [
+            None,
+            Var(-3),
+            Var(-2, (Var(-1, (None, Var(-4))), Var(-5, (Var(-1), None)))),
+            Var(-1, (Var(-2, (Var(-3), Var(-4))), Var(-6))),
+            ]
+    for root_var in root_vars:
+        for max_depth in [None, 0, 1, 3, 6]:
+            extractor = VarExtractor(root_var, max_depth)
+            for seq_len in xrange(9):
+                for seq in itertools.product("01", repeat=seq_len):
+                    history = to_bits(seq)
+                    eq_(extractor.extract_context(history),
+                            extractor._extract_short_context(history))
+
+
+def test_overlay_history():
+    for base in [[1, 0, 1], BoundedHistory(3, num_forgotten=2)]:
+        if isinstance(base, BoundedHistory):
+            base += [1, 0, 1]
+        history = OverlayHistory(base)
+        history += [0, 0]
+        history.append(1)
+        eq_(len(history), len(base) + 3)
+        eq_(list(history)[-6:], [1, 0, 1, 0, 0, 1])
+        eq_(list(reversed(history))[:6], [1, 0, 0, 1, 0, 1])
+        eq_(history[-4], 1)
+        eq_(history[-3:], [0, 0, 1])
+
+        del history[-4:]
+        eq_(len(history), len(base) - 1)
+        eq_(history.pop(), 0)
+        eq_(history[-1], 1)
+        history.append(0)
+        eq_(list(reversed(history))[:2], [0, 1])
+        eq_(list(base)[-3:], [1, 0, 1])
+
+
+def test_packed_history():
+    bits = to_bits("0110100111010")
+    history = PackedHistory()
+    for length in xrange(len(bits) + 1):
+        expected = bits[:length]
+        eq_(len(history), length)
+        eq_(list(history), expected)
+        eq_(list(reversed(history)), expected[::-1])
+        eq_(history[:], expected)
+        eq_(history[3:-2], expected[3:-2])
+        eq_(history[8:], expected[8:])
+        eq_([history[-i] for i in xrange(1, length + 1)], expected[::-1])
+        if length < len(bits):
+            history.append(bits[length])
+
+    del history[-6:]
+    eq_(list(history), bits[:-6])
+    eq_(history.pop(), bits[-7])
+    history += [1, 1, 1]
+    eq_(list(history), bits[:-7] + [1, 1, 1])
+
+    history = PackedHistory([1, 0, 1, 1, 0, 0, 1, 0])
+    history.extend_bytes("A")
+    eq_(list(history), [1, 0, 1, 1, 0, 0, 1, 0] + to_bits("01000001"))
+    history.append(1)
+    history.extend_bytes(bytearray("A"))
+    eq_(history[-9:], to_bits("101000001"))
+
+
+def test_packed_history_value():
+    bits = to_bits("01101001110100101")
+    history = PackedHistory(bits)
+    for start in xrange(len(bits) + 1):
+        for stop in xrange(start, len(bits) + 1):
+            expected = int("0" + "".join(map(str, bits[start:stop])), 2)
+            eq_(history.get_value(start, stop), expected)
@@ -1,7 +1,9 @@
 
 from nose.tools import eq_
+import math
 
-from libctw import factored
+from libctw import factored, ctw
+from test_ctw import eq_float_
 
 def test_offset():
     model = factored.create_model(num_factors=3)
@@ -33,3 +35,134 @@ def test_revert_generated():
     model.revert_generated(6)
     eq_(model.offset, 0)
     eq_(model.predict_one(), 0.5)
+
+
+def test_advance():
+    model = factored.create_model(deterministic=True, max_depth=2,
+            num_factors=3)
+    model.see_generated([1, 0, 0])
+    model.see_generated([1, 0, 0])
+    eq_(model.advance(), (1, 1.0))
+    eq_(model.offset, 1)
+    eq_(model.advance(), (0, 1.0))
+    eq_(model.advance(), (0, 1.0))
+    eq_(model.offset, 0)
+    eq_([list(ct.history) for ct in model.cts], [[1, 0, 0] * 3] * 3)
+
+
+def test_shared_history():
+    for max_depth in [None, 2]:
+        model = factored.create_model(max_depth=max_depth, num_factors=3)
+        cts = [ctw.create_model(max_depth=max_depth) for i in xrange(3)]
+        bits = [1, 0, 0, 1, 1, 0, 1]
+        model.see_generated(bits)
+        model.see_added([1, 1])
+        for i, bit in enumerate(bits):
+            for j, ct in enumerate(cts):
+                if j == i % len(cts):
+                    ct.see_generated([bit])
+                else:
+                    ct.see_added([bit])
+        for ct in cts:
+            ct.see_added([1, 1])
+
+        for ct in model.cts:
+            assert ct.history is model.history
+        eq_(list(model.history), bits + [1, 1])
+        eq_float_(model.get_history_log_p(),
+                sum(ct.get_history_log_p() for ct in cts))
+
+        model.switch_history()
+        eq_(len(model.history), 0)
+        for ct in model.cts:
+            assert ct.history is model.history
+
+
+def test_shared_bounded_history():
+    model = factored.create_model(max_depth=2, num_factors=2)
+    eq_(model.history.capacity, 2 + ctw.NUM_REVERTIBLE_BITS)
+    model.see_generated([1, 0] * ctw.NUM_REVERTIBLE_BITS)
+
+    restored = factored.create_factored_model(
+            [ctw.create_model(max_depth=2) for i in xrange(2)])
+    restored.cts[0].history = model.history
+    restored = factored.create_factored_model(restored.cts)
+    eq_(len(restored.history), len(model.history))
+    eq_(list(restored.history), list(model.history))
+
+
+def test_predict_distribution():
+    for deterministic in [False, True]:
+        model = factored.create_model(deterministic=deterministic,
+                max_depth=12, num_factors=4)
+        model.see_generated([1, 0, 0, 1] * 3)
+        probs = model.predict_distribution()
+        eq_(len(probs), 16)
+        _check_distribution(model, probs)
+        eq_(factored.get_most_probable(probs, 1)[0][0], 9)
+
+    model.see_generated([1])
+    eq_(len(model.predict_distribution()), 8)
+
+
+def test_predict_impossible_values():
+    model = factored.create_model(deterministic=True, max_depth=0,
+            num_factors=2)
+    model.see_generated([1, 0] * 4)
+    probs = model.predict_distribution()
+    eq_(probs, [0.0, 0.0, 1.0, 0.0])
+    _check_distribution(model, probs)
+
+
+def _check_distribution(model, probs):
+    eq_float_(sum(probs), 1.0)
+    log_p = model.get_history_log_p()
+    num_bits = len(model.cts) - model.offset
+    for value, p in enumerate(probs):
+        expected = 0.0
+        num_seen = 0
+        try:
+            for i in xrange(num_bits - 1, -1, -1):
+                num_seen += 1
+                model.see_generated([(value >> i) & 1])
+            expected = math.exp(model.get_history_log_p() - log_p)
+        except ctw.ImpossibleHistoryError:
+            pass
+        model.revert_generated(num_seen)
+        eq_float_(p, expected)
+        eq_float_(model.get_history_log_p(), log_p)
+
+
+def test_predict_distribution_full_history():
+    model = factored.create_model(max_depth=2, num_factors=4)
+    bits = [1, 0, 0, 1] * (ctw.NUM_REVERTIBLE_BITS // 4 + 10)
+    model.see_generated(bits)
+    history = model.history
+    start = history.start
+    probs = model.predict_distribution()
+    eq_float_(sum(probs), 1.0)
+    eq_(model.history is history, True)
+    eq_(history.start, start)
+    eq_(len(history), len(bits))
+    for ct in model.cts:
+        eq_(ct.history is history, True)
+
+
+def test_get_most_probable():
+    eq_(factored.get_most_probable([0.1, 0.4, 0.1, 0.4], 3),
+            [(1, 0.4), (3, 0.4), (0, 0.1)])
+
+
+def test_fork():
+    model = factored.create_model(max_depth=4, num_factors=3)
+    model.see_generated([1, 0, 0, 1])
+    log_p = model.get_history_log_p()
+    forked = model.fork()
+    forked.see_generated([0, 1, 1])
+    eq_(forked.offset, 1)
+    eq_(model.offset, 1)
+    eq_(model.get_history_log_p(), log_p)
+    eq_(list(model.history), [1, 0, 0, 1])
+
+    model.see_generated([0, 1, 1])
+    eq_float_(forked.get_history_log_p(), model.get_history_log_p())
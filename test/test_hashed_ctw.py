@@ -0,0 +1,81 @@
+
+from nose.tools import eq_
+import math
+import random
+
+from libctw import ctw, factored, hashed_ctw
+from libctw.formatting import to_bits
+
+from test_ctw import eq_float_, iter_all_seqs
+
+
+def _create_model(num_slots, deterministic=False, max_depth=None):
+    return ctw.create_model(deterministic, max_depth, storage="hashed",
+            memory_budget=num_slots * hashed_ctw.BYTES_PER_NODE)
+
+
+def test_big_table():
+    rand = random.Random(2)
+    bits = [rand.randint(0, 1) for i in xrange(200)]
+    for determ in [False, True]:
+        model = _create_model(10000, determ, max_depth=6)
+        verifier = ctw.create_model(determ, max_depth=6)
+        for bit in bits:
+            eq_float_(model.predict_one(), verifier.predict_one())
+            try:
+                verifier.see_generated([bit])
+            except ctw.ImpossibleHistoryError:
+                break
+            model.see_generated([bit])
+
+        eq_(model.get_table_stats()["num_dropped"], 0)
+
+
+def test_small_table_p_sum():
+    for seq_len in [6, 9]:
+        total = 0.0
+        for seq in iter_all_seqs(seq_len):
+            model = _create_model(7)
+            model.see_generated(to_bits(seq))
+            total += math.exp(model.get_history_log_p())
+
+        eq_float_(total, 1.0)
+
+
+def test_small_table_predict():
+    rand = random.Random(3)
+    model = _create_model(30)
+    for i in xrange(300):
+        one_p = model.predict_one()
+        log_p = model.get_history_log_p()
+        model.see_generated([1])
+        eq_float_(math.exp(model.get_history_log_p() - log_p), one_p)
+        model.revert_generated(1)
+        model.see_generated([rand.randint(0, 1)])
+
+    stats = model.get_table_stats()
+    eq_(stats["num_slots"], 30)
+    eq_(stats["num_nodes"], 30)
+    eq_(stats["num_dropped"] > 0, True)
+    eq_(stats["num_collisions"] > 0, True)
+
+
+def test_advance():
+    model = _create_model(20)
+    verifier = _create_model(20)
+    model.see_generated(to_bits("0110"))
+    verifier.see_generated(to_bits("0110"))
+    for i in xrange(50):
+        bit, p = model.advance()
+        expected_bit, expected_p = ctw.choose_bit(verifier.predict_one())
+        verifier.see_generated([expected_bit])
+        eq_(bit, expected_bit)
+        eq_float_(p, expected_p)
+
+
+def test_factored():
+    model = factored.create_model(max_depth=4, num_factors=2,
+            storage="hashed", memory_budget=10 * hashed_ctw.BYTES_PER_NODE)
+    model.see_generated(to_bits("01100111011001110"))
+    for ct in model.cts:
+        eq_(ct.get_table_stats()["num_slots"], 10)
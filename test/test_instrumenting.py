@@ -0,0 +1,89 @@
+
+from nose.tools import eq_
+from StringIO import StringIO
+import json
+
+from libctw import ctw, factored, instrumenting, extracting
+from test_ctw import eq_float_
+
+
+def _get_calls(stats, timer_name):
+    return stats["timers"][timer_name]["calls"]
+
+
+def test_instrument():
+    model = ctw.create_model(max_depth=3)
+    recorder = instrumenting.instrument(model)
+    model.see_generated([1, 0, 1, 1])
+    p = model.predict_one()
+
+    stats = recorder.get_stats()
+    eq_(_get_calls(stats, "update"), 4)
+    eq_(_get_calls(stats, "extract"), 5)
+    eq_(_get_calls(stats, "predict"), 1)
+    eq_(stats["histograms"]["context_length"],
+            [(0, 1), (1, 1), (2, 1), (3, 2)])
+    eq_(stats["histograms"]["path_length"], [(1, 1), (2, 1), (3, 1), (4, 1)])
+    eq_(stats["num_nodes"], instrumenting.count_nodes(model))
+    eq_(stats["history_length"], 4)
+    eq_(stats["memory"] > 0, True)
+
+    recorder.detach()
+    eq_(model.predict_one(), p)
+    model.see_generated([0])
+    eq_(_get_calls(recorder.get_stats(), "update"), 4)
+    eq_("_update_path" in model.__dict__, False)
+
+
+def test_same_predictions():
+    for storage in ctw.STORAGES:
+        plain = ctw.create_model(max_depth=4, storage=storage)
+        model = ctw.create_model(max_depth=4, storage=storage)
+        instrumenting.instrument(model)
+        for bit in [1, 0, 0, 1, 1, 1, 0, 1]:
+            eq_float_(model.predict_one(), plain.predict_one())
+            plain.see_generated([bit])
+            model.see_generated([bit])
+        eq_(model.advance(), plain.advance())
+        model.revert_generated(3)
+        plain.revert_generated(3)
+        eq_float_(model.get_history_log_p(), plain.get_history_log_p())
+
+
+def test_impossible_history():
+    model = ctw.create_model(deterministic=True, max_depth=0)
+    recorder = instrumenting.instrument(model)
+    model.see_generated([1])
+    try:
+        model.see_generated([0])
+        assert False, "ImpossibleHistoryError is expected"
+    except ctw.ImpossibleHistoryError:
+        pass
+    eq_(recorder.get_stats()["counters"], {"ImpossibleHistoryError": 1})
+
+
+def test_var_extractor():
+    root_var = extracting.Var(-2, (extracting.Var(-1), None))
+    model = ctw.create_context_based_model(extracting.VarExtractor(root_var))
+    recorder = instrumenting.instrument(model)
+    model.see_generated([1, 0, 1, 1])
+    eq_(_get_calls(recorder.get_stats(), "extract_short") > 0, True)
+
+
+def test_factored():
+    model = factored.create_model(max_depth=2, num_factors=2)
+    recorder = instrumenting.instrument(model)
+    model.see_generated([1, 0, 1, 1, 0])
+
+    stats = recorder.get_stats()
+    eq_(len(stats["factors"]), 2)
+    eq_(_get_calls(stats, "update"), 5)
+    eq_([_get_calls(factor, "update") for factor in stats["factors"]], [3, 2])
+    eq_(stats["num_nodes"], instrumenting.count_nodes(model))
+
+    output = StringIO()
+    recorder.dump(output)
+    eq_(json.loads(output.getvalue())["num_nodes"], stats["num_nodes"])
+
+    recorder.reset()
+    eq_(recorder.get_stats()["timers"], {})
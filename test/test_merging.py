@@ -0,0 +1,113 @@
+
+from nose.tools import eq_, raises
+import random
+
+from libctw import ctw, factored, merging, storing
+
+from test_ctw import eq_float_
+
+
+def _get_sequences(seed, num_sequences):
+    rand = random.Random(seed)
+    return [[rand.randint(0, 1) for i in xrange(rand.randint(0, 60))]
+            for j in xrange(num_sequences)]
+
+
+def _train(model, sequences):
+    for seq in sequences:
+        model.switch_history()
+        model.see_generated(seq)
+    model.switch_history()
+    return model
+
+
+def _eq_trees(model, expected):
+    nodes = storing.get_node_arrays(model)
+    expected_nodes = storing.get_node_arrays(expected)
+    eq_(len(nodes), len(expected_nodes))
+    for column, expected_column in zip(nodes.get_columns(),
+            expected_nodes.get_columns()):
+        for value, expected_value in zip(column, expected_column):
+            eq_float_(value, expected_value, precision=10)
+
+
+def test_merge():
+    for deterministic in [False, True]:
+        for max_depth in [None, 5]:
+            sequences = _get_sequences(max_depth, 6)
+            if deterministic:
+                sequences = [[1] * len(seq) for seq in sequences]
+            create = lambda: ctw.create_model(deterministic, max_depth)
+            expected = _train(create(), sequences)
+
+            model = _train(create(), sequences[:2])
+            merging.merge(model, _train(create(), sequences[2:5]))
+            merging.merge(model, _train(create(), sequences[5:]))
+            _eq_trees(model, expected)
+            eq_float_(model.predict_one(), expected.predict_one())
+
+
+def test_merge_other_storages():
+    sequences = _get_sequences(1, 4)
+    expected = _train(ctw.create_model(max_depth=8), sequences)
+    for storage in ["arrays", "hashed"]:
+        model = _train(ctw.create_model(max_depth=8), sequences[:1])
+        merging.merge(model, _train(ctw.create_model(max_depth=8,
+            storage=storage), sequences[1:]))
+        _eq_trees(model, expected)
+
+
+def test_merge_factored():
+    sequences = [bits[:len(bits) - len(bits) % 8]
+            for bits in _get_sequences(2, 5)]
+    expected = _train(factored.create_model(max_depth=4), sequences)
+    model = _train(factored.create_model(max_depth=4), sequences[:3])
+    merging.merge(model, _train(factored.create_model(max_depth=4),
+        sequences[3:]))
+    for ct, expected_ct in zip(model.cts, expected.cts):
+        _eq_trees(ct, expected_ct)
+
+
+@raises(ctw.ImpossibleHistoryError)
+def test_merge_impossible():
+    model = _train(ctw.create_model(True, 1), [[0, 0, 0]])
+    merging.merge(model, _train(ctw.create_model(True, 1), [[0, 1, 0]]))
+
+
+@raises(ctw.ImpossibleHistoryError)
+def test_train_sharded_impossible():
+    merging.train_sharded(ctw.create_model(True, 1),
+            [[0, 0, 0], [0, 1, 0]], num_processes=2)
+
+
+@raises(ValueError)
+def test_merge_different_depths():
+    merging.merge(ctw.create_model(max_depth=4), ctw.create_model())
+
+
+@raises(ValueError)
+def test_merge_into_arrays():
+    merging.merge(ctw.create_model(storage="arrays"), ctw.create_model())
+
+
+def test_split_to_shards():
+    sequences = [[0] * 5, [1] * 3, [0] * 4, [1] * 2]
+    shards = merging._split_to_shards(sequences, 2)
+    eq_([sum(len(seq) for seq in shard) for shard in shards], [7, 7])
+    eq_(len(merging._split_to_shards(sequences, 10)), 4)
+
+
+def test_train_sharded():
+    sequences = _get_sequences(3, 7)
+    expected = _train(ctw.create_model(max_depth=6), sequences)
+    model = ctw.create_model(max_depth=6)
+    merging.train_sharded(model, sequences, num_processes=3)
+    _eq_trees(model, expected)
+    eq_(len(model.history), 0)
+
+    sequences = [bits[:len(bits) - len(bits) % 8] for bits in sequences]
+    expected = _train(factored.create_model(max_depth=6), sequences)
+    model = factored.create_model(max_depth=6)
+    merging.train_sharded(model, sequences, num_processes=2)
+    for ct, expected_ct in zip(model.cts, expected.cts):
+        _eq_trees(ct, expected_ct)
@@ -1,8 +1,10 @@
 
 from nose.tools import eq_
 import itertools
+import math
 
 from libctw import naive_ctw as ctw
+from test_ctw import eq_float_
 
 ESTIMATORS = [ctw._estim_kt_p, ctw._estim_determ_p]
 
@@ -72,3 +74,38 @@ def _check_p_sum(p_func):
 
         eq_(total, 1.0, "%s != 1.0, probabilities: %s" % (total, parts))
 
+
+
+def test_indexed_calc_p():
+    for estimator in ESTIMATORS:
+        for max_depth in [None, 0, 3]:
+            calc_p = ctw._Contexted(estimator, max_depth).calc_p
+            indexed_calc_p = ctw._IndexedContexted(estimator,
+                    max_depth).calc_p
+            for seq_len in xrange(10):
+                for seq in itertools.product("01", repeat=seq_len):
+                    seq = "".join(seq)
+                    for context in ["", "0", "11", "010"]:
+                        if max_depth is not None and (
+                                len(context) > max_depth):
+                            continue
+                        p = calc_p(context, seq)
+                        assert abs(indexed_calc_p(context, seq) - p) <= (
+                                1e-13 * p), (context, seq)
+
+
+def test_indexed_long_seq():
+    calc_log_p = ctw._IndexedContexted(ctw._estim_kt_p).calc_log_p
+    for seq in ["01" * 5000, "0110100" * 1500]:
+        log_p = calc_log_p("", seq)
+        assert -50 < log_p < 0
+        eq_float_(calc_log_p("", seq + "0") - log_p,
+                math.log(1 - math.exp(calc_log_p("", seq + "1") - log_p)),
+                precision=10)
+
+
+def test_estim_kt_p_large_counts():
+    assert 0 < ctw._estim_kt_p(300, 200) < ctw._estim_kt_p(30, 20)
+    exact = ctw._estim_kt_p(100, 70)
+    eq_float_(ctw._estim_kt_p(101, 70) / exact,
+            (100 + 0.5) / (170 + 1), precision=10)
@@ -0,0 +1,88 @@
+
+from nose.tools import eq_
+
+from libctw import ctw, factored, pooling
+from test_ctw import eq_float_
+
+
+def test_one_session():
+    for storage in ctw.STORAGES:
+        model = ctw.create_model(max_depth=4, storage=storage)
+        pool = pooling.SessionPool(ctw.create_model(max_depth=4,
+            storage=storage))
+        session_id = pool.open_session()
+        for bit in [1, 0, 1, 1, 0, 0, 1]:
+            eq_float_(pool.predict_one(session_id), model.predict_one())
+            pool.see_generated(session_id, [bit])
+            pool.flush()
+            model.see_generated([bit])
+        eq_float_(pool.model.get_history_log_p(), model.get_history_log_p())
+
+
+def test_pending_bits():
+    model = ctw.create_model(max_depth=3)
+    pool = pooling.SessionPool(ctw.create_model(max_depth=3))
+    first = pool.open_session()
+    second = pool.open_session()
+    pool.see_generated(first, [1, 1, 0])
+    pool.see_generated(second, [0, 1])
+    pool.see_generated(first, [1])
+
+    # The tree is not updated yet, but the contexts are.
+    model.see_added([1, 1, 0, 1])
+    eq_float_(pool.predict_one(first), model.predict_one())
+    eq_(pool.predict_many([second, first]),
+            [pool.predict_one(second), pool.predict_one(first)])
+
+    pool.flush()
+    model = ctw.create_model(max_depth=3)
+    model.see_generated([1, 1, 0, 1])
+    model.switch_history()
+    model.see_generated([0, 1])
+    eq_float_(pool.model.get_history_log_p(), model.get_history_log_p())
+    eq_float_(pool.predict_one(second), model.predict_one())
+
+    pool.see_added(first, [0])
+    pool.close_session(second)
+    eq_(pool.get_num_sessions(), 1)
+    eq_(list(pool.sessions[first].history), [1, 1, 0, 1, 0])
+
+
+def test_factored_sessions():
+    model = factored.create_model(max_depth=2, num_factors=3)
+    pool = pooling.SessionPool(factored.create_model(max_depth=2,
+        num_factors=3))
+    first = pool.open_session()
+    second = pool.open_session()
+    bits = [1, 0, 0, 1, 1, 0, 1]
+    for i, bit in enumerate(bits):
+        pool.see_generated(first, [bit])
+        pool.see_generated(second, [1 - bit])
+        if i % 3 == 0:
+            pool.flush()
+    pool.flush()
+
+    for session_bits in [bits, [1 - bit for bit in bits]]:
+        model.switch_history()
+        model.see_generated(session_bits)
+    eq_float_(pool.model.get_history_log_p(), model.get_history_log_p())
+    eq_float_(pool.predict_one(second), model.predict_one())
+
+
+def test_many_pending_bits():
+    bits = [0, 1] * (ctw.NUM_REVERTIBLE_BITS // 2 + 50)
+    model = ctw.create_model(max_depth=4)
+    pool = pooling.SessionPool(ctw.create_model(max_depth=4))
+    first = pool.open_session()
+    second = pool.open_session()
+    pool.see_generated(second, [1])
+    pool.see_generated(first, bits)
+    eq_(pool.sessions[first].num_pending <= pooling.MAX_PENDING_BITS, True)
+    pool.flush()
+    eq_(pool.pending_ids, [])
+
+    model.see_generated(bits)
+    model.switch_history()
+    model.see_generated([1])
+    eq_float_(pool.model.get_history_log_p(), model.get_history_log_p())
+    eq_(len(pool.sessions[first].history), len(bits))
@@ -0,0 +1,63 @@
+
+from nose.tools import eq_
+import itertools
+
+from libctw import ctw, factored, searching
+from test_ctw import eq_float_
+
+
+def _get_continuation_p(model, bits):
+    log_p = model.get_history_log_p()
+    model.see_generated(bits)
+    p = ctw.math.exp(model.get_history_log_p() - log_p)
+    model.revert_generated(len(bits))
+    return p
+
+
+def test_exhaustive_search():
+    model = ctw.create_model(max_depth=3)
+    model.see_generated([0, 1, 1, 0, 1, 1, 0, 1, 0])
+    log_p = model.get_history_log_p()
+    num_bits = 4
+    # The beam keeps all continuations.
+    results = searching.search(model, num_bits, beam_width=2**num_bits,
+            num_results=3)
+    eq_float_(model.get_history_log_p(), log_p)
+
+    expected = sorted(((_get_continuation_p(model, list(bits)), list(bits))
+        for bits in itertools.product([0, 1], repeat=num_bits)),
+        key=lambda pair: (-pair[0], [-bit for bit in pair[1]]))[:3]
+    eq_([bits for bits, p in results], [bits for p, bits in expected])
+    for (bits, p), (expected_p, expected_bits) in zip(results, expected):
+        eq_float_(p, expected_p)
+
+
+def test_greedy_search():
+    model = ctw.create_model(max_depth=4)
+    model.see_generated([1, 0, 0] * 3)
+    results = searching.search(model, 5, beam_width=1)
+    greedy = [model.advance()[0] for i in xrange(5)]
+    eq_(results[0][0], greedy)
+
+
+def test_greedy_ties():
+    for max_depth in [None, 2]:
+        model = ctw.create_model(max_depth=max_depth)
+        results = searching.search(model, 3, beam_width=1)
+        greedy = [model.advance()[0] for i in xrange(3)]
+        eq_(greedy, [1, 1, 1])
+        eq_(results[0][0], greedy)
+
+    model = factored.create_model(max_depth=2, num_factors=2)
+    results = searching.search(model, 4, beam_width=1)
+    eq_(results[0][0], [model.advance()[0] for i in xrange(4)])
+
+
+def test_determ_search():
+    model = factored.create_model(deterministic=True, max_depth=2,
+            num_factors=3)
+    model.see_generated([1, 0, 0] * 2)
+    results = searching.search(model, 6, beam_width=4, num_results=10)
+    eq_(results[0], ([1, 0, 0, 1, 0, 0], 1.0))
+    eq_(len(results), 1)
+    eq_(searching.search(model, 0), [([], 1.0)])
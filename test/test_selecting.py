@@ -0,0 +1,125 @@
+
+from nose.tools import eq_
+import random
+import multiprocessing
+
+from libctw import byting, formatting
+from libctw.anycontext import selecting, creating
+
+
+def _naive_choose_split(history, positions, var_indexes):
+    best = (None, None, None)
+    min_complexity = None
+    for var_index in var_indexes:
+        on_0 = selecting._filter_poss(history, positions, var_index, 0)
+        on_1 = selecting._filter_poss(history, positions, var_index, 1)
+        complexity = (_naive_complexity(history, on_0) +
+                _naive_complexity(history, on_1))
+        if min_complexity is None or complexity < min_complexity:
+            min_complexity = complexity
+            best = (var_index, on_0, on_1)
+    return best
+
+
+def _naive_complexity(history, positions):
+    num_positive = sum(history[pos] for pos in positions)
+    return selecting._get_complexity(len(positions), num_positive)
+
+
+def test_count_ones():
+    history = [1, 0, 1, 1, 0, 1]
+    correlator = selecting._Correlator(history)
+    eq_(correlator.count_ones([]), [0] * 7)
+    eq_(correlator.count_ones([5]), [1, 0, 1, 1, 0, 1, 0])
+    eq_(correlator.count_ones([1, 3, 5]), [2, 2, 1, 2, 0, 1, 0])
+    eq_(selecting._Correlator([]).count_ones([]), [0])
+
+
+def test_choose_split():
+    rand = random.Random(3)
+    for i in xrange(200):
+        length = rand.randint(0, 40)
+        period = rand.randint(1, 6)
+        pattern = [rand.randint(0, 1) for j in xrange(period)]
+        history = [pattern[j % period] ^ (rand.random() < 0.1)
+                for j in xrange(length)]
+        positions = sorted(rand.sample(xrange(length),
+            rand.randint(0, length)))
+        var_indexes = range(-1, -length - 1, -1)
+        rand.shuffle(var_indexes)
+        eq_(selecting._choose_split(history, positions, var_indexes),
+                _naive_choose_split(history, positions, var_indexes))
+
+
+def test_select_vartree():
+    history = [0, 1, 1] * 10
+    root_var = selecting.select_vartree(history, range(len(history)))
+    eq_(root_var.index, -3)
+    eq_(selecting.select_vartree(history, []), None)
+
+
+def _describe(var):
+    if var is None:
+        return None
+    return (var.index, _describe(var.children[0]), _describe(var.children[1]))
+
+
+def test_parallel_select_vartree():
+    rand = random.Random(4)
+    history = [rand.randint(0, 1) for i in xrange(200)]
+    positions = range(0, len(history), 3)
+    pool = multiprocessing.Pool(2)
+    try:
+        for max_depth in [1, 2, 4]:
+            eq_(_describe(selecting.select_vartree(history, positions,
+                vartree_max_depth=max_depth, pool=pool)),
+                _describe(selecting.select_vartree(history, positions,
+                    vartree_max_depth=max_depth)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_parallel_create_model():
+    history = formatting.to_bits(byting.to_binseq("abcabdabeabf" * 3))
+    for factored in [False, True]:
+        num_generated_bits = 8 if factored else 1
+        historian = creating.Historian(history, num_generated_bits, 0)
+        serial = creating.create_model(historian, factored=factored)
+        parallel = creating.create_model(historian, factored=factored,
+                num_processes=2)
+        serial.see_generated(history)
+        parallel.see_generated(history)
+        eq_(parallel.get_history_log_p(), serial.get_history_log_p())
+
+
+def test_historian():
+    history = formatting.to_bits("011" "100" "010")
+    historian = creating.Historian(history, 2, 1)
+    eq_(list(historian.get_generated_positions()), [0, 1, 3, 4, 6, 7])
+    eq_(historian.get_generated_positions()[-1], 7)
+    eq_(map(list, historian.get_factored_positions()), [[0, 3, 6],
+        [1, 4, 7]])
+    eq_(list(historian.get_steps()), [([0, 1], [1]), ([1, 0], [0]),
+        ([0, 1], [0])])
+
+    positions = historian.get_generated_positions()
+    historian.append_step([1, 1], [0])
+    eq_(len(positions), 6)
+    eq_(list(historian.get_generated_positions())[-2:], [9, 10])
+    eq_(historian.get_steps()[-1], ([1, 1], [0]))
+    eq_(len(history), 12)
+
+
+def test_historian_select_appended():
+    history = formatting.to_bits(byting.to_binseq("abcabdabeabf"))
+    historian = creating.Historian([], 8, 0)
+    for i in xrange(0, len(history), 8):
+        historian.append_step(history[i:i + 8])
+    expected = creating.Historian(history, 8, 0)
+    eq_(_describe(selecting.select_vartree(historian.get_history(),
+        historian.get_generated_positions())),
+        _describe(selecting.select_vartree(history,
+            range(len(history)))))
+    eq_(map(list, historian.get_factored_positions()),
+            map(list, expected.get_factored_positions()))
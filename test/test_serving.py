@@ -0,0 +1,164 @@
+import json
+import socket
+
+from nose.tools import eq_
+
+from libctw import ctw, byting, factored, formatting, serving
+from test_ctw import eq_float_
+
+
+def _create_registry(**kwargs):
+    registry = serving.ModelRegistry()
+    request = dict(op="create", model="m", depth=4)
+    request.update(kwargs)
+    eq_(registry.execute(request), dict(id=None, ok=True, result="m"))
+    return registry
+
+
+def test_see_and_predict():
+    registry = _create_registry()
+    model = ctw.create_model(max_depth=4)
+    for op, seq in [("see_generated", "0110"), ("see_added", "11"),
+            ("see_generated", "1")]:
+        response = registry.execute(dict(op=op, model="m", bits=seq))
+        eq_(response["result"], len(seq))
+        getattr(model, op)([int(bit) for bit in seq])
+
+        response = registry.execute(dict(op="predict", model="m"))
+        eq_float_(response["result"], model.predict_one())
+
+
+def test_generate():
+    registry = _create_registry()
+    model = ctw.create_model(max_depth=4)
+    registry.execute(dict(op="see_generated", model="m", bits="010101"))
+    model.see_generated([0, 1, 0, 1, 0, 1])
+
+    response = registry.execute(dict(op="generate", model="m", num_bits=5))
+    bits = []
+    p = 1.0
+    for i in xrange(5):
+        bit, bit_p = model.advance()
+        bits.append(bit)
+        p *= bit_p
+    eq_(response["result"]["bits"], formatting.to_seq(bits))
+    eq_float_(response["result"]["p"], p)
+
+
+def test_top_bytes():
+    registry = _create_registry(bytes=True)
+    model = factored.create_model(max_depth=4)
+    registry.execute(dict(op="see_generated", model="m", bytes=u"abab"))
+    model.see_generated(formatting.to_bits(byting.to_binseq("abab")))
+
+    response = registry.execute(dict(op="predict", model="m", top=2))
+    expected = factored.get_most_probable(model.predict_distribution(), 2)
+    eq_([value for value, p in response["result"]],
+            [value for value, p in expected])
+
+
+def test_batch():
+    registry = _create_registry()
+    registry.execute(dict(op="create", model="other"))
+    requests = [
+            dict(id=1, op="predict", model="m"),
+            dict(id=2, op="see_generated", model="other", bits="1"),
+            dict(id=3, op="see_generated", model="m", bits="1"),
+            dict(id=4, op="predict", model="m"),
+            dict(id=5, op="predict", model="other"),
+            ]
+    responses = registry.execute_batch(requests)
+    eq_([response["id"] for response in responses], [1, 2, 3, 4, 5])
+
+    model = ctw.create_model(max_depth=4)
+    eq_float_(responses[0]["result"], model.predict_one())
+    model.see_generated([1])
+    eq_float_(responses[3]["result"], model.predict_one())
+    model = ctw.create_model()
+    model.see_generated([1])
+    eq_float_(responses[4]["result"], model.predict_one())
+
+
+def test_errors():
+    registry = _create_registry()
+    for request in [dict(op="predict", model="unknown"),
+            dict(op="unknown", model="m"),
+            dict(op="create", model="m"),
+            dict(op="see_generated", model="m", bits="012"),
+            dict(op="generate", model="m"),
+            dict(op="predict", model="m", top=2),
+            "invalid"]:
+        response = registry.execute(request)
+        eq_(response["ok"], False)
+        assert response["error"]
+
+    registry.execute(dict(op="create", model="d", estimator="determ"))
+    for request in [dict(op="see_generated", model="d", bits="011"),
+            dict(op="switch_history", model="d"),
+            dict(op="see_generated", model="d", bits="01")]:
+        eq_(registry.execute(request)["ok"], True)
+    response = registry.execute(dict(op="see_generated", model="d", bits="0"))
+    eq_(response["ok"], False)
+    eq_(registry.execute(dict(op="list"))["result"], ["d", "m"])
+
+
+def test_invalid_numbers():
+    registry = _create_registry()
+    for request in [dict(op="generate", model="m", num_bits=10**20),
+            dict(op="generate", model="m", num_bits=-1),
+            dict(op="generate", model="m", num_bits="8"),
+            dict(op="create", model="n", depth=-1),
+            dict(op="create", model="n", depth=2.5),
+            dict(op="create", model="n", memory="64"),
+            dict(op="create", model="n", memory=0),
+            dict(op="create", model="n", memory=10**20)]:
+        response = registry.execute(request)
+        eq_(response["ok"], False)
+        assert response["error"]
+    eq_(registry.execute(dict(op="list"))["result"], ["m"])
+
+
+def test_unexpected_error():
+    registry = _create_registry()
+    # A broken model raises AttributeError.
+    registry.models["broken"] = None
+    responses = registry.execute_batch([
+        dict(op="see_generated", model="broken", bits="01"),
+        dict(op="predict", model="m")])
+    eq_(responses[0]["ok"], False)
+    eq_(responses[1]["ok"], True)
+
+
+def test_server():
+    server = serving.Server(("127.0.0.1", 0))
+    client = socket.create_connection(server.socket.getsockname())
+    try:
+        lines = [
+                dict(id=1, op="create", model="m"),
+                dict(id=2, op="see_generated", model="m", bits="11"),
+                dict(id=3, op="predict", model="m"),
+                ]
+        client.sendall("".join(json.dumps(line) + "\n" for line in lines)
+                + "not json\n")
+
+        responses = []
+        received = ""
+        while len(responses) < len(lines) + 1:
+            server.poll(timeout=0.1)
+            client.settimeout(0.1)
+            try:
+                received += client.recv(4096)
+            except socket.timeout:
+                continue
+            parts = received.split("\n")
+            received = parts.pop()
+            responses += [json.loads(part) for part in parts]
+    finally:
+        client.close()
+        server.close()
+
+    eq_([response["ok"] for response in responses], [True, True, True, False])
+    eq_(responses[3]["error"], "A request has to be a JSON object.")
+    model = ctw.create_model()
+    model.see_generated([1, 1])
+    eq_float_(responses[2]["result"], model.predict_one())
@@ -0,0 +1,99 @@
+
+from nose.tools import eq_
+import os
+import random
+import shutil
+import tempfile
+
+from libctw import ctw, factored, storing
+from libctw.anycontext import creating
+
+from test_ctw import eq_float_
+
+
+class _TempDir:
+    def __init__(self):
+        self.path = tempfile.mkdtemp()
+
+    def get_filename(self, name):
+        return os.path.join(self.path, name)
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+
+def _get_bits(seed, num_bits):
+    rand = random.Random(seed)
+    return [rand.randint(0, 1) for i in xrange(num_bits)]
+
+
+def test_save_load():
+    bits = _get_bits(1, 200)
+    temp_dir = _TempDir()
+    try:
+        for storage in ctw.STORAGES:
+            for max_depth in [None, 5]:
+                model = ctw.create_model(max_depth=max_depth,
+                        storage=storage)
+                model.see_generated(bits)
+                filename = temp_dir.get_filename("model.ctw")
+                storing.save(model, filename)
+
+                loaded = storing.load(filename)
+                _check_same_future(model, loaded, _get_bits(2, 30))
+    finally:
+        temp_dir.remove()
+
+
+def test_load_determ_var_model():
+    bits = _get_bits(3, 160)
+    historian = creating.Historian(bits, 1, 0)
+    model = creating.create_model(historian, deterministic=True,
+            min_var_index=None, max_depth=4)
+    model.see_added(bits)
+    temp_dir = _TempDir()
+    try:
+        filename = temp_dir.get_filename("model.ctw")
+        storing.save(model, filename)
+        loaded = storing.load(filename)
+        eq_(storing.get_estimator_name(loaded.estim_update), "determ")
+        eq_(len(loaded.history), len(bits))
+        eq_(loaded.extractor.extract_context(loaded.history),
+                model.extractor.extract_context(model.history))
+    finally:
+        temp_dir.remove()
+
+
+def test_save_factored():
+    bits = _get_bits(4, 83)
+    model = factored.create_model(max_depth=6, num_factors=4)
+    model.see_generated(bits)
+    temp_dir = _TempDir()
+    try:
+        filename = temp_dir.get_filename("model.ctw")
+        storing.save(model, filename)
+        with open(filename, "rb") as input:
+            content = input.read()
+
+        loaded = storing.load(filename)
+        eq_(loaded.offset, model.offset)
+        _check_same_future(model, loaded, _get_bits(5, 40))
+
+        # The updates of a loaded model are not saved to the file.
+        with open(filename, "rb") as input:
+            eq_(input.read(), content)
+
+        storing.save(loaded, temp_dir.get_filename("resaved.ctw"))
+        resaved = storing.load(temp_dir.get_filename("resaved.ctw"))
+        _check_same_future(model, resaved, _get_bits(6, 10))
+    finally:
+        temp_dir.remove()
+
+
+def _check_same_future(model, loaded, bits):
+    eq_float_(loaded.get_history_log_p(), model.get_history_log_p())
+    for bit in bits:
+        eq_float_(loaded.predict_one(), model.predict_one())
+        model.see_generated([bit])
+        loaded.see_generated([bit])
+    eq_float_(loaded.get_history_log_p(), model.get_history_log_p())
@@ -0,0 +1,60 @@
+
+from nose.tools import eq_
+from StringIO import StringIO
+
+from libctw import ctw, streaming, byting
+from libctw.formatting import to_bits
+
+from test_ctw import eq_float_
+
+
+def test_iter_bit_chunks():
+    input = StringIO("0110\n01 1\n")
+    chunks = streaming.read_chunks(input, chunk_size=3)
+    eq_(list(streaming.iter_bit_chunks(chunks)),
+            [[0, 1, 1], [0, 0], [1, 1]])
+
+
+def test_iter_byte_chunks():
+    chunks = streaming.read_chunks(StringIO("AC"), chunk_size=1)
+    eq_(list(streaming.iter_bit_chunks(chunks, bytes=True)),
+            [to_bits(byting.to_binseq("A")), to_bits(byting.to_binseq("C"))])
+
+
+def test_invalid_bits():
+    chunks = streaming.iter_bit_chunks(["01", "2"])
+    eq_(chunks.next(), [0, 1])
+    try:
+        chunks.next()
+        assert False, "ValueError is expected"
+    except ValueError:
+        pass
+
+
+def test_train():
+    model = ctw.create_model()
+    chunks = streaming.read_chunks(StringIO("01101"), chunk_size=2)
+    eq_(streaming.train(model, streaming.iter_bit_chunks(chunks)), 5)
+
+    verifier = ctw.create_model()
+    verifier.see_generated(to_bits("01101"))
+    eq_float_(model.get_history_log_p(), verifier.get_history_log_p())
+
+
+def test_write_predictions():
+    output = StringIO()
+    streaming.write_predictions(output, [(1, 0.75), (0, 0.5)])
+    eq_(output.getvalue(), "1 0.750000\n0 0.500000\n")
+
+    output = StringIO()
+    bits = to_bits(byting.to_binseq("A"))
+    streaming.write_predictions(output, [(bit, 0.5) for bit in bits],
+            bytes=True)
+    eq_(output.getvalue(), "41" + " 0.500000" * 8 + "\n")
+
+
+def test_iter_predictions():
+    model = ctw.create_model()
+    model.see_generated(to_bits("01101"))
+    predictions = list(streaming.iter_predictions(model, 10))
+    eq_([bit for bit, p in predictions], to_bits("1011011011"))